@@ -0,0 +1,229 @@
+"""
+benchmark_generation.py
+
+End-to-end throughput benchmark of the generation pipeline against the local mock
+endpoint in mock_llm.py (no network access or API key needed).
+
+Runs generate_diverse_training_data (sequential or async) and utils.openai_completion
+against the mock and reports records/sec, p50/p99 call latency as seen by the client
+and the retries the pipeline made (counted per call by its metrics hooks; the SDK's own
+retries are disabled so every retry goes through them).
+
+Run:
+python benchmark_generation.py --mode async --max_concurrency 32 --latency_mean 0.3 --rate_limit_rate 0.05
+"""
+import asyncio
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Optional
+
+import httpx
+
+import generate_instruction_v8 as generator
+import utils
+from llm_cache import ResponseCache
+from llm_client import set_clients
+from metrics import CallMetrics
+from mock_llm import MockLLMConfig, MockLLMServer, percentile
+from rate_limiter import AdaptiveRateLimiter
+
+
+class LatencyRecorder:
+    """httpx event hooks measuring client-side latency of every HTTP call."""
+
+    def __init__(self):
+        self.latencies = []
+
+    def on_request(self, request: httpx.Request):
+        request.extensions["benchmark_start"] = time.perf_counter()
+
+    def on_response(self, response: httpx.Response):
+        start = response.request.extensions.get("benchmark_start")
+        if start is not None:
+            self.latencies.append(time.perf_counter() - start)
+
+    async def aon_request(self, request: httpx.Request):
+        self.on_request(request)
+
+    async def aon_response(self, response: httpx.Response):
+        self.on_response(response)
+
+    def summary(self) -> dict:
+        return {
+            "calls": len(self.latencies),
+            "latency_p50": round(percentile(self.latencies, 50), 4),
+            "latency_p99": round(percentile(self.latencies, 99), 4),
+        }
+
+
+def _summarize(name: str, elapsed: float, records: int, recorder: LatencyRecorder, metrics: CallMetrics,
+               server: MockLLMServer, server_before: dict, limiter: AdaptiveRateLimiter) -> dict:
+    server_after = server.stats()
+    result = {
+        "benchmark": name,
+        "seconds": round(elapsed, 3),
+        "records": records,
+        "records_per_sec": round(records / elapsed, 2) if elapsed > 0 else 0.0,
+        **recorder.summary(),
+        "rate_limited_responses": server_after["rate_limited"] - server_before["rate_limited"],
+        "server_error_responses": server_after["server_errors"] - server_before["server_errors"],
+        "throttled_seconds": limiter.stats()["throttled_seconds"],
+        "retries": metrics.summary(per_cell=False)["retries"],
+    }
+    return result
+
+
+def benchmark_generator(server: MockLLMServer, mode: str, max_concurrency: int, cells_per_call: int,
+                        num_queries: int, repeats: int, stream_output: bool = False) -> dict:
+    """Time one generate_diverse_training_data run over the (repeated) recipe grid."""
+    recorder = LatencyRecorder()
+    limiter = AdaptiveRateLimiter()
+    cache = ResponseCache(mode="bypass")
+    metrics = CallMetrics()
+    set_clients(
+        client=server.make_client(max_retries=0, http_client=httpx.Client(
+            event_hooks={"request": [recorder.on_request], "response": [recorder.on_response]}
+        )),
+        async_client=server.make_async_client(max_retries=0, http_client=httpx.AsyncClient(
+            event_hooks={"request": [recorder.aon_request], "response": [recorder.aon_response]},
+            limits=httpx.Limits(max_connections=max_concurrency)
+        ))
+    )
+    # Repeating the recipe lists scales the grid without changing the prompt shape
+    param_recipes = [f"{recipe} [{i}]" for i in range(repeats) for recipe in generator.all_param_recipes]
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        run_kwargs = dict(
+            prompt_path=str(Path(__file__).parent / "prompt" / "gemini_mindat_prompt_v1.md"),
+            output_dir=output_dir,
+            output_filename="benchmark.json",
+            param_recipes=param_recipes,
+            style_recipes=generator.all_style_recipes,
+            id_prefix="Mindat_benchmark",
+            num_queries_per_combination=num_queries,
+            model_name="mock",
+            rate_limiter=limiter,
+            cache=cache,
+            metrics=metrics,
+            cells_per_call=cells_per_call,
+            stream_output=stream_output,
+        )
+        server_before = server.stats()
+        start = time.perf_counter()
+        if mode == "async":
+            asyncio.run(generator.generate_diverse_training_data_async(max_concurrency=max_concurrency, **run_kwargs))
+        else:
+            generator.generate_diverse_training_data(**run_kwargs)
+        elapsed = time.perf_counter() - start
+        with open(os.path.join(output_dir, "benchmark.json")) as f:
+            records = sum(1 for line in f if line.strip())
+
+    name = f"generator ({mode}{', streamed' if stream_output else ''})"
+    return _summarize(name, elapsed, records, recorder, metrics, server, server_before, limiter)
+
+
+def benchmark_openai_completion(server: MockLLMServer, num_prompts: int, batch_size: int) -> dict:
+    """Time utils.openai_completion over num_prompts independent prompts."""
+    recorder = LatencyRecorder()
+    limiter = AdaptiveRateLimiter()
+    metrics = CallMetrics()
+    set_clients(client=server.make_client(max_retries=0, http_client=httpx.Client(
+        event_hooks={"request": [recorder.on_request], "response": [recorder.on_response]}
+    )))
+    prompts = [f"Benchmark prompt {i}" for i in range(num_prompts)]
+    server_before = server.stats()
+    start = time.perf_counter()
+    completions = utils.openai_completion(
+        prompts,
+        utils.OpenAIDecodingArguments(max_tokens=64),
+        model_name="mock",
+        sleep_time=0.1,
+        batch_size=batch_size,
+        rate_limiter=limiter,
+        cache=ResponseCache(mode="bypass"),
+        metrics=metrics,
+    )
+    elapsed = time.perf_counter() - start
+    return _summarize("openai_completion", elapsed, len(completions), recorder, metrics, server, server_before, limiter)
+
+
+def main(
+    mode: str = "async",
+    max_concurrency: int = 32,
+    cells_per_call: int = 1,
+    num_queries: int = 5,
+    repeats: int = 4,
+    stream_output: bool = False,
+    completion_prompts: int = 50,
+    completion_batch_size: int = 1,
+    latency: str = "lognormal",
+    latency_mean: float = 0.2,
+    latency_spread: float = 0.5,
+    rate_limit_rate: float = 0.0,
+    server_error_rate: float = 0.0,
+    retry_after: float = 0.2,
+    seed: int = 0,
+    output_json: Optional[str] = None,
+):
+    """
+    Run the generation benchmarks against a fresh mock endpoint.
+
+    Args:
+        mode: "async" or "sequential" generator
+        max_concurrency: Requests in flight for the async generator
+        cells_per_call: Recipe cells packed into each generator call
+        num_queries: Queries requested per recipe cell
+        repeats: How many times the 27-cell recipe grid is repeated
+        stream_output: Stream generator responses and write queries as they complete
+        completion_prompts: Prompts sent through utils.openai_completion (0 skips it)
+        completion_batch_size: batch_size passed to utils.openai_completion
+        latency: Mock latency distribution (constant | uniform | lognormal)
+        latency_mean: Mean mock service time in seconds
+        latency_spread: Spread of the latency distribution
+        rate_limit_rate: Share of requests answered with 429
+        server_error_rate: Share of requests answered with 500
+        retry_after: Retry-After seconds on 429 responses
+        seed: Seed for latency and error injection
+        output_json: Optional path to write the results as JSON
+    """
+    config = MockLLMConfig(
+        latency=latency,
+        latency_mean=latency_mean,
+        latency_spread=latency_spread,
+        rate_limit_rate=rate_limit_rate,
+        server_error_rate=server_error_rate,
+        retry_after=retry_after,
+        seed=seed,
+    )
+    results = []
+    with MockLLMServer(config) as server:
+        results.append(benchmark_generator(
+            server, mode, max_concurrency, cells_per_call, num_queries, repeats, stream_output
+        ))
+        if completion_prompts:
+            results.append(benchmark_openai_completion(server, completion_prompts, completion_batch_size))
+
+    print("\n" + "=" * 60)
+    print("BENCHMARK RESULTS")
+    print("=" * 60)
+    for result in results:
+        print(f"{result['benchmark']}: {result['records']} records in {result['seconds']:.2f}s "
+              f"({result['records_per_sec']:.1f} records/sec)")
+        print(f"  calls: {result['calls']}, latency p50: {result['latency_p50'] * 1000:.0f} ms, "
+              f"p99: {result['latency_p99'] * 1000:.0f} ms")
+        print(f"  retries: {result['retries']} (server answered {result['rate_limited_responses']} x 429, "
+              f"{result['server_error_responses']} x 5xx), throttled: {result['throttled_seconds']:.1f}s")
+    if output_json:
+        with open(output_json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to: {output_json}")
+    return results
+
+
+if __name__ == "__main__":
+    import fire
+
+    fire.Fire(main)
@@ -0,0 +1,98 @@
+"""
+benchmark_imports.py
+
+Cold-start import-time benchmark for the repo's modules.
+
+Each module is imported in a fresh interpreter several times; the script reports the
+median import time and whether the import pulled in the openai/httpx client stack.
+
+Run:
+python benchmark_imports.py --repeats 7 --output_json output/import_times.json
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import List, Optional
+
+DEFAULT_MODULES = [
+    "io_utils",
+    "utils",
+    "llm_client",
+    "checkpoint",
+    "compact_records",
+    "dedup",
+    "final_processing_for_bfcl",
+    "generate_instruction_v8",
+]
+
+HEAVY_MODULES = ["openai", "httpx", "dotenv"]
+
+_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "loaded": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def time_import(module: str, repeats: int = 5) -> dict:
+    """
+    Import a module in `repeats` fresh interpreters.
+
+    Returns:
+        Dict with the median and minimum import time in milliseconds and the heavy
+        modules the import loaded
+    """
+    times = []
+    loaded = []
+    for _ in range(repeats):
+        result = subprocess.run(
+            [sys.executable, "-c", _PROBE.format(module=module, heavy=HEAVY_MODULES)],
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+        if result.returncode != 0:
+            return {"module": module, "error": result.stderr.strip().splitlines()[-1]}
+        probe = json.loads(result.stdout.strip().splitlines()[-1])
+        times.append(probe["seconds"] * 1000)
+        loaded = probe["loaded"]
+    return {
+        "module": module,
+        "median_ms": round(statistics.median(times), 1),
+        "min_ms": round(min(times), 1),
+        "loads": loaded,
+    }
+
+
+def main(modules: Optional[List[str]] = None, repeats: int = 5, output_json: Optional[str] = None):
+    """
+    Print the import time of each module.
+
+    Args:
+        modules: Modules to import (defaults to the repo's scripts and helpers)
+        repeats: Fresh interpreters per module
+        output_json: Optional path to write the results as JSON
+    """
+    results = [time_import(module, repeats) for module in (modules or DEFAULT_MODULES)]
+    print(f"{'module':<28}{'median ms':>12}{'min ms':>10}  loads")
+    for result in results:
+        if "error" in result:
+            print(f"{result['module']:<28}  failed: {result['error']}")
+            continue
+        print(f"{result['module']:<28}{result['median_ms']:>12.1f}{result['min_ms']:>10.1f}  "
+              f"{', '.join(result['loads']) or '-'}")
+    if output_json:
+        with open(output_json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to: {output_json}")
+    return results
+
+
+if __name__ == "__main__":
+    import fire
+
+    fire.Fire(main)
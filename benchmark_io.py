@@ -0,0 +1,121 @@
+"""
+benchmark_io.py
+
+JSONL read/write benchmark of io_utils against the plain json module on the output/
+datasets.
+
+For every dataset the file is replicated in memory up to at least min_records lines,
+then decoded line by line (json.loads, io_utils.loads, io_utils.loads into BFCLRecord)
+and re-encoded (json.dumps, io_utils.dumps_line). Each variant runs several times and
+the median is reported; the output re-encoded from the BFCLRecord structs is checked to
+be byte-identical to the input.
+
+Run:
+python benchmark_io.py --min_records 50000 --output_json output/io_benchmark.json
+"""
+import glob
+import json
+import os
+import statistics
+import time
+from typing import Callable, List, Optional
+
+import io_utils
+
+
+def _median_seconds(function: Callable[[], object], repeats: int) -> float:
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def benchmark_file(path: str, min_records: int = 50000, repeats: int = 5) -> dict:
+    """
+    Time decoding and encoding of one JSONL dataset.
+
+    Args:
+        path: JSONL dataset
+        min_records: Lines to time, reached by repeating the file's lines
+        repeats: Runs per variant
+
+    Returns:
+        Dict with records/sec per variant, the speedups over the json module and the
+        byte-compatibility check
+    """
+    with open(path, "rb") as f:
+        raw_lines = [line for line in f if line.strip()]
+    if not raw_lines:
+        return {"dataset": os.path.basename(path), "records": 0}
+    copies = max(1, -(-min_records // len(raw_lines)))
+    raw_lines = raw_lines * copies
+    text_lines = [line.decode("utf-8") for line in raw_lines]
+    records = [json.loads(line) for line in text_lines]
+
+    timings = {
+        "decode_json": _median_seconds(lambda: [json.loads(line) for line in text_lines], repeats),
+        "decode_io_utils": _median_seconds(lambda: [io_utils.loads(line) for line in raw_lines], repeats),
+        "decode_typed": _median_seconds(
+            lambda: [io_utils.BFCLRecord.from_dict(io_utils.loads(line)) for line in raw_lines], repeats
+        ),
+        "encode_json": _median_seconds(
+            lambda: [json.dumps(record, ensure_ascii=False) for record in records], repeats
+        ),
+        "encode_io_utils": _median_seconds(lambda: [io_utils.dumps_line(record) for record in records], repeats),
+    }
+    typed = [io_utils.BFCLRecord.from_dict(io_utils.loads(line)) for line in raw_lines]
+    byte_identical = all(
+        (io_utils.dumps_line(record.to_dict()) + "\n").encode("utf-8") == line.rstrip(b"\r\n") + b"\n"
+        for record, line in zip(typed, raw_lines)
+    )
+    count = len(raw_lines)
+    return {
+        "dataset": os.path.basename(path),
+        "records": count,
+        "records_per_second": {name: round(count / seconds) for name, seconds in timings.items()},
+        "decode_speedup": round(timings["decode_json"] / timings["decode_io_utils"], 2),
+        "typed_decode_speedup": round(timings["decode_json"] / timings["decode_typed"], 2),
+        "encode_speedup": round(timings["encode_json"] / timings["encode_io_utils"], 2),
+        "byte_identical": byte_identical,
+    }
+
+
+def main(
+    paths: Optional[List[str]] = None,
+    min_records: int = 50000,
+    repeats: int = 5,
+    output_json: Optional[str] = None
+):
+    """
+    Print decode/encode throughput of the json module and io_utils per dataset.
+
+    Args:
+        paths: JSONL datasets (defaults to output/*.json)
+        min_records: Lines timed per dataset (the file is repeated to reach it)
+        repeats: Runs per variant
+        output_json: Optional path to write the results as JSON
+    """
+    # Sidecars (<output>.manifest.json, .schemas.json, ...) are not datasets
+    paths = paths or sorted(path for path in glob.glob(os.path.join("output", "*.json")) if ".json." not in path)
+    print(f"orjson: {'yes' if io_utils.orjson is not None else 'no (json module fallback)'}")
+    results = [benchmark_file(path, min_records, repeats) for path in paths]
+    print(f"{'dataset':<40}{'decode x':>10}{'typed x':>10}{'encode x':>10}  byte-identical")
+    for result in results:
+        if not result["records"]:
+            print(f"{result['dataset']:<40}  empty")
+            continue
+        print(f"{result['dataset']:<40}{result['decode_speedup']:>10.2f}{result['typed_decode_speedup']:>10.2f}"
+              f"{result['encode_speedup']:>10.2f}  {result['byte_identical']}")
+    if output_json:
+        with open(output_json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to: {output_json}")
+    return results
+
+
+if __name__ == "__main__":
+    import fire
+
+    fire.Fire(main)
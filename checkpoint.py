@@ -0,0 +1,314 @@
+"""
+checkpoint.py
+
+Cell-level checkpoint journal for resumable generation runs.
+
+Each output JSONL file gets a sidecar journal (<output>.journal.jsonl) with one line
+per completed (param_recipe, style_recipe) cell, plus one per top-up of a cell: the
+cell's recipe hash, the ID range it was assigned and the byte offset of the output
+file after its records were flushed. A restarted run skips cells whose journaled
+records reach their target, truncates any records written after the last journaled
+offset (a cell that crashed mid-write) and re-dispatches the rest, asking short cells
+only for their missing records.
+
+A second sidecar (<output>.manifest.json) caches the largest record ID per prefix so
+that finding the resume ID does not require rescanning the whole output file.
+"""
+import hashlib
+import json
+import os
+from typing import Dict, Optional
+
+from io_utils import loads
+
+
+def recipe_hash(param_recipe: str, style_recipe: str, id_prefix: str, num_queries: int) -> str:
+    """
+    Identify a grid cell by the content of its recipes rather than its position.
+
+    Args:
+        param_recipe: Parameter recipe string
+        style_recipe: Style recipe string
+        id_prefix: Prefix for record IDs
+        num_queries: Number of queries requested for the cell
+
+    Returns:
+        Short hex digest identifying the cell
+    """
+    payload = json.dumps([param_recipe, style_recipe, id_prefix, num_queries], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+class CellJournal:
+    """Append-only sidecar journal of completed grid cells for one output file."""
+
+    def __init__(self, output_path: str):
+        """
+        Args:
+            output_path: Path to the output JSONL file the journal belongs to
+        """
+        self.output_path = output_path
+        self.path = output_path + ".journal.jsonl"
+        self.entries: Dict[str, dict] = {}
+        self.filled: Dict[str, int] = {}
+        self.attempts: Dict[str, int] = {}
+        self.load()
+
+    def load(self):
+        """Read completed cells from disk, ignoring a torn final line."""
+        self.entries = {}
+        self.filled = {}
+        self.attempts = {}
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    print(f"Warning: Ignoring unreadable journal line: {line[:50]}...")
+                    continue
+                self._add(entry)
+
+    def _add(self, entry: dict):
+        # A cell can have several entries when it was topped up; the latest one wins
+        # for lookups and the record counts add up
+        self.entries[entry["cell"]] = entry
+        self.filled[entry["cell"]] = self.filled.get(entry["cell"], 0) + entry["count"]
+        self.attempts[entry["cell"]] = self.attempts.get(entry["cell"], 0) + 1
+
+    def filled_count(self, cell: str) -> int:
+        """Number of records written for a cell across all of its entries."""
+        return self.filled.get(cell, 0)
+
+    def attempt_count(self, cell: str) -> int:
+        """Number of answered requests journaled for a cell (its first one plus top-ups)."""
+        return self.attempts.get(cell, 0)
+
+    def is_complete(self, cell: str, target: int) -> bool:
+        """Whether a cell's journaled records reach its target."""
+        return self.filled_count(cell) >= target
+
+    def last_offset(self) -> Optional[int]:
+        """Byte offset of the output file after the most recently journaled cell."""
+        if not self.entries:
+            return None
+        return max(entry["end_offset"] for entry in self.entries.values())
+
+    def last_id(self) -> Optional[int]:
+        """Largest record ID assigned to a journaled cell."""
+        ids = [entry["end_id"] for entry in self.entries.values() if entry["count"] > 0]
+        return max(ids) if ids else None
+
+    def discard_partial_output(self) -> int:
+        """
+        Truncate records written after the last journaled cell.
+
+        Returns:
+            Number of bytes removed from the output file
+        """
+        offset = self.last_offset()
+        if offset is None or not os.path.exists(self.output_path):
+            return 0
+        size = os.path.getsize(self.output_path)
+        if size <= offset:
+            return 0
+        with open(self.output_path, "r+b") as f:
+            f.truncate(offset)
+        return size - offset
+
+    def record(
+        self,
+        cell: str,
+        param_index: int,
+        style_index: int,
+        start_id: int,
+        count: int,
+        end_offset: int
+    ):
+        """
+        Append a completed cell. The output file must already be flushed up to end_offset.
+
+        Args:
+            cell: Recipe hash of the cell
+            param_index: Index of the parameter recipe in the grid
+            style_index: Index of the style recipe in the grid
+            start_id: First record ID assigned to the cell
+            count: Number of records written for the cell
+            end_offset: Output file size in bytes after the cell's records
+        """
+        entry = {
+            "cell": cell,
+            "param_index": param_index,
+            "style_index": style_index,
+            "start_id": start_id,
+            "end_id": start_id + count - 1,
+            "count": count,
+            "end_offset": end_offset,
+        }
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+        self._add(entry)
+
+    def reset(self):
+        """Forget all completed cells (used when the output file is started from scratch)."""
+        self.entries = {}
+        self.filled = {}
+        self.attempts = {}
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class ResumeManifest:
+    """
+    Small sidecar (<output>.manifest.json) holding the largest ID per prefix.
+
+    The manifest stores the output file's size and a hash of its last bytes, so a
+    lookup can confirm in constant time that the file has not changed since the
+    manifest was written.
+    """
+
+    TAIL_BYTES = 4096
+
+    def __init__(self, output_path: str):
+        """
+        Args:
+            output_path: Path to the output JSONL file the manifest describes
+        """
+        self.output_path = output_path
+        self.path = output_path + ".manifest.json"
+
+    def _fingerprint(self) -> dict:
+        size = os.path.getsize(self.output_path)
+        with open(self.output_path, "rb") as f:
+            f.seek(max(0, size - self.TAIL_BYTES))
+            tail = f.read()
+        return {"size": size, "tail_sha256": hashlib.sha256(tail).hexdigest()}
+
+    def _read(self) -> Optional[dict]:
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (json.JSONDecodeError, OSError):
+            return None
+
+    def lookup(self, id_prefix: str) -> Optional[int]:
+        """
+        Return the cached maximum ID for a prefix if the manifest still matches the file.
+
+        Returns:
+            The maximum ID, or None if the manifest is missing, stale or has no entry
+            for the prefix
+        """
+        manifest = self._read()
+        if manifest is None or not os.path.exists(self.output_path):
+            return None
+        fingerprint = self._fingerprint()
+        if manifest.get("size") != fingerprint["size"] or manifest.get("tail_sha256") != fingerprint["tail_sha256"]:
+            return None
+        return manifest.get("max_ids", {}).get(id_prefix)
+
+    def update(self, id_prefix: str, max_id: int):
+        """Record the maximum ID for a prefix against the current (flushed) file contents."""
+        manifest = self._read() or {}
+        max_ids = manifest.get("max_ids", {})
+        fingerprint = self._fingerprint()
+        if manifest.get("size") is not None and fingerprint["size"] < manifest["size"]:
+            # The file was truncated or rewritten, so other prefixes may be gone
+            max_ids = {}
+        max_ids[id_prefix] = max_id
+        manifest = dict(fingerprint, max_ids=max_ids)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.path)
+
+    def reset(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def read_last_id(file_path: str, id_prefix: str, block_size: int = 65536) -> int:
+    """
+    Find the ID of the last record with a given prefix by reading the file backwards.
+
+    This is the largest ID only while the file is in append order (as the generator
+    writes it); read_max_id checks that before relying on it. Only the tail of the file
+    is read unless the prefix does not occur there.
+
+    Args:
+        file_path: Path to the JSONL file
+        id_prefix: ID prefix to match
+        block_size: Number of bytes read per backwards step
+
+    Returns:
+        The last ID with the prefix, or -1 if there is none
+    """
+    prefix = f"{id_prefix}_"
+    with open(file_path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        position = f.tell()
+        remainder = b""
+        while position > 0:
+            read_size = min(block_size, position)
+            position -= read_size
+            f.seek(position)
+            chunk = f.read(read_size) + remainder
+            lines = chunk.split(b"\n")
+            # The first piece may be the end of a line that starts in an earlier block
+            remainder = lines.pop(0) if position > 0 else b""
+            for line in reversed(lines):
+                numeric_id = _parse_record_id(line, prefix)
+                if numeric_id is not None:
+                    return numeric_id
+        numeric_id = _parse_record_id(remainder, prefix)
+        return numeric_id if numeric_id is not None else -1
+
+
+def read_max_id(file_path: str, id_prefix: str, journal: Optional[CellJournal] = None) -> int:
+    """
+    Find the largest ID with a given prefix.
+
+    When the file ends exactly where the journal's last cell ended, it has not been
+    touched since the generator appended it in increasing ID order, so the last
+    matching record is read from the tail. Any other file (merged, sharded, edited or
+    without a journal) is scanned in full.
+
+    Args:
+        file_path: Path to the JSONL file
+        id_prefix: ID prefix to match
+        journal: Cell journal of the file, if it has one
+
+    Returns:
+        The largest ID with the prefix, or -1 if there is none
+    """
+    if journal is not None and journal.last_offset() == os.path.getsize(file_path):
+        return read_last_id(file_path, id_prefix)
+    prefix = f"{id_prefix}_"
+    max_id = -1
+    with open(file_path, "rb") as f:
+        for line in f:
+            numeric_id = _parse_record_id(line, prefix)
+            if numeric_id is not None and numeric_id > max_id:
+                max_id = numeric_id
+    return max_id
+
+
+def _parse_record_id(line: bytes, prefix: str) -> Optional[int]:
+    """Numeric ID of a record line whose ID is the prefix followed by digits, else None."""
+    # Most lines of other prefixes are rejected without decoding them
+    if prefix.encode("utf-8") not in line:
+        return None
+    try:
+        id_str = loads(line).get("id", "")
+    except (json.JSONDecodeError, ValueError, AttributeError):
+        return None
+    if not isinstance(id_str, str) or not id_str.startswith(prefix):
+        return None
+    suffix = id_str[len(prefix):]
+    return int(suffix) if suffix.isdigit() else None
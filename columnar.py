@@ -0,0 +1,477 @@
+"""
+columnar.py
+
+Columnar Arrow/Parquet export and memory-mapped loading of generated datasets.
+
+A BFCL JSONL file (plain or compact, see compact_records.py) is written as one table
+with a row per record:
+    id, number          record ID and its numeric part
+    query               text of the first user turn
+    question            the full question turns (list<list<struct<role, content>>>)
+    function_ref        schema hashes of the record's functions
+    ground_truth        the record's ground truth calls (list<struct<name, arguments>>, see
+                        encode_ground_truth; null if none was given)
+    ground_truth_json   JSON text of ground truth that does not have the BFCL call shape
+    cell, param_index, style_index
+                        recipe cell of the record, from the generator's journal
+    param_recipe, style_recipe
+                        recipe texts, dictionary-encoded (only when the recipe lists are given)
+
+Function schemas are not repeated per row: every distinct schema is stored once in the
+table's schema metadata (bfcl.function_schemas, hash -> schema) and rows reference it
+through function_ref. import_dataset() turns a table back into byte-identical JSONL.
+
+".arrow" files use the Arrow IPC file format and load zero-copy from a memory map;
+".parquet" files are smaller on disk and are memory-mapped while decoding. pyarrow is
+an optional dependency, needed only by this module.
+
+Run:
+python columnar.py export output/BFCL_V4_Mindat_v1.json output/BFCL_V4_Mindat_v1.arrow
+python columnar.py describe output/BFCL_V4_Mindat_v1.arrow
+python columnar.py import_dataset output/BFCL_V4_Mindat_v1.arrow output/roundtrip.json
+"""
+import bisect
+import json
+import os
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from compact_records import SchemaTable, schema_hash, schema_table_path
+from io_utils import dumps_line, iter_jsonl, loads
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:  # Only the functions of this module need it
+    pa = pc = pq = None
+
+SCHEMAS_METADATA_KEY = b"bfcl.function_schemas"
+COMPACT_METADATA_KEY = b"bfcl.compact"
+COLUMNAR_EXTENSIONS = (".arrow", ".parquet")
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError("Columnar export and loading need pyarrow (pip install pyarrow)")
+
+
+def _is_parquet(path: str) -> bool:
+    return path.endswith(".parquet")
+
+
+# Typed value lists of a ground-truth argument; an argument uses exactly one of these or
+# "json" (its values as JSON texts) when they do not share one of the types
+GROUND_TRUTH_VALUE_FIELDS = ("bools", "ints", "floats", "strings", "string_lists")
+
+
+def _value_field(value) -> Optional[str]:
+    if isinstance(value, bool):
+        return "bools"
+    if isinstance(value, int):
+        return "ints" if -2 ** 63 <= value < 2 ** 63 else None
+    if isinstance(value, float):
+        return "floats"
+    if isinstance(value, str):
+        return "strings"
+    if isinstance(value, list) and all(isinstance(item, str) for item in value):
+        return "string_lists"
+    return None
+
+
+def encode_ground_truth(ground_truth) -> Optional[List[dict]]:
+    """
+    Rows of the typed ground_truth column for one record.
+
+    BFCL ground truth is a list of calls {function name: {argument: [accepted values]}};
+    each call becomes {"name", "arguments"} and each argument {"name", <value field>: values}
+    with the value field picked from the values' common type.
+
+    Returns:
+        The call rows, or None if the ground truth does not have that shape
+    """
+    if not isinstance(ground_truth, list):
+        return None
+    calls = []
+    for call in ground_truth:
+        if not isinstance(call, dict) or len(call) != 1:
+            return None
+        (name, arguments), = call.items()
+        if not isinstance(arguments, dict):
+            return None
+        encoded = []
+        for argument, values in arguments.items():
+            if not isinstance(values, list):
+                return None
+            fields = {_value_field(value) for value in values}
+            field = fields.pop() if len(fields) == 1 else None
+            if field is None:
+                encoded.append({"name": argument, "json": [dumps_line(value) for value in values]})
+            else:
+                encoded.append({"name": argument, field: values})
+        calls.append({"name": name, "arguments": encoded})
+    return calls
+
+
+def decode_ground_truth(calls: List[dict]) -> list:
+    """Inverse of encode_ground_truth (rows as returned by to_pylist())."""
+    ground_truth = []
+    for call in calls:
+        arguments = {}
+        for argument in call["arguments"]:
+            if argument["json"] is not None:
+                arguments[argument["name"]] = [loads(value) for value in argument["json"]]
+            else:
+                arguments[argument["name"]] = next(
+                    argument[field] for field in GROUND_TRUTH_VALUE_FIELDS if argument[field] is not None
+                )
+        ground_truth.append({call["name"]: arguments})
+    return ground_truth
+
+
+def _ground_truth_type():
+    argument = pa.struct([
+        ("name", pa.string()),
+        ("bools", pa.list_(pa.bool_())),
+        ("ints", pa.list_(pa.int64())),
+        ("floats", pa.list_(pa.float64())),
+        ("strings", pa.list_(pa.string())),
+        ("string_lists", pa.list_(pa.list_(pa.string()))),
+        ("json", pa.list_(pa.string())),
+    ])
+    return pa.list_(pa.struct([("name", pa.string()), ("arguments", pa.list_(argument))]))
+
+
+def dataset_schema(function_schemas: Dict[str, dict], compact: bool, with_recipes: bool):
+    """Arrow schema of an exported dataset, with the function schemas as metadata."""
+    _require_pyarrow()
+    message = pa.struct([("role", pa.string()), ("content", pa.string())])
+    fields = [
+        pa.field("id", pa.string(), nullable=False),
+        pa.field("number", pa.int64()),
+        pa.field("query", pa.string()),
+        pa.field("question", pa.list_(pa.list_(message))),
+        pa.field("function_ref", pa.list_(pa.string())),
+        pa.field("ground_truth", _ground_truth_type()),
+        pa.field("ground_truth_json", pa.string()),
+        pa.field("cell", pa.string()),
+        pa.field("param_index", pa.int32()),
+        pa.field("style_index", pa.int32()),
+    ]
+    if with_recipes:
+        fields += [
+            pa.field("param_recipe", pa.dictionary(pa.int32(), pa.string())),
+            pa.field("style_recipe", pa.dictionary(pa.int32(), pa.string())),
+        ]
+    metadata = {
+        SCHEMAS_METADATA_KEY: json.dumps(function_schemas, ensure_ascii=False).encode("utf-8"),
+        COMPACT_METADATA_KEY: b"true" if compact else b"false",
+    }
+    return pa.schema(fields, metadata=metadata)
+
+
+class _CellRanges:
+    """Record number -> journaled grid cell, from every entry of a generator journal."""
+
+    def __init__(self, journal_path: Optional[str]):
+        entries = []
+        if journal_path and os.path.exists(journal_path):
+            for entry in iter_jsonl(journal_path):
+                if entry["count"] > 0:
+                    entries.append((entry["start_id"], entry["end_id"], entry))
+        entries.sort(key=lambda item: item[0])
+        self._starts = [start for start, _, _ in entries]
+        self._entries = entries
+
+    def lookup(self, number: int) -> Optional[dict]:
+        position = bisect.bisect_right(self._starts, number) - 1
+        if position >= 0:
+            _, end, entry = self._entries[position]
+            if number <= end:
+                return entry
+        return None
+
+
+def _collect_schemas(records_path: str, schema_path: Optional[str]) -> Tuple[Dict[str, dict], bool]:
+    """Distinct function schemas of a dataset and whether its records are compact."""
+    schemas: Dict[str, dict] = {}
+    compact = None
+    for record in iter_jsonl(records_path):
+        if "function_ref" in record:
+            compact = True
+            break
+        compact = False
+        for schema in record.get("function") or ():
+            schemas.setdefault(schema_hash(schema), schema)
+    if compact:
+        schemas = dict(SchemaTable(schema_path or schema_table_path(records_path)).schemas)
+    return schemas, bool(compact)
+
+
+def export_dataset(
+    records_path: str,
+    output_path: str,
+    ground_truth_path: Optional[str] = None,
+    journal_path: Optional[str] = None,
+    schema_path: Optional[str] = None,
+    param_recipes: Optional[Sequence[str]] = None,
+    style_recipes: Optional[Sequence[str]] = None,
+    batch_size: int = 50000,
+    compression: str = "zstd"
+) -> dict:
+    """
+    Write a generated dataset as an Arrow (.arrow) or Parquet (.parquet) table.
+
+    Args:
+        records_path: BFCL JSONL file (plain or compact records)
+        output_path: Destination; the extension picks the format
+        ground_truth_path: Optional JSONL file of {"id", "ground_truth"} records to join by ID
+        journal_path: Generator journal with the records' recipe cells
+            (default: <records_path>.journal.jsonl if it exists)
+        schema_path: Schema table of compact records (default: their sidecar table)
+        param_recipes: Parameter recipes of the run, to add the param_recipe column
+        style_recipes: Style recipes of the run, to add the style_recipe column
+        batch_size: Rows per record batch (Parquet row group)
+        compression: Parquet compression codec
+
+    Returns:
+        Dict with the number of rows and distinct function schemas
+    """
+    _require_pyarrow()
+    function_schemas, compact = _collect_schemas(records_path, schema_path)
+    with_recipes = param_recipes is not None and style_recipes is not None
+    schema = dataset_schema(function_schemas, compact, with_recipes)
+    cells = _CellRanges(journal_path or records_path + ".journal.jsonl")
+    ground_truth = {}
+    if ground_truth_path:
+        for record in iter_jsonl(ground_truth_path):
+            ground_truth[record["id"]] = record["ground_truth"]
+    if with_recipes:
+        param_dictionary = pa.array(list(param_recipes), type=pa.string())
+        style_dictionary = pa.array(list(style_recipes), type=pa.string())
+
+    if _is_parquet(output_path):
+        writer = pq.ParquetWriter(output_path, schema, compression=compression)
+        write = lambda batch: writer.write_table(pa.Table.from_batches([batch]))  # noqa: E731
+    else:
+        sink = pa.OSFile(output_path, "wb")
+        writer = pa.ipc.new_file(sink, schema)
+        write = writer.write_batch
+
+    def flush(rows: Dict[str, list]):
+        arrays = [
+            pa.array(rows["id"], type=pa.string()),
+            pa.array(rows["number"], type=pa.int64()),
+            pa.array(rows["query"], type=pa.string()),
+            pa.array(rows["question"], type=schema.field("question").type),
+            pa.array(rows["function_ref"], type=pa.list_(pa.string())),
+            pa.array(rows["ground_truth"], type=schema.field("ground_truth").type),
+            pa.array(rows["ground_truth_json"], type=pa.string()),
+            pa.array(rows["cell"], type=pa.string()),
+            pa.array(rows["param_index"], type=pa.int32()),
+            pa.array(rows["style_index"], type=pa.int32()),
+        ]
+        if with_recipes:
+            # The grid indices are the dictionary indices, so every batch shares one dictionary
+            arrays += [
+                pa.DictionaryArray.from_arrays(arrays[8], param_dictionary),
+                pa.DictionaryArray.from_arrays(arrays[9], style_dictionary),
+            ]
+        write(pa.RecordBatch.from_arrays(arrays, schema=schema))
+
+    columns = ("id", "number", "query", "question", "function_ref", "ground_truth", "ground_truth_json",
+               "cell", "param_index", "style_index")
+    rows = {name: [] for name in columns}
+    count = 0
+    try:
+        for record in iter_jsonl(records_path):
+            number = int(record["id"].split("_")[-1])
+            question = record.get("question") or []
+            entry = cells.lookup(number)
+            rows["id"].append(record["id"])
+            rows["number"].append(number)
+            rows["query"].append(question[0][0].get("content") if question and question[0] else None)
+            rows["question"].append(question)
+            rows["function_ref"].append(
+                record["function_ref"] if "function_ref" in record
+                else [schema_hash(function) for function in record.get("function") or ()]
+            )
+            if record["id"] in ground_truth or "ground_truth" in record:
+                truth = ground_truth.get(record["id"], record.get("ground_truth"))
+                calls = encode_ground_truth(truth)
+                rows["ground_truth"].append(calls)
+                rows["ground_truth_json"].append(dumps_line(truth) if calls is None else None)
+            else:
+                rows["ground_truth"].append(None)
+                rows["ground_truth_json"].append(None)
+            rows["cell"].append(entry["cell"] if entry else None)
+            rows["param_index"].append(entry["param_index"] if entry else None)
+            rows["style_index"].append(entry["style_index"] if entry else None)
+            count += 1
+            if len(rows["id"]) >= batch_size:
+                flush(rows)
+                rows = {name: [] for name in columns}
+        if rows["id"]:
+            flush(rows)
+    finally:
+        writer.close()
+        if not _is_parquet(output_path):
+            sink.close()
+
+    print(f"Exported {count} records to {output_path} ({len(function_schemas)} distinct function schemas)")
+    return {"rows": count, "function_schemas": len(function_schemas)}
+
+
+def load_dataset(path: str, columns: Optional[List[str]] = None):
+    """
+    Load an exported dataset as an Arrow table without building Python objects.
+
+    Arrow IPC files are memory-mapped and read zero-copy, so only the pages of the
+    columns actually scanned are read from disk. Parquet files are memory-mapped while
+    their column chunks are decoded.
+
+    Args:
+        path: .arrow or .parquet file written by export_dataset (or export_rows)
+        columns: Columns to load (default: all)
+
+    Returns:
+        pyarrow.Table
+    """
+    _require_pyarrow()
+    if _is_parquet(path):
+        return pq.read_table(path, columns=columns, memory_map=True)
+    with pa.memory_map(path, "r") as source:
+        table = pa.ipc.open_file(source).read_all()
+    return table.select(columns) if columns is not None else table
+
+
+def function_schemas(table) -> Dict[str, dict]:
+    """The function schemas stored in a table's metadata, by hash."""
+    metadata = table.schema.metadata or {}
+    return json.loads(metadata.get(SCHEMAS_METADATA_KEY, b"{}"))
+
+
+def load_columns(path: str, names: Sequence[str]) -> Dict[str, list]:
+    """Python lists of a few columns (e.g. for train.py), read without per-row dicts."""
+    table = load_dataset(path, columns=list(names))
+    return {name: table.column(name).to_pylist() for name in names}
+
+
+def iter_records(path: str) -> Iterator[dict]:
+    """
+    Rebuild the BFCL records of an exported dataset, batch by batch.
+
+    Yields:
+        Records with the key order of the generator's output ("function" or
+        "function_ref" as in the original file)
+    """
+    table = load_dataset(path, columns=["id", "question", "function_ref"])
+    schemas = function_schemas(table)
+    compact = (table.schema.metadata or {}).get(COMPACT_METADATA_KEY) == b"true"
+    for batch in table.to_batches():
+        ids, questions, refs = (batch.column(i).to_pylist() for i in range(3))
+        for record_id, question, function_ref in zip(ids, questions, refs):
+            if compact:
+                yield {"id": record_id, "question": question, "function_ref": function_ref}
+            else:
+                yield {"id": record_id, "question": question, "function": [schemas[ref] for ref in function_ref]}
+
+
+def import_dataset(path: str, output_path: str, ground_truth_output: Optional[str] = None) -> int:
+    """
+    Write an exported dataset back to BFCL JSONL.
+
+    Args:
+        path: .arrow or .parquet file written by export_dataset
+        output_path: Destination JSONL file for the question records
+        ground_truth_output: Optional JSONL file for the {"id", "ground_truth"} records
+
+    Returns:
+        Number of records written
+    """
+    count = 0
+    with open(output_path, "w", encoding="utf-8") as f:
+        for record in iter_records(path):
+            f.write(dumps_line(record) + "\n")
+            count += 1
+    if ground_truth_output:
+        table = load_dataset(path, columns=["id", "ground_truth", "ground_truth_json"])
+        with open(ground_truth_output, "w", encoding="utf-8") as f:
+            for batch in table.to_batches():
+                ids, calls, texts = (batch.column(i).to_pylist() for i in range(3))
+                for record_id, record_calls, text in zip(ids, calls, texts):
+                    if record_calls is not None:
+                        f.write(dumps_line({"id": record_id, "ground_truth": decode_ground_truth(record_calls)}) + "\n")
+                    elif text is not None:
+                        f.write(dumps_line({"id": record_id, "ground_truth": loads(text)}) + "\n")
+    print(f"Imported {count} records into {output_path}")
+    return count
+
+
+def export_rows(input_path: str, output_path: str, compression: str = "zstd") -> int:
+    """
+    Write a JSON list or JSONL file of flat records (e.g. instruction/input/output
+    training data for train.py) as an Arrow or Parquet table.
+
+    Returns:
+        Number of rows written
+    """
+    _require_pyarrow()
+    if input_path.endswith(".jsonl"):
+        rows = list(iter_jsonl(input_path))
+    else:
+        with open(input_path, "r", encoding="utf-8") as f:
+            rows = loads(f.read())
+    table = pa.Table.from_pylist(rows)
+    if _is_parquet(output_path):
+        pq.write_table(table, output_path, compression=compression)
+    else:
+        with pa.OSFile(output_path, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+    print(f"Exported {table.num_rows} rows to {output_path}")
+    return table.num_rows
+
+
+def describe(path: str, top: int = 10) -> dict:
+    """
+    Quick analytics over an exported dataset, computed on the columns.
+
+    Args:
+        path: .arrow or .parquet file written by export_dataset
+        top: Number of most frequent recipe cells to list
+
+    Returns:
+        Dict with the row count, query length statistics, records per recipe cell and
+        the share of records with ground truth
+    """
+    table = load_dataset(path, columns=["query", "cell", "ground_truth", "ground_truth_json"])
+    lengths = pc.utf8_length(table.column("query"))
+    extremes = pc.min_max(lengths)
+    counts = pc.value_counts(table.column("cell").drop_null()).to_pylist()
+    counts.sort(key=lambda item: -item["counts"])
+    summary = {
+        "rows": table.num_rows,
+        "function_schemas": len(function_schemas(table)),
+        "query_length": {
+            "min": extremes["min"].as_py(),
+            "mean": round(pc.mean(lengths).as_py() or 0.0, 1),
+            "max": extremes["max"].as_py(),
+        },
+        "cells": len(counts),
+        "top_cells": {item["values"]: item["counts"] for item in counts[:top]},
+        "with_ground_truth": pc.sum(pc.or_(pc.is_valid(table.column("ground_truth")),
+                                           pc.is_valid(table.column("ground_truth_json")))).as_py() or 0,
+    }
+    print(json.dumps(summary, indent=2))
+    return summary
+
+
+if __name__ == "__main__":
+    import fire
+
+    fire.Fire({
+        "export": export_dataset,
+        "export_rows": export_rows,
+        "import_dataset": import_dataset,
+        "describe": describe,
+    })
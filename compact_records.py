@@ -0,0 +1,142 @@
+"""
+compact_records.py
+
+Compact schema-by-reference record format and BFCL exporter.
+
+A BFCL record embeds the full function schema in every line:
+    {"id": ..., "question": ..., "function": [{...schema...}]}
+
+The compact format stores each distinct schema once in a sidecar schema table
+(<file>.schemas.json, content hash -> schema) and records point to it:
+    {"id": ..., "question": ..., "function_ref": ["<hash>"]}
+
+Records are only expanded back to the BFCL layout when exporting, which yields
+byte-identical lines to writing the full records directly.
+
+Run:
+python compact_records.py export output/compact.jsonl output/BFCL_V4_Mindat_v1.json
+python compact_records.py compact output/BFCL_V4_Mindat_v1.json output/compact.jsonl
+"""
+import hashlib
+import json
+import os
+from typing import Dict, Optional
+
+
+def schema_hash(schema: dict) -> str:
+    """Content hash of a function schema, independent of key order."""
+    canonical = json.dumps(schema, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
+
+
+def schema_table_path(records_path: str) -> str:
+    """Path of the schema table that belongs to a compact JSONL file."""
+    return records_path + ".schemas.json"
+
+
+class SchemaTable:
+    """Mapping from schema content hash to function schema, persisted as JSON."""
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: JSON file holding the table
+        """
+        self.path = path
+        self.schemas: Dict[str, dict] = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.schemas = json.load(f)
+
+    def add(self, schema: dict) -> str:
+        """Register a schema and return its hash."""
+        ref = schema_hash(schema)
+        self.schemas.setdefault(ref, schema)
+        return ref
+
+    def get(self, ref: str) -> dict:
+        try:
+            return self.schemas[ref]
+        except KeyError:
+            raise KeyError(f"Schema {ref} not found in {self.path}") from None
+
+    def save(self):
+        dirname = os.path.dirname(self.path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(self.schemas, f, ensure_ascii=False, indent=2)
+
+
+def compact_record(record: dict, table: SchemaTable) -> dict:
+    """Replace the embedded "function" list of a BFCL record with schema references."""
+    if "function" not in record:
+        return record
+    compact = {}
+    for key, value in record.items():
+        if key == "function":
+            compact["function_ref"] = [table.add(schema) for schema in value]
+        else:
+            compact[key] = value
+    return compact
+
+
+def expand_record(record: dict, table: SchemaTable) -> dict:
+    """Inverse of compact_record: inline the referenced schemas, keeping key order."""
+    if "function_ref" not in record:
+        return record
+    expanded = {}
+    for key, value in record.items():
+        if key == "function_ref":
+            expanded["function"] = [table.get(ref) for ref in value]
+        else:
+            expanded[key] = value
+    return expanded
+
+
+def export_bfcl(compact_path: str, output_path: str, schema_path: Optional[str] = None):
+    """
+    Expand a compact JSONL file into BFCL-compatible records.
+
+    Args:
+        compact_path: Compact JSONL file
+        output_path: Destination for the expanded BFCL JSONL file
+        schema_path: Schema table (defaults to the compact file's sidecar table)
+    """
+    table = SchemaTable(schema_path or schema_table_path(compact_path))
+    count = 0
+    with open(compact_path, "r", encoding="utf-8") as fin, open(output_path, "w", encoding="utf-8") as fout:
+        for line in fin:
+            if not line.strip():
+                continue
+            record = expand_record(json.loads(line), table)
+            fout.write(json.dumps(record, ensure_ascii=False) + "\n")
+            count += 1
+    print(f"Exported {count} records to {output_path}")
+
+
+def compact_file(input_path: str, output_path: str):
+    """
+    Convert a BFCL JSONL file into the compact format plus its schema table.
+
+    Args:
+        input_path: BFCL JSONL file with embedded schemas
+        output_path: Destination for the compact JSONL file
+    """
+    table = SchemaTable(schema_table_path(output_path))
+    count = 0
+    with open(input_path, "r", encoding="utf-8") as fin, open(output_path, "w", encoding="utf-8") as fout:
+        for line in fin:
+            if not line.strip():
+                continue
+            record = compact_record(json.loads(line), table)
+            fout.write(json.dumps(record, ensure_ascii=False) + "\n")
+            count += 1
+    table.save()
+    print(f"Compacted {count} records into {output_path} ({len(table.schemas)} distinct schemas)")
+
+
+if __name__ == "__main__":
+    import fire
+
+    fire.Fire({"export": export_bfcl, "compact": compact_file})
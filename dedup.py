@@ -0,0 +1,304 @@
+"""
+dedup.py
+
+Streaming near-duplicate query filter based on MinHash signatures and LSH banding.
+
+Each query is normalized, split into character shingles and summarized by a MinHash
+signature. Signatures are split into bands; queries sharing any band bucket become
+candidate pairs, and only those candidates are compared exactly (shingle Jaccard and,
+optionally, ROUGE-L). This keeps the cost per query roughly constant instead of the
+O(n^2) all-pairs ROUGE check used by upstream Alpaca.
+
+The filter runs inline in generate_instruction_v8.py (dedup_threshold) or as a batch
+pass over an existing JSONL file.
+
+Run:
+python dedup.py output/BFCL_V4_Mindat_v1.json output/BFCL_V4_Mindat_v1.dedup.json --threshold 0.7
+"""
+import hashlib
+import json
+import random
+import re
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # The pure-Python path gives identical signatures, just slower
+    np = None
+
+_MERSENNE_PRIME = (1 << 31) - 1
+
+
+def normalize_query(text: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace."""
+    text = re.sub(r"[^\w\s]", " ", text.lower())
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def shingles(text: str, size: int = 5) -> Set[str]:
+    """Character shingles of a normalized query."""
+    text = normalize_query(text)
+    if len(text) <= size:
+        return {text}
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def choose_bands(threshold: float, num_perm: int) -> Tuple[int, int]:
+    """
+    Pick (bands, rows) with bands * rows == num_perm whose LSH S-curve midpoint
+    (1 / bands) ** (1 / rows) lies closest to the similarity threshold.
+    """
+    best = None
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        midpoint = (1.0 / bands) ** (1.0 / rows)
+        # Prefer the lower midpoint on ties: extra candidates are checked exactly anyway
+        score = (abs(midpoint - threshold), midpoint)
+        if best is None or score < best[0]:
+            best = (score, bands, rows)
+    return best[1], best[2]
+
+
+_rouge_scorer = None
+
+
+def rouge_l(a: str, b: str) -> float:
+    """ROUGE-L F-measure between two queries (requires the rouge_score package)."""
+    from rouge_score import rouge_scorer
+
+    global _rouge_scorer
+    if _rouge_scorer is None:
+        _rouge_scorer = rouge_scorer.RougeScorer(["rougeL"], use_stemmer=False)
+    return _rouge_scorer.score(a, b)["rougeL"].fmeasure
+
+
+class NearDuplicateFilter:
+    """
+    Keep-first near-duplicate filter over a stream of queries.
+
+    A query is dropped when an earlier kept query shares an LSH bucket with it and
+    their shingle Jaccard similarity is at least `threshold` (and, if rouge_threshold
+    is set, their ROUGE-L score is at least `rouge_threshold`).
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.7,
+        num_perm: int = 64,
+        shingle_size: int = 5,
+        rouge_threshold: Optional[float] = None,
+        seed: int = 1
+    ):
+        """
+        Args:
+            threshold: Jaccard similarity at or above which a query counts as a duplicate
+            num_perm: Number of MinHash permutations
+            shingle_size: Character shingle length
+            rouge_threshold: Optional ROUGE-L score confirming a candidate pair
+            seed: Seed for the hash permutations
+        """
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.rouge_threshold = rouge_threshold
+        self.bands, self.rows = choose_bands(threshold, num_perm)
+
+        rng = random.Random(seed)
+        self._a = [rng.randrange(1, _MERSENNE_PRIME) for _ in range(num_perm)]
+        self._b = [rng.randrange(0, _MERSENNE_PRIME) for _ in range(num_perm)]
+        if np is not None:
+            self._a_np = np.array(self._a, dtype=np.uint64)
+            self._b_np = np.array(self._b, dtype=np.uint64)
+
+        self._buckets: List[Dict[tuple, List[str]]] = [defaultdict(list) for _ in range(self.bands)]
+        self._shingles: Dict[str, Set[str]] = {}
+        self._texts: Dict[str, str] = {}
+        self.kept = 0
+        self.dropped_total = 0
+        self.dropped: List[dict] = []
+
+    def _hash_shingles(self, items: Iterable[str]) -> List[int]:
+        return [
+            int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little")
+            % _MERSENNE_PRIME
+            for s in items
+        ]
+
+    def signature(self, shingle_set: Set[str]) -> tuple:
+        """MinHash signature of a shingle set."""
+        hashes = self._hash_shingles(shingle_set)
+        if np is not None:
+            values = np.array(hashes, dtype=np.uint64)[:, None]
+            permuted = (values * self._a_np + self._b_np) % _MERSENNE_PRIME
+            return tuple(int(v) for v in permuted.min(axis=0))
+        return tuple(
+            min((a * h + b) % _MERSENNE_PRIME for h in hashes)
+            for a, b in zip(self._a, self._b)
+        )
+
+    def _band_keys(self, signature: tuple) -> List[tuple]:
+        return [signature[i * self.rows:(i + 1) * self.rows] for i in range(self.bands)]
+
+    def find_duplicate(self, text: str, shingle_set: Optional[Set[str]] = None, band_keys=None) -> Optional[dict]:
+        """
+        Look for a kept query that `text` duplicates.
+
+        Returns:
+            Dict with the matching key and similarity scores, or None if text is unique
+        """
+        shingle_set = shingle_set if shingle_set is not None else shingles(text, self.shingle_size)
+        band_keys = band_keys if band_keys is not None else self._band_keys(self.signature(shingle_set))
+        seen = set()
+        for band, key in enumerate(band_keys):
+            for candidate in self._buckets[band].get(key, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                similarity = jaccard(shingle_set, self._shingles[candidate])
+                if similarity < self.threshold:
+                    continue
+                match = {"duplicate_of": candidate, "jaccard": round(similarity, 4)}
+                if self.rouge_threshold is not None:
+                    score = rouge_l(self._texts[candidate], text)
+                    if score < self.rouge_threshold:
+                        continue
+                    match["rouge_l"] = round(score, 4)
+                return match
+        return None
+
+    def add(self, key: str, text: str, shingle_set: Optional[Set[str]] = None, band_keys=None):
+        """Index a query as kept, without checking it."""
+        shingle_set = shingle_set if shingle_set is not None else shingles(text, self.shingle_size)
+        band_keys = band_keys if band_keys is not None else self._band_keys(self.signature(shingle_set))
+        for band, band_key in enumerate(band_keys):
+            self._buckets[band][band_key].append(key)
+        self._shingles[key] = shingle_set
+        if self.rouge_threshold is not None:
+            self._texts[key] = text
+        self.kept += 1
+
+    def remove(self, key: str):
+        """Forget a kept query (e.g. a record that was taken back before it was checkpointed)."""
+        shingle_set = self._shingles.pop(key, None)
+        if shingle_set is None:
+            return
+        for band, band_key in enumerate(self._band_keys(self.signature(shingle_set))):
+            bucket = self._buckets[band].get(band_key)
+            if bucket is not None and key in bucket:
+                bucket.remove(key)
+        self._texts.pop(key, None)
+        self.kept -= 1
+
+    def offer(self, key: str, text: str, source: Optional[str] = None) -> bool:
+        """
+        Keep `text` under `key` unless it duplicates an earlier query.
+
+        Args:
+            key: Identifier for the query if kept (e.g. its record ID)
+            text: Query text
+            source: Optional context for the drop report (e.g. the recipe cell)
+
+        Returns:
+            True if the query was kept, False if it was dropped
+        """
+        shingle_set = shingles(text, self.shingle_size)
+        band_keys = self._band_keys(self.signature(shingle_set))
+        match = self.find_duplicate(text, shingle_set, band_keys)
+        if match is not None:
+            entry = {"key": key, "query": text, "reason": "near_duplicate"}
+            if source is not None:
+                entry["source"] = source
+            entry.update(match)
+            self.dropped.append(entry)
+            self.dropped_total += 1
+            return False
+        self.add(key, text, shingle_set, band_keys)
+        return True
+
+    def write_report(self, report_path: str, mode: str = "a"):
+        """Write the dropped queries (one JSON object per line) and clear the in-memory report."""
+        if not self.dropped:
+            return
+        with open(report_path, mode, encoding="utf-8") as f:
+            for entry in self.dropped:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self.dropped = []
+
+    def stats(self) -> dict:
+        return {"kept": self.kept, "dropped": self.dropped_total, "bands": self.bands, "rows": self.rows}
+
+
+def record_query(record: dict) -> str:
+    """Return the user query of a BFCL record."""
+    return record["question"][0][0]["content"]
+
+
+def seed_from_file(dedup_filter: NearDuplicateFilter, file_path: str) -> int:
+    """
+    Index every query of an existing JSONL file as kept.
+
+    Returns:
+        Number of records indexed
+    """
+    count = 0
+    with open(file_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            dedup_filter.add(record["id"], record_query(record))
+            count += 1
+    return count
+
+
+def deduplicate_file(
+    input_path: str,
+    output_path: str,
+    threshold: float = 0.7,
+    num_perm: int = 64,
+    rouge_threshold: Optional[float] = None,
+    report_path: Optional[str] = None
+):
+    """
+    Batch pass: copy input to output, dropping near-duplicate records (first one wins).
+
+    Args:
+        input_path: JSONL file of BFCL records
+        output_path: Destination for the kept records
+        threshold: Jaccard similarity threshold
+        num_perm: Number of MinHash permutations
+        rouge_threshold: Optional ROUGE-L confirmation threshold
+        report_path: Where to write dropped records (defaults to <output>.dropped.jsonl)
+    """
+    dedup_filter = NearDuplicateFilter(threshold=threshold, num_perm=num_perm, rouge_threshold=rouge_threshold)
+    report_path = report_path or output_path + ".dropped.jsonl"
+    total = 0
+    with open(input_path, "r", encoding="utf-8") as fin, open(output_path, "w", encoding="utf-8") as fout:
+        for line in fin:
+            if not line.strip():
+                continue
+            total += 1
+            record = json.loads(line)
+            if dedup_filter.offer(record["id"], record_query(record)):
+                fout.write(line if line.endswith("\n") else line + "\n")
+    dropped = len(dedup_filter.dropped)
+    dedup_filter.write_report(report_path, mode="w")
+    print(f"Kept {total - dropped}/{total} records, dropped {dropped} near-duplicates")
+    print(f"Output saved to: {output_path}")
+    if dropped:
+        print(f"Drop report saved to: {report_path}")
+
+
+if __name__ == "__main__":
+    import fire
+
+    fire.Fire(deduplicate_file)
@@ -0,0 +1,312 @@
+"""
+elements.py
+
+Chemical element table used to check and normalize the el_inc/el_exc arguments of
+mindat_geomaterial.
+
+Elements can be written as symbols ("Fe"), in any case ("FE", "fe"), or by name
+("Iron", "iron"), including common alternative spellings ("Sulphur", "Aluminium").
+ElementIndex additionally resolves misspelled names ("Sliver", "Magnesum") within a
+bounded edit distance using a symmetric-delete index, and normalizes whole records.
+
+Run:
+python elements.py output/answers.jsonl output/answers.normalized.jsonl
+"""
+import json
+import threading
+from collections import Counter
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+# (atomic number order) symbol, name
+ELEMENTS: Tuple[Tuple[str, str], ...] = (
+    ("H", "Hydrogen"), ("He", "Helium"), ("Li", "Lithium"), ("Be", "Beryllium"),
+    ("B", "Boron"), ("C", "Carbon"), ("N", "Nitrogen"), ("O", "Oxygen"),
+    ("F", "Fluorine"), ("Ne", "Neon"), ("Na", "Sodium"), ("Mg", "Magnesium"),
+    ("Al", "Aluminum"), ("Si", "Silicon"), ("P", "Phosphorus"), ("S", "Sulfur"),
+    ("Cl", "Chlorine"), ("Ar", "Argon"), ("K", "Potassium"), ("Ca", "Calcium"),
+    ("Sc", "Scandium"), ("Ti", "Titanium"), ("V", "Vanadium"), ("Cr", "Chromium"),
+    ("Mn", "Manganese"), ("Fe", "Iron"), ("Co", "Cobalt"), ("Ni", "Nickel"),
+    ("Cu", "Copper"), ("Zn", "Zinc"), ("Ga", "Gallium"), ("Ge", "Germanium"),
+    ("As", "Arsenic"), ("Se", "Selenium"), ("Br", "Bromine"), ("Kr", "Krypton"),
+    ("Rb", "Rubidium"), ("Sr", "Strontium"), ("Y", "Yttrium"), ("Zr", "Zirconium"),
+    ("Nb", "Niobium"), ("Mo", "Molybdenum"), ("Tc", "Technetium"), ("Ru", "Ruthenium"),
+    ("Rh", "Rhodium"), ("Pd", "Palladium"), ("Ag", "Silver"), ("Cd", "Cadmium"),
+    ("In", "Indium"), ("Sn", "Tin"), ("Sb", "Antimony"), ("Te", "Tellurium"),
+    ("I", "Iodine"), ("Xe", "Xenon"), ("Cs", "Cesium"), ("Ba", "Barium"),
+    ("La", "Lanthanum"), ("Ce", "Cerium"), ("Pr", "Praseodymium"), ("Nd", "Neodymium"),
+    ("Pm", "Promethium"), ("Sm", "Samarium"), ("Eu", "Europium"), ("Gd", "Gadolinium"),
+    ("Tb", "Terbium"), ("Dy", "Dysprosium"), ("Ho", "Holmium"), ("Er", "Erbium"),
+    ("Tm", "Thulium"), ("Yb", "Ytterbium"), ("Lu", "Lutetium"), ("Hf", "Hafnium"),
+    ("Ta", "Tantalum"), ("W", "Tungsten"), ("Re", "Rhenium"), ("Os", "Osmium"),
+    ("Ir", "Iridium"), ("Pt", "Platinum"), ("Au", "Gold"), ("Hg", "Mercury"),
+    ("Tl", "Thallium"), ("Pb", "Lead"), ("Bi", "Bismuth"), ("Po", "Polonium"),
+    ("At", "Astatine"), ("Rn", "Radon"), ("Fr", "Francium"), ("Ra", "Radium"),
+    ("Ac", "Actinium"), ("Th", "Thorium"), ("Pa", "Protactinium"), ("U", "Uranium"),
+    ("Np", "Neptunium"), ("Pu", "Plutonium"), ("Am", "Americium"), ("Cm", "Curium"),
+    ("Bk", "Berkelium"), ("Cf", "Californium"), ("Es", "Einsteinium"), ("Fm", "Fermium"),
+    ("Md", "Mendelevium"), ("No", "Nobelium"), ("Lr", "Lawrencium"), ("Rf", "Rutherfordium"),
+    ("Db", "Dubnium"), ("Sg", "Seaborgium"), ("Bh", "Bohrium"), ("Hs", "Hassium"),
+    ("Mt", "Meitnerium"), ("Ds", "Darmstadtium"), ("Rg", "Roentgenium"), ("Cn", "Copernicium"),
+    ("Nh", "Nihonium"), ("Fl", "Flerovium"), ("Mc", "Moscovium"), ("Lv", "Livermorium"),
+    ("Ts", "Tennessine"), ("Og", "Oganesson"),
+)
+
+# Spellings the names above do not cover
+ALTERNATIVE_NAMES: Dict[str, str] = {
+    "aluminium": "Al",
+    "sulphur": "S",
+    "caesium": "Cs",
+    "wolfram": "W",
+}
+
+SYMBOLS: FrozenSet[str] = frozenset(symbol for symbol, _ in ELEMENTS)
+SYMBOL_TO_NAME: Dict[str, str] = dict(ELEMENTS)
+
+# Lowercased symbol or name -> symbol. Symbols are unique ignoring case and no
+# name is also the lowercase form of another element's symbol, so one table suffices.
+_LOOKUP: Dict[str, str] = {
+    **{symbol.lower(): symbol for symbol, _ in ELEMENTS},
+    **{name.lower(): symbol for symbol, name in ELEMENTS},
+    **ALTERNATIVE_NAMES,
+}
+
+
+def to_symbol(token: str) -> Optional[str]:
+    """
+    Resolve an element written as a symbol or name, in any case.
+
+    Args:
+        token: Element text, e.g. "Fe", "fe", "Iron" or "Sulphur"
+
+    Returns:
+        The element symbol, or None if the token is not an element
+    """
+    return _LOOKUP.get(token.strip().lower())
+
+
+def split_elements(value: str) -> Tuple[str, ...]:
+    """Split an el_inc/el_exc string such as "Fe, Cu" into its non-empty tokens."""
+    return tuple(token for token in (part.strip() for part in value.split(",")) if token)
+
+
+def _deletes(word: str, distance: int) -> Set[str]:
+    """Every string obtained from word by deleting up to distance characters (word included)."""
+    variants = {word}
+    frontier = {word}
+    for _ in range(distance):
+        frontier = {variant[:i] + variant[i + 1:] for variant in frontier for i in range(len(variant))}
+        variants |= frontier
+    return variants
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """
+    Optimal string alignment distance (insertions, deletions, substitutions and
+    adjacent transpositions), or limit + 1 once it is known to exceed limit.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        # A transposition reaches back two rows, so both must be past the limit
+        if min(current) > limit and min(previous) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return min(previous[-1], limit + 1)
+
+
+class ElementIndex:
+    """
+    Precomputed element normalization index.
+
+    Exact lookups cover symbols and names in any case. Unknown tokens of at least
+    min_length characters are matched against the names by edit distance: one edit for
+    words shorter than long_word_length, max_distance edits for longer ones. Symbols are
+    never matched fuzzily, so "Xx" stays unknown instead of becoming some two-letter
+    symbol. A token with several equally close names is left unresolved.
+
+    Every distinct token and comma string is resolved once and cached.
+    """
+
+    def __init__(self, max_distance: int = 2, min_length: int = 4, long_word_length: int = 8):
+        """
+        Args:
+            max_distance: Most edits accepted for long words (0 disables fuzzy matching)
+            min_length: Shortest token that is matched fuzzily
+            long_word_length: Length from which max_distance edits are accepted instead of one
+        """
+        self.max_distance = max_distance
+        self.min_length = min_length
+        self.long_word_length = long_word_length
+        self._names = {name: symbol for name, symbol in _LOOKUP.items() if len(name) > 2}
+        # Symmetric delete: a name and a token within k edits share a variant with <= k deletions
+        self._deletes: Dict[str, Set[str]] = {}
+        for name in self._names:
+            for variant in _deletes(name, max_distance):
+                self._deletes.setdefault(variant, set()).add(name)
+        self._lock = threading.Lock()
+        self._tokens: Dict[str, Optional[str]] = {}
+        self._values: Dict[str, Tuple[Tuple[str, ...], Tuple[str, ...]]] = {}
+
+    def _allowed_distance(self, word: str) -> int:
+        if len(word) < self.min_length:
+            return 0
+        return min(self.max_distance, 1 if len(word) < self.long_word_length else 2)
+
+    def _fuzzy(self, word: str) -> Optional[str]:
+        limit = self._allowed_distance(word)
+        if not limit:
+            return None
+        best_distance = limit + 1
+        best: Set[str] = set()
+        candidates = set()
+        for variant in _deletes(word, limit):
+            candidates |= self._deletes.get(variant, set())
+        for name in candidates:
+            distance = edit_distance(word, name, limit)
+            if distance < best_distance:
+                best_distance, best = distance, {self._names[name]}
+            elif distance == best_distance:
+                best.add(self._names[name])
+        return best.pop() if len(best) == 1 else None
+
+    def resolve(self, token: str) -> Optional[str]:
+        """
+        Resolve one element token.
+
+        Args:
+            token: Symbol, name or misspelled name, e.g. "FE", "Iron" or "Sliver"
+
+        Returns:
+            The element symbol, or None if the token is not (close to) an element
+        """
+        word = token.strip().lower()
+        try:
+            return self._tokens[word]
+        except KeyError:
+            pass
+        symbol = _LOOKUP.get(word)
+        if symbol is None:
+            symbol = self._fuzzy(word)
+        with self._lock:
+            self._tokens[word] = symbol
+        return symbol
+
+    def normalize(self, value: str) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+        """
+        Resolve an el_inc/el_exc string such as "Iron, cu, Sliver".
+
+        Returns:
+            Tuple of (symbols of the resolved elements without repeats, tokens that are not elements)
+        """
+        try:
+            return self._values[value]
+        except KeyError:
+            pass
+        symbols = []
+        unknown = []
+        for token in split_elements(value):
+            symbol = self.resolve(token)
+            if symbol is None:
+                unknown.append(token)
+            elif symbol not in symbols:
+                symbols.append(symbol)
+        result = (tuple(symbols), tuple(unknown))
+        with self._lock:
+            self._values[value] = result
+        return result
+
+    def normalize_many(self, values: Iterable[str]) -> List[Tuple[Tuple[str, ...], Tuple[str, ...]]]:
+        """normalize() for a batch of el_inc/el_exc strings, in input order."""
+        return [self.normalize(value) for value in values]
+
+    def normalize_fields(self, data, fields: Tuple[str, ...] = ("el_inc", "el_exc"), unknown: Optional[Counter] = None):
+        """
+        Rewrite element fields anywhere in a record to canonical symbols, in place.
+
+        Strings become comma-joined symbols ("iron, Cu" -> "Fe,Cu"); lists are normalized
+        item by item (nested lists, as in BFCL ground truth, included). Unknown tokens are
+        kept as written.
+
+        Args:
+            data: Record (dict or list) to rewrite
+            fields: Keys holding element values
+            unknown: Optional counter receiving the unknown tokens
+
+        Returns:
+            The rewritten record
+        """
+        if isinstance(data, dict):
+            for key, value in data.items():
+                if key in fields:
+                    data[key] = self.normalize_value(value, unknown)
+                elif isinstance(value, (dict, list)):
+                    self.normalize_fields(value, fields, unknown)
+        elif isinstance(data, list):
+            for item in data:
+                self.normalize_fields(item, fields, unknown)
+        return data
+
+    def normalize_value(self, value, unknown: Optional[Counter] = None):
+        """Canonical symbols for one element value (string, or list of them, nested lists included)."""
+        if isinstance(value, str):
+            symbols, missing = self.normalize(value)
+            if unknown is not None:
+                unknown.update(missing)
+            return ",".join(symbols + missing)
+        if isinstance(value, list):
+            return [self.normalize_value(item, unknown) for item in value]
+        return value
+
+
+_shared_index = None
+_shared_index_lock = threading.Lock()
+
+
+def get_element_index() -> ElementIndex:
+    """Return the process-wide element index with the default distance settings."""
+    global _shared_index
+    with _shared_index_lock:
+        if _shared_index is None:
+            _shared_index = ElementIndex()
+        return _shared_index
+
+
+def normalize_file(input_path: str, output_path: str, max_distance: int = 2) -> dict:
+    """
+    Rewrite the el_inc/el_exc values of every record in a JSONL file to canonical symbols.
+
+    Args:
+        input_path: Input JSONL file
+        output_path: Output JSONL file
+        max_distance: Most edits accepted when matching misspelled names (0: exact only)
+
+    Returns:
+        Dict with the record count and the most common unresolved tokens
+    """
+    index = ElementIndex(max_distance=max_distance)
+    unknown = Counter()
+    records = 0
+    with open(input_path, "r", encoding="utf-8") as fin, open(output_path, "w", encoding="utf-8") as fout:
+        for line in fin:
+            if not line.strip():
+                continue
+            record = index.normalize_fields(json.loads(line), unknown=unknown)
+            fout.write(json.dumps(record, ensure_ascii=False) + "\n")
+            records += 1
+    summary = {"records": records, "unresolved": dict(unknown.most_common(20))}
+    print(json.dumps(summary, indent=2))
+    return summary
+
+
+if __name__ == "__main__":
+    import fire
+
+    fire.Fire(normalize_file)
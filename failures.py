@@ -0,0 +1,319 @@
+"""
+failures.py
+
+Failure handling for LLM requests: error classification, a circuit breaker and a
+dead-letter file.
+
+Every exception raised by a request is sorted into one of three classes:
+    retryable       rate limits, server errors, timeouts, connection problems and
+                    unparseable responses; retried with backoff up to a retry budget
+    reduce_length   the prompt plus max_tokens exceed the context window; retried with
+                    a smaller max_tokens
+    permanent       any other client error (bad request, auth, content filter, ...)
+                    and responses cut off at max_tokens; never retried
+
+Requests that fail permanently or run out of retries raise RequestFailedError. Callers
+that process many items record those in a DeadLetterFile (<output>.failed.jsonl) and
+carry on, so a replay can later re-run just the failed items.
+
+The CircuitBreaker pauses dispatch for every caller once the endpoint keeps failing
+(server errors or connection problems), instead of letting each request burn its retry
+budget against an unhealthy endpoint.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+RETRYABLE = "retryable"
+REDUCE_LENGTH = "reduce_length"
+PERMANENT = "permanent"
+
+_CONNECTION_ERRORS = {"APIConnectionError", "APITimeoutError", "TransportError", "TimeoutException"}
+_CONTEXT_LENGTH_MARKERS = ("Please reduce your prompt", "maximum context length", "context_length_exceeded")
+
+
+class RequestFailedError(RuntimeError):
+    """A request that failed permanently or exhausted its retries."""
+
+    def __init__(self, category: str, attempts: int, cause: Exception):
+        super().__init__(f"{category} failure after {attempts} attempt(s): {cause}")
+        self.category = category
+        self.attempts = attempts
+        self.cause = cause
+
+
+class TruncatedResponseError(RuntimeError):
+    """A response cut off at max_tokens (finish_reason "length")."""
+
+
+def _status_code(error: Exception) -> Optional[int]:
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(error, "response", None), "status_code", None)
+    return status_code
+
+
+def is_endpoint_failure(error: Exception) -> bool:
+    """Return True if an error means the endpoint itself is unhealthy (5xx, timeout, no connection)."""
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    if any(cls.__name__ in _CONNECTION_ERRORS for cls in type(error).__mro__):
+        return True
+    status_code = _status_code(error)
+    return status_code is not None and status_code >= 500
+
+
+def classify_error(error: Exception) -> str:
+    """
+    Sort a request exception into RETRYABLE, REDUCE_LENGTH or PERMANENT.
+
+    Args:
+        error: Exception raised by the API client or while parsing its response
+
+    Returns:
+        The failure class
+    """
+    if getattr(error, "code", None) == "context_length_exceeded" or any(
+        marker in str(error) for marker in _CONTEXT_LENGTH_MARKERS
+    ):
+        return REDUCE_LENGTH
+    if is_endpoint_failure(error):
+        return RETRYABLE
+    status_code = _status_code(error)
+    if status_code is not None:
+        return RETRYABLE if status_code in (408, 409, 429) else PERMANENT
+    if isinstance(error, TruncatedResponseError):
+        return PERMANENT
+    # Unparseable or schema-violating output (ValidationError and JSON errors are
+    # ValueErrors) usually parses on a fresh sample
+    if isinstance(error, ValueError):
+        return RETRYABLE
+    return PERMANENT
+
+
+class CircuitBreaker:
+    """
+    Thread- and asyncio-safe circuit breaker shared by all requests to one endpoint.
+
+    After failure_threshold consecutive endpoint failures the breaker opens and callers
+    wait in wait()/wait_async() for reset_timeout seconds. Then a single probe request is
+    let through: if it succeeds the breaker closes, otherwise it reopens with twice the
+    timeout (up to max_reset_timeout).
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0, max_reset_timeout: float = 300.0):
+        """
+        Args:
+            failure_threshold: Consecutive endpoint failures that open the breaker
+            reset_timeout: Seconds the breaker stays open before the first probe
+            max_reset_timeout: Upper bound for the open period after repeated failed probes
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+
+        self._lock = threading.Lock()
+        self.state = "closed"
+        self._consecutive_failures = 0
+        self._open_until = 0.0
+        self._current_timeout = reset_timeout
+        self._probe_in_flight = False
+
+        # Statistics
+        self.opens = 0
+        self.paused_seconds = 0.0
+
+    def _reserve(self) -> float:
+        """Return 0 if a request may be sent now, otherwise seconds to wait before asking again."""
+        with self._lock:
+            if self.state == "closed":
+                return 0.0
+            now = time.monotonic()
+            if self.state == "open":
+                if now < self._open_until:
+                    return self._open_until - now
+                self.state = "half_open"
+                self._probe_in_flight = False
+            if not self._probe_in_flight:
+                self._probe_in_flight = True
+                return 0.0
+            # Another caller's probe is deciding whether the endpoint is back
+            return min(1.0, self.reset_timeout)
+
+    def wait(self) -> float:
+        """
+        Block while the breaker is open.
+
+        Returns:
+            Seconds spent waiting
+        """
+        waited = 0.0
+        while (delay := self._reserve()) > 0:
+            time.sleep(delay)
+            waited += delay
+        if waited:
+            with self._lock:
+                self.paused_seconds += waited
+        return waited
+
+    async def wait_async(self) -> float:
+        """Async version of wait() that yields to the event loop while waiting."""
+        import asyncio  # Already loaded whenever an event loop is running
+
+        waited = 0.0
+        while (delay := self._reserve()) > 0:
+            await asyncio.sleep(delay)
+            waited += delay
+        if waited:
+            with self._lock:
+                self.paused_seconds += waited
+        return waited
+
+    def record_success(self):
+        """Report a request the endpoint answered successfully."""
+        with self._lock:
+            self._consecutive_failures = 0
+            if self.state != "closed":
+                logging.warning("Circuit breaker closed: endpoint is responding again")
+            self.state = "closed"
+            self._current_timeout = self.reset_timeout
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        """Report an endpoint failure (server error, timeout or connection problem)."""
+        with self._lock:
+            self._consecutive_failures += 1
+            if self.state == "half_open":
+                # The probe failed: back off harder before the next one
+                self._current_timeout = min(self.max_reset_timeout, self._current_timeout * 2)
+            elif self.state == "open" or self._consecutive_failures < self.failure_threshold:
+                return
+            self.state = "open"
+            self._open_until = time.monotonic() + self._current_timeout
+            self._probe_in_flight = False
+            self.opens += 1
+            logging.warning(
+                f"Circuit breaker open after {self._consecutive_failures} consecutive endpoint failures; "
+                f"pausing dispatch for {self._current_timeout:.0f}s"
+            )
+
+    def record_inconclusive(self):
+        """
+        Report a request that failed for a reason that says nothing about the endpoint's
+        health (a 400, a 429 or unusable output).
+
+        The failure count and the breaker state are left alone; if the request was the
+        half-open probe, the next caller may probe instead.
+        """
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_outcome(self, error: Exception):
+        """Report a failed request, counting it against the endpoint only if it is an endpoint failure."""
+        if is_endpoint_failure(error):
+            self.record_failure()
+        else:
+            self.record_inconclusive()
+
+    def stats(self) -> dict:
+        """Return breaker statistics for end-of-run reporting."""
+        return {
+            "state": self.state,
+            "opens": self.opens,
+            "paused_seconds": round(self.paused_seconds, 3),
+        }
+
+
+_shared_breaker = None
+_shared_breaker_lock = threading.Lock()
+
+
+def get_shared_circuit_breaker() -> CircuitBreaker:
+    """Return the process-wide circuit breaker."""
+    global _shared_breaker
+    with _shared_breaker_lock:
+        if _shared_breaker is None:
+            _shared_breaker = CircuitBreaker()
+        return _shared_breaker
+
+
+def dead_letter_path(output_path: str) -> str:
+    return output_path + ".failed.jsonl"
+
+
+class DeadLetterFile:
+    """
+    Append-only JSONL record of items whose requests failed for good.
+
+    Each entry is keyed by the failed item (a recipe-cell hash, a prompt index, ...);
+    the latest entry per key wins. resolve() drops the entries of items that have since
+    succeeded.
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: JSONL file holding the entries (see dead_letter_path)
+        """
+        self.path = path
+        self._lock = threading.Lock()
+
+    def record(self, key: str, error: RequestFailedError, **details):
+        """
+        Append a failed item.
+
+        Args:
+            key: Identifier of the failed item
+            error: The final failure
+            **details: JSON-serializable fields needed to replay the item
+        """
+        entry = {
+            "key": key,
+            "category": error.category,
+            "attempts": error.attempts,
+            "error": str(error.cause)[:1000],
+            "failed_at": time.time(),
+            **details,
+        }
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def entries(self) -> Dict[str, dict]:
+        """Latest entry per failed item, in first-failure order."""
+        entries: Dict[str, dict] = {}
+        if not os.path.exists(self.path):
+            return entries
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    entries[entry["key"]] = entry
+        return entries
+
+    def resolve(self, keys: Iterable[str]) -> int:
+        """
+        Remove the entries of items that have succeeded since they failed.
+
+        Returns:
+            Number of items removed
+        """
+        keys = set(keys)
+        with self._lock:
+            entries = self.entries()
+            remaining = [entry for key, entry in entries.items() if key not in keys]
+            removed = len(entries) - len(remaining)
+            if not removed:
+                return 0
+            if not remaining:
+                os.remove(self.path)
+                return removed
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for entry in remaining:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            os.replace(tmp_path, self.path)
+        return removed
@@ -1,7 +1,69 @@
+import hashlib
+import heapq
 import json
-from itertools import permutations
+import math
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+import time
+from itertools import islice, permutations
+from typing import Iterator, List, Tuple
+from compact_records import SchemaTable, expand_record
+from elements import get_element_index
+from io_utils import dumps_line, loads
 
-def generate_all_combinations(elements):
+def element_case(element):
+    """Symbol case for an element ("cu", "CU" -> "Cu"); names become capitalized ("IRON" -> "Iron")."""
+    element = str(element).strip()
+    return element[:1].upper() + element[1:].lower()
+
+def canonical_elements(value):
+    """
+    Order- and case-insensitive form of an element value: its distinct elements in
+    symbol case, sorted.
+
+    Accepts the list format (["Mg", "Fe"]) and the comma format ("Mg, Fe") alike, so
+    "Mg,Fe", "fe, MG" and ["Fe", "Mg"] all give ("Fe", "Mg").
+    """
+    if isinstance(value, str):
+        value = value.split(",")
+    return tuple(sorted({element_case(element) for element in value} - {""}))
+
+def canonical_alternatives(elements):
+    """
+    Ground-truth alternatives of one element list in canonical order: the list format
+    and the comma format, as an exact-match checker expects them.
+    ["Mg", "fe"] -> [["Fe", "Mg"], "Fe,Mg"]
+    """
+    canonical = list(canonical_elements(elements))
+    return [canonical, ",".join(canonical)]
+
+def elements_match(answer, alternatives):
+    """
+    Check an el_inc/el_exc answer against the ground-truth alternatives of the field.
+
+    Works on canonical and expanded ground truth alike: every alternative is reduced to
+    its canonical form, so any ordering or case in either list or comma format matches
+    in O(n log n) instead of requiring one of the 2 * n! spelled-out permutations.
+
+    Args:
+        answer: Value produced by the model (list of elements or comma-separated string)
+        alternatives: Ground-truth list of accepted values ("" stands for "omitted")
+
+    Returns:
+        True if the answer names the same set of elements as some alternative
+    """
+    if answer is None or answer == "":
+        return "" in alternatives
+    target = canonical_elements(answer)
+    return any(
+        alternative != "" and canonical_elements(alternative) == target
+        for alternative in alternatives
+    )
+
+def generate_all_combinations(elements, max_alternatives=None):
     """
     Generate all possible combinations for a list of elements.
     For ["Fe", "Mg"], generates:
@@ -9,15 +71,21 @@ def generate_all_combinations(elements):
     - ["Mg", "Fe"] (reversed list)
     - "Fe,Mg" (comma-separated)
     - "Mg,Fe" (reversed comma-separated)
+
+    There are 2 * n! of them; with max_alternatives set, only the first
+    max_alternatives // 2 orderings are written in each format. Element symbols are
+    written in symbol case ("cu" -> "Cu").
     """
     if not elements or len(elements) == 0:
         return [elements]
+    elements = [element_case(element) if isinstance(element, str) else element for element in elements]
     
     combinations = []
+    per_format = None if max_alternatives is None else max(1, max_alternatives // 2)
     
     # Generate all permutations as lists
     if len(elements) > 1:
-        for perm in permutations(elements):
+        for perm in islice(permutations(elements), per_format):
             # Add list format
             combinations.append(list(perm))
     else:
@@ -26,7 +94,7 @@ def generate_all_combinations(elements):
     
     # Generate all permutations as comma-separated strings
     if len(elements) > 1:
-        for perm in permutations(elements):
+        for perm in islice(permutations(elements), per_format):
             # Add comma-separated format
             combinations.append(",".join(perm))
     else:
@@ -35,10 +103,17 @@ def generate_all_combinations(elements):
     
     return combinations
 
-def transform_element_field(data):
+def transform_element_field(data, expand=True, max_alternatives=None):
     """
-    Transform el_inc and el_exc fields from [["Fe", "Mg"]] 
-    to [["Fe", "Mg"], ["Mg", "Fe"], ["Fe,Mg"], ["Mg,Fe"]]
+    Transform el_inc and el_exc fields.
+
+    By default every ordering is spelled out in both formats for exact-match checkers
+    such as BFCL's, capped at max_alternatives per list:
+    [["Fe", "Mg"]] -> [["Fe", "Mg"], ["Mg", "Fe"], "Fe,Mg", "Mg,Fe"]
+
+    With expand=False each element list is replaced by its canonical ordering in both
+    formats (see canonical_alternatives), for harnesses that compare with elements_match:
+    [["Mg", "Fe"]] -> [["Fe", "Mg"], "Fe,Mg"]
     """
     if isinstance(data, dict):
         for key, value in data.items():
@@ -46,20 +121,22 @@ def transform_element_field(data):
             if key in ["el_inc", "el_exc"] and isinstance(value, list):
                 transformed = []
                 for item in value:
-                    if isinstance(item, list):
+                    if isinstance(item, list) and expand:
                         # Generate all combinations for this element list
-                        combinations = generate_all_combinations(item)
+                        combinations = generate_all_combinations(item, max_alternatives)
                         transformed.extend(combinations)
+                    elif isinstance(item, list) and item:
+                        transformed.extend(canonical_alternatives(item))
                     else:
                         # Keep non-list items as is
                         transformed.append(item)
                 data[key] = transformed
             elif isinstance(value, (dict, list)):
                 # Recursively process nested structures
-                transform_element_field(value)
+                transform_element_field(value, expand, max_alternatives)
     elif isinstance(data, list):
         for item in data:
-            transform_element_field(item)
+            transform_element_field(item, expand, max_alternatives)
     return data
 
 def transform_crystal_system(data):
@@ -87,52 +164,544 @@ def transform_crystal_system(data):
             transform_crystal_system(item)
     return data
 
-def process_jsonl_complete(input_file, output_file):
+def _element_alternatives(value, expand, max_alternatives):
+    transformed = []
+    for item in value:
+        if isinstance(item, list) and expand:
+            transformed.extend(generate_all_combinations(item, max_alternatives))
+        elif isinstance(item, list) and item:
+            transformed.extend(canonical_alternatives(item))
+        else:
+            transformed.append(item)
+    return transformed
+
+def transform_ground_truth(item, expand=True, max_alternatives=None, element_index=None):
+    """
+    Fused el_inc/el_exc and crystal_system transform of one record's ground truth.
+
+    Equivalent to transform_element_field followed by transform_crystal_system (and,
+    with element_index, ElementIndex.normalize_fields), but it only visits the call
+    arguments under "ground_truth" ({"ground_truth": [{function: {param: [values]}}]})
+    instead of walking the whole record, embedded function schemas included.
+
+    Returns:
+        Tuple of (the record, transformed in place; number of element lists capped at max_alternatives)
+    """
+    capped = 0
+    for call in item.get("ground_truth") or ():
+        if not isinstance(call, dict):
+            continue
+        for arguments in call.values():
+            if not isinstance(arguments, dict):
+                continue
+            for key, value in arguments.items():
+                if not isinstance(value, list):
+                    continue
+                if key == "el_inc" or key == "el_exc":
+                    if element_index is not None:
+                        value = element_index.normalize_value(value)
+                    if expand and max_alternatives is not None:
+                        capped += sum(
+                            1 for elements in value
+                            if isinstance(elements, list) and len(elements) > 1
+                            and 2 * math.factorial(len(elements)) > max_alternatives
+                        )
+                    arguments[key] = _element_alternatives(value, expand, max_alternatives)
+                elif key == "crystal_system" and len(value) == 1 and isinstance(value[0], str):
+                    arguments[key] = [value[0], [value[0]]]
+    return item, capped
+
+# Per-process state of the transform workers, set by _init_worker
+_worker_options = None
+
+
+def _init_worker(options):
+    global _worker_options
+    schema_path = options.pop("schema_path")
+    options["schema_table"] = SchemaTable(schema_path) if schema_path else None
+    options["element_index"] = get_element_index() if options.pop("normalize_elements") else None
+    _worker_options = options
+
+
+def _transform_lines(lines):
+    """Transform a chunk of JSONL lines; returns (output text, capped element lists)."""
+    options = _worker_options
+    schema_table = options["schema_table"]
+    out = []
+    capped = 0
+    for line in lines:
+        item, item_capped = transform_ground_truth(
+            loads(line), options["expand"], options["max_alternatives"], options["element_index"]
+        )
+        capped += item_capped
+        # Inline referenced function schemas only at the very end
+        if schema_table is not None:
+            item = expand_record(item, schema_table)
+        out.append(dumps_line(item) + '\n')
+    return "".join(out), capped
+
+
+def _chunks(lines, size):
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+# Records written by this repo start with their ID, which is read without a full parse
+_LEADING_ID = re.compile(r'\{\s*"id"\s*:\s*"([^"\\]*)"')
+
+
+def record_id(line):
+    """ID of the record on a JSONL line."""
+    match = _LEADING_ID.match(line)
+    return match.group(1) if match else loads(line)['id']
+
+
+def record_number(line):
+    """Numeric part of a JSONL line's record ID (e.g. "Mindat_v1_112" -> 112)."""
+    return int(record_id(line).split('_')[-1])
+
+
+def _write_run(lines: List[Tuple[int, int, str]], run_dir: str, index: int) -> str:
+    path = os.path.join(run_dir, f"run-{index:05d}.jsonl")
+    with open(path, 'w', encoding='utf-8') as f:
+        for _, _, line in lines:
+            f.write(line)
+    return path
+
+
+def _read_run(path: str, run_index: int) -> Iterator[Tuple[int, int, str]]:
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            # The run index breaks ties between runs, keeping the merge stable
+            yield record_number(line), run_index, line
+
+
+def iter_sorted_lines(input_file, chunk_size=100000, tmp_dir=None) -> Tuple[int, Iterator[str]]:
+    """
+    Stream the non-empty lines of a JSONL file in ascending record-ID order.
+
+    An input already in ID order is streamed as is. Otherwise the file is cut into
+    chunks of chunk_size lines, each chunk is sorted into a temporary run file, and the
+    runs are merged with a heap, so at most one chunk is held in memory. Input that fits
+    in one chunk is sorted in memory without temporary files. Records with equal IDs
+    keep their input order.
+
+    Args:
+        input_file: JSONL file whose records carry an "id" ending in "_<number>"
+        chunk_size: Lines per sorted run
+        tmp_dir: Directory for the run files (default: next to the input file)
+
+    Returns:
+        Tuple of (number of records, iterator over their lines, each ending in a newline)
+    """
+    count = 0
+    previous = None
+    in_order = True
+    with open(input_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                number = record_number(line)
+                if previous is not None and number < previous:
+                    in_order = False
+                previous = number
+                count += 1
+
+    def stream_input():
+        with open(input_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    yield line if line.endswith('\n') else line + '\n'
+
+    if in_order:
+        return count, stream_input()
+
+    def merge_runs():
+        run_dir = None
+        try:
+            runs = []
+            chunk = []
+            for line in stream_input():
+                chunk.append((record_number(line), len(chunk), line))
+                if len(chunk) >= chunk_size:
+                    chunk.sort()
+                    if run_dir is None:
+                        run_dir = tempfile.mkdtemp(
+                            prefix='bfcl-sort-', dir=tmp_dir or os.path.dirname(os.path.abspath(input_file))
+                        )
+                    runs.append(_write_run(chunk, run_dir, len(runs)))
+                    chunk = []
+            chunk.sort()
+            if not runs:
+                for _, _, line in chunk:
+                    yield line
+                return
+            if chunk:
+                runs.append(_write_run(chunk, run_dir, len(runs)))
+            chunk = []
+            for _, _, line in heapq.merge(*(_read_run(path, index) for index, path in enumerate(runs))):
+                yield line
+        finally:
+            if run_dir is not None:
+                shutil.rmtree(run_dir, ignore_errors=True)
+
+    return count, merge_runs()
+
+
+def process_jsonl_complete(input_file, output_file, schema_path=None, normalize_elements=False,
+                           chunk_size=100000, tmp_dir=None, expand_elements=True, max_alternatives=None,
+                           workers=1, task_size=2000, progress_every=10000):
     """
     Complete processing pipeline:
     1. Read and sort JSONL file by ID
     2. Transform el_inc and el_exc fields
     3. Transform crystal_system field
     4. Write to output file
+
+    Records are streamed: the sort is skipped for input already in ID order and is
+    otherwise an external merge sort over runs of chunk_size records (see
+    iter_sorted_lines), so memory stays flat however large the file is.
+
+    Compact records (see compact_records.py) are transformed without their function
+    schemas; pass schema_path to expand them into BFCL records while writing.
+
+    el_inc/el_exc lists get every ordering spelled out in list and comma format, as the
+    exact-match BFCL checker needs (2 * n! entries for n elements). Setting
+    max_alternatives caps each list at that many entries and reports the number of
+    capped lists; the default None writes every ordering. expand_elements=False
+    writes only the canonical (sorted) ordering in both formats instead, for harnesses
+    that compare with elements_match.
+
+    With normalize_elements=True, element names, case variants and misspellings in
+    el_inc/el_exc (e.g. "iron", "CU", "Sliver") are rewritten to their symbols before
+    the combinations are generated (see elements.ElementIndex).
+
+    The transforms only touch the ground-truth arguments (see transform_ground_truth)
+    and run on chunks of task_size records, across a pool of workers processes when
+    workers > 1; output order is preserved either way. Throughput is printed every
+    progress_every records.
     """
-    # Step 1: Read all lines and parse JSON
+    options = {
+        "schema_path": schema_path,
+        "normalize_elements": normalize_elements,
+        "expand": expand_elements,
+        "max_alternatives": max_alternatives,
+    }
+    # Step 1: Sort lines by the numeric part of the ID (e.g., "Mindat_v1_112" -> 112)
     print("Step 1: Reading and sorting data...")
-    data_list = []
-    with open(input_file, 'r', encoding='utf-8') as f:
-        for line in f:
-            if line.strip():  # Skip empty lines
-                data_list.append(json.loads(line))
+    started = time.perf_counter()
+    total, sorted_lines = iter_sorted_lines(input_file, chunk_size=chunk_size, tmp_dir=tmp_dir)
+    print(f"Sorting {total} records by ID")
     
-    # Step 2: Sort by ID in ascending order
-    # Extract numeric part from ID (e.g., "Mindat_v1_112" -> 112)
-    data_list.sort(key=lambda x: int(x['id'].split('_')[-1]))
-    print(f"Sorted {len(data_list)} records by ID")
-    
-    # Step 3: Transform each record and write to output
-    print("Step 2: Transforming el_inc and el_exc fields...")
+    # Steps 2-4 run as one fused pass over each record's ground truth
+    if expand_elements:
+        print("Step 2: Expanding el_inc and el_exc fields...")
+    else:
+        print("Step 2: Canonicalizing el_inc and el_exc fields...")
     print("Step 3: Transforming crystal_system fields...")
-    print("Step 4: Writing to output file...")
+    print(f"Step 4: Writing to output file ({workers} worker{'s' if workers != 1 else ''})...")
     
-    with open(output_file, 'w', encoding='utf-8') as f:
-        for idx, item in enumerate(data_list, 1):
-            # Apply element field transformation
-            item = transform_element_field(item)
-            # Apply crystal system transformation
-            item = transform_crystal_system(item)
-            # Write to output
-            f.write(json.dumps(item, ensure_ascii=False) + '\n')
-            
-            if idx % 100 == 0:
-                print(f"Processed {idx}/{len(data_list)} records...")
+    pool = None
+    if workers > 1:
+        pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(options,))
+        # imap keeps the chunks in input order
+        results = pool.imap(_transform_lines, _chunks(sorted_lines, task_size))
+    else:
+        _init_worker(dict(options))
+        results = map(_transform_lines, _chunks(sorted_lines, task_size))
     
+    done = 0
+    capped = 0
+    try:
+        with open(output_file, 'w', encoding='utf-8') as f:
+            for text, chunk_capped in results:
+                f.write(text)
+                capped += chunk_capped
+                previous, done = done, done + text.count('\n')
+                if done // progress_every > previous // progress_every:
+                    elapsed = time.perf_counter() - started
+                    print(f"Processed {done}/{total} records ({done / elapsed:.0f} records/sec)...")
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    
+    elapsed = time.perf_counter() - started
     print(f"\nProcessing complete!")
-    print(f"Total records processed: {len(data_list)}")
+    print(f"Total records processed: {total} in {elapsed:.2f}s ({total / elapsed if elapsed else 0:.0f} records/sec)")
+    if capped:
+        print(f"Warning: {capped} element lists had more than {max_alternatives} orderings and were cut short")
     print(f"Output saved to: {output_file}")
 
+# Incremental processing: <output>.processed.json holds the run options, the input size
+# with a digest of its last bytes, and the output size; <output>.processed.jsonl maps
+# every processed record ID to the hash of its input line (latest entry per ID wins).
+
+# Bytes before the recorded input size that are hashed to recognize the processed prefix
+TAIL_BYTES = 4096
+
+def processed_manifest_path(output_file):
+    return output_file + ".processed.json"
+
+
+def processed_records_path(output_file):
+    return output_file + ".processed.jsonl"
+
+
+def _line_hash(line: bytes) -> str:
+    return hashlib.blake2b(line.strip(), digest_size=8).hexdigest()
+
+
+def _read_tail(path, size):
+    """The TAIL_BYTES bytes before offset size (None if the file is shorter than size)."""
+    if os.path.getsize(path) < size:
+        return None
+    start = max(0, size - TAIL_BYTES)
+    with open(path, 'rb') as f:
+        f.seek(start)
+        return f.read(size - start)
+
+
+def _scan_input(input_file, start=0):
+    """Yield (id, number, content hash, line) for the non-empty lines from byte offset start."""
+    with open(input_file, 'rb') as f:
+        f.seek(start)
+        for raw in f:
+            if raw.strip():
+                line = raw.decode('utf-8')
+                rid = record_id(line)
+                yield rid, int(rid.split('_')[-1]), _line_hash(raw), line
+
+
+def _load_processed(output_file, options):
+    """The manifest of the last run, or None if it is missing, stale or from other options."""
+    path = processed_manifest_path(output_file)
+    records_path = processed_records_path(output_file)
+    if not (os.path.exists(path) and os.path.exists(records_path) and os.path.exists(output_file)):
+        return None
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (json.JSONDecodeError, OSError):
+        return None
+    if (manifest.get("options") != options
+            or manifest.get("output_size") != os.path.getsize(output_file)
+            or manifest.get("records_size") != os.path.getsize(records_path)):
+        return None
+    return manifest
+
+
+def _load_processed_records(output_file):
+    records = {}
+    with open(processed_records_path(output_file), 'rb') as f:
+        for line in f:
+            if line.strip():
+                entry = loads(line)
+                if entry["hash"] is None:
+                    records.pop(entry["id"], None)
+                else:
+                    records[entry["id"]] = entry["hash"]
+    return records
+
+
+def _save_processed(input_file, output_file, options, max_number, unique):
+    """Write the manifest header; call after the output and records sidecar are final."""
+    input_size = os.path.getsize(input_file)
+    tail = _read_tail(input_file, input_size)
+    manifest = {
+        "options": options,
+        "input_size": input_size,
+        "input_tail_sha256": hashlib.sha256(tail).hexdigest(),
+        # Only input ending in a newline can be extended by whole appended lines
+        "input_newline_terminated": not tail or tail.endswith(b'\n'),
+        "output_size": os.path.getsize(output_file),
+        "records_size": os.path.getsize(processed_records_path(output_file)),
+        "max_number": max_number,
+        "unique": unique,
+    }
+    path = processed_manifest_path(output_file)
+    with open(path + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(path + ".tmp", path)
+
+
+def _write_processed_records(output_file, entries, mode='w'):
+    with open(processed_records_path(output_file), mode, encoding='utf-8') as f:
+        for rid, content_hash in entries:
+            f.write(dumps_line({"id": rid, "hash": content_hash}) + '\n')
+
+
+def _transform_selected(lines, options):
+    """Transform a few input lines in this process; returns their output lines."""
+    _init_worker(dict(options))
+    text, capped = _transform_lines(lines)
+    if capped:
+        print(f"Warning: {capped} element lists had more than {options['max_alternatives']} orderings and were cut short")
+    return [line + '\n' for line in text.split('\n')[:-1]]
+
+
+def process_jsonl_incremental(input_file, output_file, schema_path=None, normalize_elements=False,
+                              expand_elements=True, max_alternatives=None, **kwargs):
+    """
+    Incremental variant of process_jsonl_complete for inputs that grow by small top-ups.
+
+    The IDs and content hashes of the processed input records are kept next to the
+    output (see processed_manifest_path). On later runs only new or changed records are
+    transformed:
+    - input that only grew by appended records with higher IDs is recognized by its
+      size and the digest of the bytes before the recorded size (like
+      checkpoint.ResumeManifest); only the new bytes are read and their output appended;
+    - otherwise the input is rescanned, changed and new records are transformed and
+      spliced into the existing output in ID order, and removed records are dropped.
+      The output is only rewritten from the first affected record on.
+    A full run (process_jsonl_complete) is done when there is no usable manifest, the
+    options changed, the output was modified outside this function, or IDs repeat.
+
+    Args:
+        input_file: Ground-truth JSONL file
+        output_file: Processed JSONL file
+        schema_path, normalize_elements, expand_elements, max_alternatives: As for
+            process_jsonl_complete
+        **kwargs: Further process_jsonl_complete arguments, used by full runs
+
+    Returns:
+        Dict with the mode used ("full", "unchanged", "append" or "splice") and the
+        number of records transformed and removed
+    """
+    options = {
+        "schema_path": schema_path,
+        "normalize_elements": normalize_elements,
+        "expand": expand_elements,
+        "max_alternatives": max_alternatives,
+    }
+    started = time.perf_counter()
+    manifest = _load_processed(output_file, options)
+    result = None
+    if manifest is not None and manifest["unique"]:
+        result = _try_append(input_file, output_file, options, manifest)
+        if result is None:
+            result = _splice(input_file, output_file, options, manifest)
+    if result is None:
+        print("No usable processing manifest: processing the whole file")
+        process_jsonl_complete(input_file, output_file, schema_path=schema_path,
+                               normalize_elements=normalize_elements, expand_elements=expand_elements,
+                               max_alternatives=max_alternatives, **kwargs)
+        entries = {}
+        max_number = -1
+        unique = True
+        for rid, number, content_hash, _ in _scan_input(input_file):
+            unique = unique and rid not in entries
+            entries[rid] = content_hash
+            max_number = max(max_number, number)
+        unique = unique and len({rid.split('_')[-1] for rid in entries}) == len(entries)
+        _write_processed_records(output_file, entries.items())
+        _save_processed(input_file, output_file, options, max_number, unique)
+        result = {"mode": "full", "transformed": len(entries), "removed": 0}
+    result["seconds"] = round(time.perf_counter() - started, 3)
+    print(f"Incremental processing: {result['mode']}, {result['transformed']} records transformed, "
+          f"{result['removed']} removed in {result['seconds']:.2f}s")
+    return result
+
+
+def _try_append(input_file, output_file, options, manifest):
+    """Handle input that is unchanged or only grew by records with new, higher IDs."""
+    previous_size = manifest["input_size"]
+    if not manifest["input_newline_terminated"]:
+        return None
+    tail = _read_tail(input_file, previous_size)
+    if tail is None or hashlib.sha256(tail).hexdigest() != manifest.get("input_tail_sha256"):
+        return None
+    if os.path.getsize(input_file) == previous_size:
+        return {"mode": "unchanged", "transformed": 0, "removed": 0}
+
+    new = sorted(_scan_input(input_file, start=previous_size), key=lambda entry: entry[1])
+    if not new:
+        _save_processed(input_file, output_file, options, manifest["max_number"], True)
+        return {"mode": "unchanged", "transformed": 0, "removed": 0}
+    numbers = [number for _, number, _, _ in new]
+    if numbers[0] <= manifest["max_number"] or len(set(numbers)) != len(numbers):
+        return None  # New records fall between existing ones: splice instead
+    lines = _transform_selected([line for _, _, _, line in new], options)
+    with open(output_file, 'a', encoding='utf-8') as f:
+        f.writelines(lines)
+    _write_processed_records(output_file, [(rid, content_hash) for rid, _, content_hash, _ in new], mode='a')
+    _save_processed(input_file, output_file, options, numbers[-1], True)
+    return {"mode": "append", "transformed": len(new), "removed": 0}
+
+
+def _splice(input_file, output_file, options, manifest):
+    """Transform new and changed records and merge them into the existing output by ID."""
+    previous = _load_processed_records(output_file)
+    current = {}
+    numbers = set()
+    changed = []
+    for rid, number, content_hash, line in _scan_input(input_file):
+        if rid in current or number in numbers:
+            return None  # Repeated IDs: only a full (stable) sort orders them like the input
+        current[rid] = content_hash
+        numbers.add(number)
+        if previous.get(rid) != content_hash:
+            changed.append((number, rid, line))
+    removed = previous.keys() - current.keys()
+    if not changed and not removed:
+        _save_processed(input_file, output_file, options, max(numbers, default=-1), True)
+        return {"mode": "unchanged", "transformed": 0, "removed": 0}
+
+    changed.sort()
+    transformed = _transform_selected([line for _, _, line in changed], options)
+    replaced = {rid for _, rid, _ in changed} | removed
+    inserts = [(number, line) for (number, _, _), line in zip(changed, transformed)]
+    first_insert = inserts[0][0] if inserts else math.inf
+    position = 0
+    tmp_path = output_file + ".splice.tmp"
+    with open(output_file, 'rb') as fin, open(tmp_path, 'w', encoding='utf-8') as fout:
+        # Output lines before the first replaced record or insert stay in place
+        offset = 0
+        while True:
+            raw = fin.readline()
+            if not raw:
+                break
+            line = raw.decode('utf-8')
+            if line.strip() and (record_id(line) in replaced or record_number(line) >= first_insert):
+                break
+            offset += len(raw)
+        fin.seek(offset)
+        for raw in fin:
+            line = raw.decode('utf-8')
+            if not line.strip() or record_id(line) in replaced:
+                continue
+            number = record_number(line)
+            while position < len(inserts) and inserts[position][0] < number:
+                fout.write(inserts[position][1])
+                position += 1
+            fout.write(line)
+        for _, line in inserts[position:]:
+            fout.write(line)
+    with open(tmp_path, 'rb') as fin, open(output_file, 'r+b') as fout:
+        fout.truncate(offset)
+        fout.seek(offset)
+        shutil.copyfileobj(fin, fout)
+    os.remove(tmp_path)
+    _write_processed_records(output_file, current.items())
+    _save_processed(input_file, output_file, options, max(numbers, default=-1), True)
+    return {"mode": "splice", "transformed": len(changed), "removed": len(removed)}
+
 # Main execution
 if __name__ == "__main__":
     input_file = 'test_input.jsonl'
     output_file = 'test_output.jsonl'
+    # Spell out every el_inc/el_exc ordering for the exact-match BFCL checker; False writes
+    # only the canonical ordering, for harnesses that compare with elements_match
+    expand_elements = True
+    # Cap on the alternatives written per element list (None: every ordering; lists of
+    # 7+ elements have over 10000)
+    max_alternatives = None
+    # Only transform records added or changed since the last run
+    incremental = False
     
     print("=" * 60)
     print("JSONL File Processing Pipeline")
@@ -141,4 +710,9 @@ if __name__ == "__main__":
     print(f"Output file: {output_file}")
     print("=" * 60)
     
-    process_jsonl_complete(input_file, output_file)
\ No newline at end of file
+    if incremental:
+        process_jsonl_incremental(input_file, output_file, expand_elements=expand_elements,
+                                  max_alternatives=max_alternatives)
+    else:
+        process_jsonl_complete(input_file, output_file, expand_elements=expand_elements,
+                               max_alternatives=max_alternatives)
\ No newline at end of file
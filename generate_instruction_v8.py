@@ -5,28 +5,60 @@ Generate diverse natural language queries by combining parameter recipes and sty
 
 Run:
 python generate_diverse_queries.py
+
+Offline batch mode:
+python generate_diverse_queries.py --batch-emit batch_requests.jsonl
+python generate_diverse_queries.py --batch-ingest batch_results.jsonl
+
+Re-run only the combinations whose requests failed permanently (<output>.failed.jsonl):
+python generate_diverse_queries.py --replay-failed
 """
-import time
-import json
+import argparse
+import asyncio
+import inspect
 import os
+import time
 from pathlib import Path
-from openai import AzureOpenAI
 import tqdm
-from dotenv import load_dotenv
-from pydantic import BaseModel
-from typing import List
-
-load_dotenv(override=True)
-
-# Azure OpenAI configuration
-azure_endpoint = os.getenv("AZURE_OPENAI_API_ENDPOINT")
-api_version = os.getenv("AZURE_OPENAI_API_VERSION")
-deployment_name = os.getenv("AZURE_DEPLOYMENT_NAME")
-
-client = AzureOpenAI(
-    azure_endpoint=azure_endpoint,
-    api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-    api_version=api_version,
+from dataclasses import dataclass
+from pydantic import BaseModel, ValidationError
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+from checkpoint import CellJournal, ResumeManifest, read_max_id, recipe_hash
+from compact_records import SchemaTable, schema_hash, schema_table_path
+from dedup import NearDuplicateFilter, seed_from_file
+from failures import (
+    PERMANENT,
+    REDUCE_LENGTH,
+    CircuitBreaker,
+    DeadLetterFile,
+    RequestFailedError,
+    TruncatedResponseError,
+    classify_error,
+    dead_letter_path,
+    get_shared_circuit_breaker,
+)
+from io_utils import dumps_line, loads
+from llm_cache import ResponseCache, get_shared_cache, make_cache_key
+from llm_client import get_async_client, get_client, get_deployment_name
+from metrics import CallMetrics, CallTimer, get_shared_metrics
+from quota import QuotaTracker, grid_targets
+from stream_json import IncrementalJSONParser
+from sharding import (
+    ShardSpec,
+    load_plan,
+    merge_shards,
+    parse_shard_arg,
+    plan_path,
+    plan_shards,
+    save_plan,
+    shard_filename,
+)
+from rate_limiter import (
+    AdaptiveRateLimiter,
+    estimate_request_tokens,
+    get_retry_after,
+    get_shared_rate_limiter,
+    is_rate_limit_error,
 )
 
 # Fixed parameter recipes
@@ -171,24 +203,42 @@ FIXED_FUNCTION_SCHEMA = {
 }
 
 
-# Pydantic model for structured output
+# Content hash used by compact records to reference FIXED_FUNCTION_SCHEMA
+FIXED_FUNCTION_SCHEMA_REF = schema_hash(FIXED_FUNCTION_SCHEMA)
+
+
+# Pydantic models for structured output
 class QueryList(BaseModel):
     queries: List[str]
 
 
+class CellQueries(BaseModel):
+    cell_id: str
+    queries: List[str]
+
+
+class PackedQueryList(BaseModel):
+    cells: List[CellQueries]
+
+
 def load_prompt_template(prompt_path: str) -> str:
     """Load prompt template from file."""
     with open(prompt_path, "r") as f:
         return f.read().strip()
 
 
-def extract_max_id_from_file(file_path: str, id_prefix: str) -> int:
+def extract_max_id_from_file(file_path: str, id_prefix: str, journal: Optional[CellJournal] = None) -> int:
     """
     Extract the maximum ID from an existing JSONL file.
     
+    The ID is served from the file's resume manifest when the manifest still matches
+    the file; otherwise it is read from the file (only its tail when the journal shows
+    the file is in append order) and the manifest refreshed.
+    
     Args:
         file_path: Path to the existing JSONL file
         id_prefix: ID prefix to match (e.g., "Mindat_v1" or "Mindat_invalid_v1")
+        journal: Cell journal of the file (defaults to the file's sidecar journal)
         
     Returns:
         Maximum ID found in the file with matching prefix, or -1 if file doesn't exist or is empty
@@ -196,27 +246,14 @@ def extract_max_id_from_file(file_path: str, id_prefix: str) -> int:
     if not os.path.exists(file_path):
         return -1
     
-    max_id = -1
+    manifest = ResumeManifest(file_path)
+    max_id = manifest.lookup(id_prefix)
+    if max_id is not None:
+        return max_id
+    
     try:
-        with open(file_path, "r") as f:
-            for line in f:
-                line = line.strip()
-                if not line:
-                    continue
-                try:
-                    record = json.loads(line)
-                    # Extract numeric ID from format "{id_prefix}_{id}"
-                    if "id" in record:
-                        id_str = record["id"]
-                        # Check if the ID starts with the expected prefix
-                        if id_str.startswith(f"{id_prefix}_"):
-                            # Extract number after the prefix
-                            numeric_part = id_str[len(id_prefix) + 1:]
-                            numeric_id = int(numeric_part)
-                            max_id = max(max_id, numeric_id)
-                except (json.JSONDecodeError, ValueError) as e:
-                    print(f"Warning: Could not parse line: {line[:50]}... Error: {e}")
-                    continue
+        max_id = read_max_id(file_path, id_prefix, journal or CellJournal(file_path))
+        manifest.update(id_prefix, max_id)
     except Exception as e:
         print(f"Warning: Error reading file {file_path}: {e}")
         return -1
@@ -224,14 +261,489 @@ def extract_max_id_from_file(file_path: str, id_prefix: str) -> int:
     return max_id
 
 
+def format_cell_prompt(prompt_template: str, param_recipe: str, style_recipe: str, num_queries: int) -> str:
+    """Format the prompt for a single parameter-style combination."""
+    return prompt_template.format(
+        params=param_recipe,
+        style=style_recipe,
+        num_queries=num_queries
+    )
+
+
+def packed_cell_id(index: int) -> str:
+    """Cell ID used inside a packed prompt for the index-th cell of the pack."""
+    return f"cell_{index}"
+
+
+def build_packed_prompt(prompt_template: str, cells: List[Tuple[str, str]], num_queries: int) -> str:
+    """
+    Format one prompt that asks for queries for several parameter-style combinations.
+    
+    The shared template text is sent once; each cell is listed with its own cell_id,
+    parameter recipe and style recipe.
+    
+    Args:
+        prompt_template: Template string with {params}, {style}, and {num_queries} placeholders
+        cells: (param_recipe, style_recipe) pairs to pack into the prompt
+        num_queries: Number of queries to generate per cell
+        
+    Returns:
+        Formatted packed prompt
+    """
+    lines = [
+        prompt_template.format(
+            params="the Target Parameters given for each cell below",
+            style="the Query Style given for each cell below",
+            num_queries=num_queries
+        ),
+        "",
+        f"This request covers {len(cells)} independent cells. For every cell, generate exactly "
+        f"{num_queries} queries that follow that cell's Target Parameters and Query Style, "
+        f"and return them under the cell's cell_id.",
+        "",
+    ]
+    for index, (param_recipe, style_recipe) in enumerate(cells):
+        lines.append(f"cell_id: {packed_cell_id(index)}")
+        lines.append(f"  * Target Parameters: {param_recipe}")
+        lines.append(f"  * Query Style: {style_recipe}")
+        lines.append("")
+    return "\n".join(lines).rstrip()
+
+
+def split_packed_response(packed: Optional[PackedQueryList], num_cells: int) -> List[List[str]]:
+    """
+    Map a packed response back to per-cell query lists, in pack order.
+    
+    Unknown or repeated cell IDs are ignored; cells the model skipped get an empty list.
+    """
+    results = [[] for _ in range(num_cells)]
+    if packed is None:
+        return results
+    cell_indices = {packed_cell_id(index): index for index in range(num_cells)}
+    for cell_queries in packed.cells:
+        index = cell_indices.get(cell_queries.cell_id.strip())
+        if index is not None and not results[index]:
+            results[index] = cell_queries.queries
+    return results
+
+
+def plan_cells_per_call(
+    cells_per_call: int,
+    num_queries: int,
+    max_tokens: int,
+    tokens_per_query: int = 48
+) -> int:
+    """
+    Cap the requested packing density so a packed response fits in max_tokens.
+    
+    Args:
+        cells_per_call: Requested number of cells per API call
+        num_queries: Number of queries per cell
+        max_tokens: Maximum tokens for generation
+        tokens_per_query: Budgeted output tokens per query, including JSON overhead
+        
+    Returns:
+        Number of cells to pack into each call (at least 1)
+    """
+    # Each cell also costs a few tokens for its cell_id and list structure
+    tokens_per_cell = num_queries * tokens_per_query + 16
+    return max(1, min(cells_per_call, max_tokens // tokens_per_cell))
+
+
+@dataclass
+class PackingStats:
+    """Call and token accounting for tuning how many cells are packed into each call."""
+    calls: int = 0
+    cells: int = 0
+    total_tokens: int = 0
+    accepted_queries: int = 0
+    
+    def record_call(self, num_cells: int, total_tokens: int):
+        self.calls += 1
+        self.cells += num_cells
+        self.total_tokens += total_tokens
+    
+    @property
+    def calls_saved(self) -> int:
+        return self.cells - self.calls
+    
+    @property
+    def tokens_per_accepted_query(self) -> float:
+        return self.total_tokens / self.accepted_queries if self.accepted_queries else 0.0
+
+
+def load_cached_response(response_cache: ResponseCache, cache_key: str, response_format):
+    """Return a cached structured response, treating unreadable entries as misses."""
+    cached = response_cache.get(cache_key)
+    if cached is None:
+        return None
+    try:
+        return response_format.model_validate(cached)
+    except ValidationError:
+        return None
+
+
+class QueryStream:
+    """
+    Extracts finished queries from a streamed QueryList or PackedQueryList response.
+    
+    A QueryList yields each query as soon as its string is closed. A PackedQueryList
+    yields a cell's queries once the cell's object is closed (its cell_id may follow
+    the queries); cells with unknown or repeated IDs are ignored, as in
+    split_packed_response.
+    """
+    
+    def __init__(self, response_format, num_cells: int = 1):
+        self.parser = IncrementalJSONParser()
+        self.packed = response_format is PackedQueryList
+        self.cell_indices = {packed_cell_id(index): index for index in range(num_cells)}
+        self.seen_cells = set()
+    
+    def feed(self, text: str) -> List[Tuple[int, List[str]]]:
+        """Return (cell position, queries) for every query or packed cell completed by text."""
+        finished = []
+        for path, value in self.parser.feed(text):
+            if not self.packed:
+                if len(path) == 2 and path[0] == "queries" and isinstance(value, str):
+                    finished.append((0, [value]))
+            elif len(path) == 2 and path[0] == "cells" and isinstance(value, dict):
+                index = self.cell_indices.get(str(value.get("cell_id", "")).strip())
+                queries = [query for query in value.get("queries") or [] if isinstance(query, str)]
+                if index is not None and index not in self.seen_cells and queries:
+                    self.seen_cells.add(index)
+                    finished.append((index, queries))
+        return finished
+
+
+class StreamedResponse:
+    """Accumulates a streamed structured-output response, forwarding finished queries to a sink."""
+    
+    def __init__(self, response_format, query_sink, timer: CallTimer):
+        self.response_format = response_format
+        self.query_sink = query_sink
+        self.timer = timer
+        self.stream = QueryStream(response_format, query_sink.num_cells)
+        self.parts = []
+        self.usage = None
+        self.finish_reason = None
+    
+    def add_chunk(self, chunk):
+        if chunk.usage is not None:
+            self.usage = chunk.usage
+        for choice in chunk.choices:
+            if choice.index != 0:
+                continue
+            if choice.finish_reason:
+                self.finish_reason = choice.finish_reason
+            text = choice.delta.content if choice.delta is not None else None
+            if not text:
+                continue
+            self.parts.append(text)
+            for position, queries in self.stream.feed(text):
+                self.timer.mark_first_query()
+                self.query_sink.add(position, queries)
+                if self.stream.packed:
+                    self.query_sink.close_cell(position)
+    
+    def result(self) -> BaseModel:
+        """Validate the complete response against the response format."""
+        if self.finish_reason == "length":
+            raise TruncatedResponseError("Streamed response was cut off at max_tokens")
+        return self.response_format.model_validate_json("".join(self.parts))
+
+
+def streaming_request(
+    formatted_prompt: str,
+    response_format,
+    model_name: str,
+    temperature: float,
+    max_tokens: int
+) -> dict:
+    """chat.completions.create arguments for a streamed structured-output request."""
+    return dict(
+        model=model_name,
+        messages=[{"role": "user", "content": formatted_prompt}],
+        response_format=strict_json_schema_format(response_format),
+        temperature=temperature,
+        max_tokens=max_tokens,
+        stream=True,
+        stream_options={"include_usage": True}
+    )
+
+
+def emit_cached_queries(query_sink, parsed: BaseModel):
+    """Pass a cached response to a query sink as if it had just been streamed."""
+    if isinstance(parsed, PackedQueryList):
+        for position, queries in enumerate(split_packed_response(parsed, query_sink.num_cells)):
+            query_sink.add(position, queries)
+            query_sink.close_cell(position)
+    else:
+        query_sink.add(0, parsed.queries)
+
+
+class StructuredCall:
+    """
+    Transport-independent part of one structured-output request.
+    
+    Holds the cache lookup, the request arguments, the success accounting and the
+    failure handling (classification, circuit breaker, retry budget and backoff), so
+    call_structured_output and acall_structured_output only add the API call itself and
+    the (a)synchronous waits.
+    """
+    
+    def __init__(
+        self,
+        formatted_prompt: str,
+        response_format,
+        model_name: Optional[str] = None,
+        temperature: float = 1.0,
+        max_tokens: int = 3072,
+        rate_limiter: Optional[AdaptiveRateLimiter] = None,
+        max_retries: int = 5,
+        cache: Optional[ResponseCache] = None,
+        metrics: Optional[CallMetrics] = None,
+        cell: Optional[str] = None,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+        query_sink=None
+    ):
+        self.formatted_prompt = formatted_prompt
+        self.response_format = response_format
+        self.model_name = model_name or get_deployment_name()
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.max_retries = max_retries
+        self.query_sink = query_sink
+        # Identical prompts are served from the on-disk cache without an API call
+        self.response_cache = cache or get_shared_cache()
+        self.cache_key = make_cache_key(formatted_prompt, self.model_name, temperature, max_tokens, response_format)
+        self.timer = CallTimer(metrics or get_shared_metrics(), "structured_output", self.model_name, cell)
+        self.limiter = rate_limiter or get_shared_rate_limiter()
+        self.breaker = circuit_breaker or get_shared_circuit_breaker()
+        self.attempt = 0
+        self.reserved_tokens = 0
+    
+    def cached_response(self) -> Optional[BaseModel]:
+        """Serve the call from the response cache (passing it to the query sink), or None on a miss."""
+        cached = load_cached_response(self.response_cache, self.cache_key, self.response_format)
+        if cached is not None:
+            if self.query_sink is not None:
+                emit_cached_queries(self.query_sink, cached)
+            self.timer.finish(cache_hit=True)
+        return cached
+    
+    def reserve_tokens(self) -> int:
+        """Token estimate of the next attempt, to acquire from the rate limiter."""
+        self.reserved_tokens = estimate_request_tokens(self.formatted_prompt, self.max_tokens)
+        return self.reserved_tokens
+    
+    def parse_arguments(self) -> dict:
+        """beta.chat.completions.parse arguments of a non-streamed attempt."""
+        return dict(
+            model=self.model_name,
+            messages=[{"role": "user", "content": self.formatted_prompt}],
+            response_format=self.response_format,
+            temperature=self.temperature,
+            max_tokens=self.max_tokens
+        )
+    
+    def stream_arguments(self) -> dict:
+        """chat.completions.create arguments of a streamed attempt."""
+        return streaming_request(
+            self.formatted_prompt, self.response_format, self.model_name, self.temperature, self.max_tokens
+        )
+    
+    def new_stream(self) -> StreamedResponse:
+        """Accumulator for the chunks of a streamed attempt."""
+        return StreamedResponse(self.response_format, self.query_sink, self.timer)
+    
+    def succeed(self, parsed: Optional[BaseModel], usage) -> Tuple[BaseModel, int]:
+        """
+        Account for a completed attempt and cache its response.
+        
+        Raises:
+            ValueError: If the response could not be parsed (handled like any failed attempt)
+        """
+        if parsed is None:
+            # Unusable output says nothing about the endpoint or the rate limit
+            self.breaker.record_inconclusive()
+            raise ValueError("Response could not be parsed into the requested format")
+        total_tokens = getattr(usage, "total_tokens", None)
+        self.limiter.record_success(total_tokens, self.reserved_tokens)
+        self.breaker.record_success()
+        self.response_cache.put(self.cache_key, parsed.model_dump())
+        self.timer.finish(usage=usage)
+        return parsed, total_tokens or 0
+    
+    def fail(self, error: Exception, usage=None) -> float:
+        """
+        Decide how to go on after a failed attempt.
+        
+        Returns:
+            Seconds to sleep before the next attempt
+            
+        Raises:
+            RequestFailedError: If the failure is permanent or the retry budget is spent
+        """
+        category = classify_error(error)
+        self.breaker.record_outcome(error)
+        if self.query_sink is not None:
+            # The next attempt streams the unfinished cells again from their start
+            self.query_sink.reset_attempt()
+        if category == PERMANENT or self.attempt >= self.max_retries:
+            print(f"Error generating queries ({category}, giving up after {self.attempt + 1} attempts): {error}")
+            self.timer.finish(usage=usage, success=False)
+            raise RequestFailedError(category, self.attempt + 1, error) from error
+        delay = 0.0
+        if is_rate_limit_error(error):
+            # The limiter holds back the next acquire() for the retry delay
+            retry_delay = self.limiter.record_rate_limit(self.attempt, get_retry_after(error))
+            print(f"Rate limited, retrying in {retry_delay:.1f}s...")
+        elif category == REDUCE_LENGTH:
+            self.max_tokens = int(self.max_tokens * 0.8)
+            print(f"Context length exceeded, retrying with max_tokens={self.max_tokens}...")
+        else:
+            delay = self.limiter.backoff_delay(self.attempt)
+            print(f"Request failed ({error}), retrying in {delay:.1f}s...")
+            self.limiter.record_backoff(delay)
+            self.timer.throttle_wait += delay
+        self.attempt += 1
+        self.timer.retries += 1
+        return delay
+
+
+def call_structured_output(
+    formatted_prompt: str,
+    response_format,
+    model_name: Optional[str] = None,
+    temperature: float = 1.0,
+    max_tokens: int = 3072,
+    rate_limiter: Optional[AdaptiveRateLimiter] = None,
+    max_retries: int = 5,
+    cache: Optional[ResponseCache] = None,
+    metrics: Optional[CallMetrics] = None,
+    cell: Optional[str] = None,
+    circuit_breaker: Optional[CircuitBreaker] = None,
+    query_sink=None
+) -> Tuple[BaseModel, int]:
+    """
+    Send one structured-output request through the response cache and rate limiter.
+    
+    Failures are classified (see failures.classify_error): retryable ones are retried
+    with backoff, context-length errors are retried with a smaller max_tokens, and
+    permanent failures or an exhausted retry budget raise RequestFailedError.
+    
+    Args:
+        formatted_prompt: Fully formatted user prompt
+        response_format: Pydantic model the response is parsed into
+        model_name: Model name to use (defaults to AZURE_DEPLOYMENT_NAME)
+        temperature: Sampling temperature
+        max_tokens: Maximum tokens for generation
+        rate_limiter: Limiter to budget requests against (defaults to the shared limiter)
+        max_retries: Number of retries after a retryable or context-length failure
+        cache: Response cache to consult first (defaults to the shared cache)
+        metrics: Collector the call is recorded in (defaults to the shared collector)
+        cell: Recipe hash(es) the call serves, attached to its metrics record
+        circuit_breaker: Breaker that pauses dispatch while the endpoint is failing
+            (defaults to the shared breaker)
+        query_sink: Stream the response and pass each query to query_sink.add() as soon
+            as it is complete (see StreamingPackWriter); after a failed attempt
+            query_sink.reset_attempt() takes back what it streamed for unfinished cells
+        
+    Returns:
+        Tuple of (parsed response, total tokens billed)
+        
+    Raises:
+        RequestFailedError: If the request failed permanently or ran out of retries
+    """
+    call = StructuredCall(
+        formatted_prompt, response_format, model_name, temperature, max_tokens, rate_limiter,
+        max_retries, cache, metrics, cell, circuit_breaker, query_sink
+    )
+    cached = call.cached_response()
+    if cached is not None:
+        return cached, 0
+    
+    while True:
+        call.timer.throttle_wait += call.breaker.wait()
+        call.timer.throttle_wait += call.limiter.acquire(call.reserve_tokens())
+        usage = None
+        try:
+            if query_sink is None:
+                # Call API with structured output
+                completion = get_client().beta.chat.completions.parse(**call.parse_arguments())
+                usage = completion.usage
+                parsed = completion.choices[0].message.parsed
+            else:
+                # Stream the response and hand over each query as soon as it is complete
+                streamed = call.new_stream()
+                for chunk in get_client().chat.completions.create(**call.stream_arguments()):
+                    streamed.add_chunk(chunk)
+                usage = streamed.usage
+                parsed = streamed.result()
+            return call.succeed(parsed, usage)
+        except Exception as e:
+            delay = call.fail(e, usage)
+            if delay:
+                time.sleep(delay)
+
+
+async def acall_structured_output(
+    formatted_prompt: str,
+    response_format,
+    model_name: Optional[str] = None,
+    temperature: float = 1.0,
+    max_tokens: int = 3072,
+    rate_limiter: Optional[AdaptiveRateLimiter] = None,
+    max_retries: int = 5,
+    cache: Optional[ResponseCache] = None,
+    metrics: Optional[CallMetrics] = None,
+    cell: Optional[str] = None,
+    circuit_breaker: Optional[CircuitBreaker] = None,
+    query_sink=None
+) -> Tuple[BaseModel, int]:
+    """Async version of call_structured_output using the async client."""
+    call = StructuredCall(
+        formatted_prompt, response_format, model_name, temperature, max_tokens, rate_limiter,
+        max_retries, cache, metrics, cell, circuit_breaker, query_sink
+    )
+    cached = call.cached_response()
+    if cached is not None:
+        return cached, 0
+    
+    while True:
+        call.timer.throttle_wait += await call.breaker.wait_async()
+        call.timer.throttle_wait += await call.limiter.acquire_async(call.reserve_tokens())
+        usage = None
+        try:
+            if query_sink is None:
+                completion = await get_async_client().beta.chat.completions.parse(**call.parse_arguments())
+                usage = completion.usage
+                parsed = completion.choices[0].message.parsed
+            else:
+                streamed = call.new_stream()
+                async for chunk in await get_async_client().chat.completions.create(**call.stream_arguments()):
+                    streamed.add_chunk(chunk)
+                usage = streamed.usage
+                parsed = streamed.result()
+            return call.succeed(parsed, usage)
+        except Exception as e:
+            delay = call.fail(e, usage)
+            if delay:
+                await asyncio.sleep(delay)
+
+
 def generate_queries_with_structured_output(
     prompt_template: str,
     param_recipe: str,
     style_recipe: str,
     num_queries: int,
-    model_name: str = deployment_name,
+    model_name: Optional[str] = None,
     temperature: float = 1.0,
-    max_tokens: int = 3072
+    max_tokens: int = 3072,
+    rate_limiter: Optional[AdaptiveRateLimiter] = None,
+    max_retries: int = 5,
+    cache: Optional[ResponseCache] = None,
+    circuit_breaker: Optional[CircuitBreaker] = None
 ) -> List[str]:
     """
     Generate multiple queries using structured output.
@@ -244,39 +756,97 @@ def generate_queries_with_structured_output(
         model_name: Model name to use
         temperature: Sampling temperature
         max_tokens: Maximum tokens for generation
+        rate_limiter: Limiter to budget requests against (defaults to the shared limiter)
+        max_retries: Number of retries after a retryable or context-length failure
+        cache: Response cache to consult first (defaults to the shared cache)
+        circuit_breaker: Breaker that pauses dispatch while the endpoint is failing
         
     Returns:
         List of generated query strings
+        
+    Raises:
+        RequestFailedError: If the request failed permanently or ran out of retries
     """
-    # Format the prompt with parameters, style, and number of queries
-    formatted_prompt = prompt_template.format(
-        params=param_recipe,
-        style=style_recipe,
-        num_queries=num_queries
+    query_list, _ = call_structured_output(
+        format_cell_prompt(prompt_template, param_recipe, style_recipe, num_queries),
+        QueryList,
+        model_name=model_name,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        rate_limiter=rate_limiter,
+        max_retries=max_retries,
+        cache=cache,
+        circuit_breaker=circuit_breaker
     )
+    return query_list.queries
+
+
+def cell_pack_request(prompt_template: str, cells: List[Tuple[str, str]], num_queries: int) -> Tuple[str, type]:
+    """
+    Prompt and response format of the call generating one or more cells.
     
-    try:
-        # Call API with structured output
-        completion = client.beta.chat.completions.parse(
-            model=model_name,
-            messages=[
-                {"role": "user", "content": formatted_prompt}
-            ],
-            response_format=QueryList,
-            temperature=temperature,
-            max_tokens=max_tokens
-        )
+    A single cell uses the plain QueryList prompt; several cells are packed into one
+    prompt answered with a PackedQueryList keyed by cell ID.
+    """
+    if len(cells) == 1:
+        param_recipe, style_recipe = cells[0]
+        return format_cell_prompt(prompt_template, param_recipe, style_recipe, num_queries), QueryList
+    return build_packed_prompt(prompt_template, cells, num_queries), PackedQueryList
+
+
+def cell_pack_results(parsed: BaseModel, num_cells: int) -> List[List[str]]:
+    """One list of queries per cell of the pack, in pack order."""
+    if isinstance(parsed, PackedQueryList):
+        return split_packed_response(parsed, num_cells)
+    return [parsed.queries]
+
+
+def generate_cell_pack(
+    prompt_template: str,
+    cells: List[Tuple[str, str]],
+    num_queries: int,
+    packing_stats: PackingStats,
+    **call_kwargs
+) -> List[List[str]]:
+    """
+    Generate queries for one or more cells with a single structured-output call.
+    
+    Args:
+        prompt_template: Template string with {params}, {style}, and {num_queries} placeholders
+        cells: (param_recipe, style_recipe) pairs to generate for
+        num_queries: Number of queries to generate per cell
+        packing_stats: Accumulates calls and tokens for the run
+        **call_kwargs: Forwarded to call_structured_output
         
-        # Extract queries from structured response
-        query_list = completion.choices[0].message.parsed
-        return query_list.queries
+    Returns:
+        One list of queries per cell, in the order of `cells`
         
-    except Exception as e:
-        print(f"Error generating queries: {e}")
-        return []
+    Raises:
+        RequestFailedError: If the call failed permanently or ran out of retries
+    """
+    parsed, total_tokens = call_structured_output(
+        *cell_pack_request(prompt_template, cells, num_queries), **call_kwargs
+    )
+    packing_stats.record_call(len(cells), total_tokens)
+    return cell_pack_results(parsed, len(cells))
+
+
+async def agenerate_cell_pack(
+    prompt_template: str,
+    cells: List[Tuple[str, str]],
+    num_queries: int,
+    packing_stats: PackingStats,
+    **call_kwargs
+) -> List[List[str]]:
+    """Async version of generate_cell_pack using the async client."""
+    parsed, total_tokens = await acall_structured_output(
+        *cell_pack_request(prompt_template, cells, num_queries), **call_kwargs
+    )
+    packing_stats.record_call(len(cells), total_tokens)
+    return cell_pack_results(parsed, len(cells))
 
 
-def create_training_record(query: str, record_id: int, id_prefix: str) -> dict:
+def create_training_record(query: str, record_id: int, id_prefix: str, compact: bool = False) -> dict:
     """
     Create a training record in the required format.
     
@@ -284,10 +854,17 @@ def create_training_record(query: str, record_id: int, id_prefix: str) -> dict:
         query: Generated natural language query
         record_id: Sequential ID for the record
         id_prefix: Prefix for the record ID (e.g., "Mindat_v1" or "Mindat_invalid_v1")
+        compact: Reference the function schema by hash instead of embedding it
         
     Returns:
         Dictionary in the required training format
     """
+    if compact:
+        return {
+            "id": f"{id_prefix}_{record_id}",
+            "question": [[{"role": "user", "content": query}]],
+            "function_ref": [FIXED_FUNCTION_SCHEMA_REF]
+        }
     return {
         "id": f"{id_prefix}_{record_id}",
         "question": [[{"role": "user", "content": query}]],
@@ -295,7 +872,21 @@ def create_training_record(query: str, record_id: int, id_prefix: str) -> dict:
     }
 
 
-def generate_diverse_training_data(
+def load_generation_template(prompt_path: str) -> str:
+    """Load the prompt template and append the instruction about the number of queries."""
+    # Load prompt template
+    prompt_template = load_prompt_template(prompt_path)
+    
+    # Ensure prompt has required placeholders and add num_queries instruction
+    if "{params}" not in prompt_template or "{style}" not in prompt_template:
+        raise ValueError("Prompt template must contain {params} and {style} placeholders")
+    
+    # Append instruction about number of queries to generate
+    prompt_template += f"\n\nGenerate exactly {{num_queries}} diverse queries following the above criteria."
+    return prompt_template
+
+
+def prepare_generation_run(
     prompt_path: str,
     output_dir: str,
     output_filename: str,
@@ -303,12 +894,13 @@ def generate_diverse_training_data(
     style_recipes: List[str],
     id_prefix: str,
     num_queries_per_combination: int,
-    model_name: str = deployment_name,
-    temperature: float = 1.0,
-    max_tokens: int = 3072
-):
+    start_id: int = 0
+) -> Tuple[str, str, int, str, CellJournal]:
     """
-    Generate diverse training data by iterating through all parameter-style combinations.
+    Load the prompt template and work out where a generation run should start.
+    
+    Records written after the last checkpointed cell (an interrupted cell) are
+    discarded so the cell can be regenerated without leaving duplicates behind.
     
     Args:
         prompt_path: Path to prompt template file
@@ -318,26 +910,25 @@ def generate_diverse_training_data(
         style_recipes: List of style recipes to use
         id_prefix: Prefix for record IDs (e.g., "Mindat_v1" or "Mindat_invalid_v1")
         num_queries_per_combination: Number of queries to generate per combination
-        model_name: Model name to use
-        temperature: Sampling temperature
-        max_tokens: Maximum tokens for generation
+        start_id: ID of the first record when the file has none yet (a shard's reserved range)
+        
+    Returns:
+        Tuple of (prompt_template, output_path, first record ID, file mode, cell journal)
     """
-    # Load prompt template
-    prompt_template = load_prompt_template(prompt_path)
-    
-    # Ensure prompt has required placeholders and add num_queries instruction
-    if "{params}" not in prompt_template or "{style}" not in prompt_template:
-        raise ValueError("Prompt template must contain {params} and {style} placeholders")
-    
-    # Append instruction about number of queries to generate
-    prompt_template += f"\n\nGenerate exactly {{num_queries}} diverse queries following the above criteria."
+    prompt_template = load_generation_template(prompt_path)
     
     # Create output directory
     os.makedirs(output_dir, exist_ok=True)
     output_path = os.path.join(output_dir, output_filename)
     
+    # Drop records of a cell that was interrupted before it was checkpointed
+    journal = CellJournal(output_path)
+    discarded_bytes = journal.discard_partial_output()
+    if discarded_bytes:
+        print(f"Discarded {discarded_bytes} bytes of records written after the last checkpoint")
+    
     # Check if output file exists and extract maximum ID
-    max_existing_id = extract_max_id_from_file(output_path, id_prefix)
+    max_existing_id = extract_max_id_from_file(output_path, id_prefix, journal)
     
     if max_existing_id >= 0:
         # File exists with valid IDs
@@ -348,52 +939,1293 @@ def generate_diverse_training_data(
         print(f"Starting new records from ID: {record_id}")
     else:
         # File doesn't exist or has no valid IDs with this prefix
-        record_id = 0
+        record_id = start_id
         file_mode = "w"  # Write mode (overwrite)
+        # Checkpoints and cached IDs of an overwritten file are meaningless
+        journal.reset()
+        ResumeManifest(output_path).reset()
         print(f"No existing file found or no records with prefix '{id_prefix}'")
         print(f"Starting new records from ID: {record_id}")
     
     # Calculate total combinations
     total_combinations = len(param_recipes) * len(style_recipes)
+    completed_combinations = sum(
+        journal.is_complete(
+            recipe_hash(param_recipe, style_recipe, id_prefix, num_queries_per_combination),
+            num_queries_per_combination
+        )
+        for param_recipe in param_recipes
+        for style_recipe in style_recipes
+    )
+    pending_combinations = total_combinations - completed_combinations
     print(f"\nTotal combinations: {total_combinations}")
+    if completed_combinations:
+        print(f"Already completed (skipped): {completed_combinations}")
     print(f"Queries per combination: {num_queries_per_combination}")
-    print(f"Total queries to generate: {total_combinations * num_queries_per_combination}")
+    print(f"Total queries to generate: {pending_combinations * num_queries_per_combination}")
     
-    # Open output file in appropriate mode
-    with open(output_path, file_mode) as f:
-        # Iterate through all combinations
-        for param_recipe in tqdm.tqdm(param_recipes, desc="Parameter recipes"):
-            for style_recipe in tqdm.tqdm(style_recipes, desc="Style recipes", leave=False):
-                
-                # Generate queries for this combination
-                queries = generate_queries_with_structured_output(
-                    prompt_template=prompt_template,
-                    param_recipe=param_recipe,
-                    style_recipe=style_recipe,
-                    num_queries=num_queries_per_combination,
-                    model_name=model_name,
-                    temperature=temperature,
-                    max_tokens=max_tokens
-                )
-                
-                # Create training records for each generated query
-                for query in queries:
-                    record = create_training_record(query, record_id, id_prefix)
-                    # Write as JSONL (one JSON per line)
-                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
-                    record_id += 1
-                
-                # Small delay to avoid rate limiting
-                time.sleep(0.1)
+    return prompt_template, output_path, record_id, file_mode, journal
+
+
+def write_training_records(
+    f,
+    queries: List[str],
+    record_id: int,
+    id_prefix: str,
+    compact: bool = False
+) -> int:
+    """
+    Write one JSONL training record per query, assigning sequential IDs.
     
+    Args:
+        f: Open output file handle
+        queries: Generated queries for one combination
+        record_id: ID to assign to the first query
+        id_prefix: Prefix for record IDs
+        compact: Write compact records that reference the function schema by hash
+        
+    Returns:
+        Next unused record ID
+    """
+    for query in queries:
+        record = create_training_record(query, record_id, id_prefix, compact)
+        # Write as JSONL (one JSON per line)
+        f.write(dumps_line(record) + "\n")
+        record_id += 1
+    return record_id
+
+
+def drop_near_duplicates(
+    deduplicator: NearDuplicateFilter,
+    queries: List[str],
+    record_id: int,
+    id_prefix: str,
+    cell: str,
+    limit: Optional[int] = None
+) -> List[str]:
+    """
+    Filter a cell's queries through the near-duplicate filter, keyed by their future IDs.
+    
+    Stops after `limit` kept queries, so surplus queries are never indexed as kept.
+    """
+    kept = []
+    for query in queries:
+        if limit is not None and len(kept) >= limit:
+            break
+        if deduplicator.offer(f"{id_prefix}_{record_id + len(kept)}", query, source=cell):
+            kept.append(query)
+    return kept
+
+
+def create_deduplicator(dedup_threshold: Optional[float], output_path: str, file_mode: str):
+    """Build the inline near-duplicate filter, seeded with records already in the output file."""
+    if dedup_threshold is None:
+        return None
+    deduplicator = NearDuplicateFilter(threshold=dedup_threshold)
+    if file_mode == "a":
+        seeded = seed_from_file(deduplicator, output_path)
+        print(f"Near-duplicate filter seeded with {seeded} existing records")
+    return deduplicator
+
+
+def finish_deduplication(deduplicator: Optional[NearDuplicateFilter], output_path: str):
+    """Write the drop report of the inline near-duplicate filter."""
+    if deduplicator is None:
+        return
+    report_path = output_path + ".dropped.jsonl"
+    dropped = deduplicator.stats()["dropped"]
+    deduplicator.write_report(report_path)
+    print(f"Near-duplicates dropped: {dropped}" + (f" (see {report_path})" if dropped else ""))
+
+
+def write_cell_records(
+    f,
+    journal: CellJournal,
+    cell: str,
+    param_index: int,
+    style_index: int,
+    queries: List[str],
+    record_id: int,
+    id_prefix: str,
+    compact: bool = False,
+    deduplicator: Optional[NearDuplicateFilter] = None,
+    limit: Optional[int] = None
+) -> int:
+    """
+    Write the records of one grid cell, checkpoint it in the journal and refresh the
+    resume manifest.
+    
+    Cells that produced no queries are not checkpointed, so a later run retries them.
+    When a deduplicator is given, near-duplicates of earlier queries are dropped before
+    IDs are assigned. Queries beyond `limit` (over-generation) are discarded.
+    
+    Returns:
+        Next unused record ID
+    """
+    start_id = record_id
+    generated = bool(queries)
+    if deduplicator is not None:
+        queries = drop_near_duplicates(deduplicator, queries, record_id, id_prefix, cell, limit)
+    elif limit is not None:
+        queries = queries[:limit]
+    record_id = write_training_records(f, queries, record_id, id_prefix, compact)
+    if generated:
+        # The journal must never point past data that is not yet on disk
+        f.flush()
+        journal.record(cell, param_index, style_index, start_id, record_id - start_id, f.tell())
+        ResumeManifest(f.name).update(id_prefix, record_id - 1)
+    return record_id
+
+
+class GridCell(NamedTuple):
+    """A pending parameter-style combination and its position in the recipe grid."""
+    param_index: int
+    style_index: int
+    cell: str
+    param_recipe: str
+    style_recipe: str
+
+
+def list_grid_cells(
+    param_recipes: List[str],
+    style_recipes: List[str],
+    id_prefix: str,
+    num_queries_per_combination: int
+) -> List[GridCell]:
+    """List every cell of the recipe grid, in grid order."""
+    return [
+        GridCell(
+            param_index, style_index,
+            recipe_hash(param_recipe, style_recipe, id_prefix, num_queries_per_combination),
+            param_recipe, style_recipe
+        )
+        for param_index, param_recipe in enumerate(param_recipes)
+        for style_index, style_recipe in enumerate(style_recipes)
+    ]
+
+
+def list_pending_cells(
+    param_recipes: List[str],
+    style_recipes: List[str],
+    id_prefix: str,
+    num_queries_per_combination: int,
+    journal: CellJournal
+) -> List[GridCell]:
+    """List the grid cells with fewer journaled records than requested, in grid order."""
+    return [
+        grid_cell
+        for grid_cell in list_grid_cells(param_recipes, style_recipes, id_prefix, num_queries_per_combination)
+        if not journal.is_complete(grid_cell.cell, num_queries_per_combination)
+    ]
+
+
+def build_quota_tracker(
+    grid_cells: List[GridCell],
+    num_queries_per_combination: int,
+    journal: CellJournal,
+    total_target: Optional[int] = None,
+    param_weights: Optional[List[float]] = None,
+    style_weights: Optional[List[float]] = None
+) -> QuotaTracker:
+    """
+    Set up per-cell targets for a run, with fill counts taken from the journal.
+    
+    Without total_target every cell targets num_queries_per_combination records;
+    otherwise total_target is split across the cells by their recipe weights.
+    """
+    num_params = max(grid_cell.param_index for grid_cell in grid_cells) + 1 if grid_cells else 0
+    num_styles = max(grid_cell.style_index for grid_cell in grid_cells) + 1 if grid_cells else 0
+    targets = grid_targets(
+        num_params, num_styles,
+        per_cell=num_queries_per_combination,
+        total=total_target,
+        param_weights=param_weights,
+        style_weights=style_weights
+    )
+    return QuotaTracker(
+        {grid_cell.cell: targets[(grid_cell.param_index, grid_cell.style_index)] for grid_cell in grid_cells},
+        {grid_cell.cell: journal.filled_count(grid_cell.cell) for grid_cell in grid_cells}
+    )
+
+
+def plan_request_packs(
+    requests: List[Tuple[GridCell, int]],
+    cells_per_call: int,
+    max_tokens: int
+) -> List[Tuple[int, List[GridCell]]]:
+    """
+    Group (cell, number of queries wanted) requests into API calls.
+    
+    Only cells asking for the same number of queries share a packed call. Groups are
+    ordered by their first cell and keep grid order inside, so a run with a uniform
+    quota packs exactly like consecutive chunks of the pending cells.
+    
+    Returns:
+        List of (queries per cell, cells) for each API call
+    """
+    groups = {}
+    for grid_cell, num_queries in requests:
+        if num_queries > 0:
+            groups.setdefault(num_queries, []).append(grid_cell)
+    packs = []
+    for num_queries, cells in groups.items():
+        per_call = plan_cells_per_call(cells_per_call, num_queries, max_tokens)
+        packs.extend((num_queries, cells[i:i + per_call]) for i in range(0, len(cells), per_call))
+    return packs
+
+
+def top_up_prompt_template(prompt_template: str, attempt: int) -> str:
+    """
+    Prompt template for a cell's request after `attempt` answered ones.
+    
+    The note changes the prompt (and so the response cache key) with every answered
+    request, so a top-up, in this run or a later one, does not replay the answer the
+    cell already got.
+    """
+    if attempt == 0:
+        return prompt_template
+    return (
+        prompt_template
+        + f"\n\nThis is follow-up request {attempt} for this combination: "
+        "vary wording, values and structure from the most obvious phrasings."
+    )
+
+
+def select_run_cells(
+    grid_cells: List[GridCell],
+    tracker: QuotaTracker,
+    shard: Optional[ShardSpec] = None,
+    dead_letters: Optional[DeadLetterFile] = None
+) -> Tuple[List[GridCell], QuotaTracker]:
+    """
+    Restrict a run to one shard's combinations and/or to dead-lettered combinations.
+    
+    Returns:
+        Tuple of (selected grid cells in grid order, tracker limited to them)
+    """
+    if shard is not None:
+        shard_cells = set(shard.cells)
+        grid_cells = [
+            grid_cell for grid_cell in grid_cells
+            if (grid_cell.param_index, grid_cell.style_index) in shard_cells
+        ]
+        print(f"Shard {shard.index + 1}/{shard.count}: {len(grid_cells)} combinations, "
+              f"IDs {shard.start_id}-{shard.end_id - 1}")
+    if dead_letters is not None:
+        failed = dead_letters.entries()
+        grid_cells = [grid_cell for grid_cell in grid_cells if grid_cell.cell in failed]
+        print(f"Replaying {len(grid_cells)} failed combinations from {dead_letters.path}")
+        if len(grid_cells) < len(failed):
+            print(f"Skipping {len(failed) - len(grid_cells)} dead-lettered combinations that are not "
+                  f"part of this run's recipes or shard")
+    return grid_cells, tracker.restrict(grid_cell.cell for grid_cell in grid_cells)
+
+
+def dead_letter_pack(
+    dead_letters: DeadLetterFile,
+    pack: List[GridCell],
+    num_queries: int,
+    round_index: int,
+    error: RequestFailedError,
+    failed_cells: set
+) -> List[List[str]]:
+    """
+    Record the combinations of a failed call in the dead-letter file.
+    
+    Returns:
+        Empty query lists for the pack, so the run carries on without them
+    """
+    for grid_cell in pack:
+        dead_letters.record(
+            grid_cell.cell, error,
+            param_index=grid_cell.param_index,
+            style_index=grid_cell.style_index,
+            num_queries=num_queries,
+            round=round_index
+        )
+        failed_cells.add(grid_cell.cell)
+    return [[] for _ in pack]
+
+
+def print_failure_summary(
+    dead_letters: DeadLetterFile,
+    answered_cells: set,
+    failed_cells: set,
+    circuit_breaker: CircuitBreaker
+):
+    """Clear dead letters of combinations that succeeded and report the ones that failed."""
+    breaker_stats = circuit_breaker.stats()
+    if breaker_stats["opens"]:
+        print(f"Circuit breaker opened {breaker_stats['opens']} times, "
+              f"dispatch paused for {breaker_stats['paused_seconds']:.1f}s")
+    resolved = dead_letters.resolve(answered_cells - failed_cells)
+    if resolved:
+        print(f"Recovered {resolved} previously failed combinations")
+    if failed_cells:
+        print(f"Warning: {len(failed_cells)} combinations failed permanently and were written to "
+              f"{dead_letters.path}; rerun with --replay-failed to retry only those")
+
+
+def print_quota_summary(tracker: QuotaTracker, top_up_calls: int):
+    """Report how close the run got to its per-cell quotas."""
+    summary = tracker.summary()
+    print(f"Quota: {summary['filled']}/{summary['target']} records across {summary['cells']} combinations"
+          f" ({top_up_calls} top-up calls)")
+    if summary["short_cells"]:
+        print(f"Warning: {summary['short_cells']} combinations are short by {summary['shortfall']} records "
+              f"in total; rerun to request the missing records")
+
+
+def write_pack_results(
+    f,
+    journal: CellJournal,
+    pack: List[GridCell],
+    results: List[List[str]],
+    record_id: int,
+    id_prefix: str,
+    packing_stats: PackingStats,
+    compact: bool = False,
+    deduplicator: Optional[NearDuplicateFilter] = None,
+    tracker: Optional[QuotaTracker] = None
+) -> int:
+    """
+    Write the results of one API call cell by cell, in grid order.
+    
+    With a quota tracker, each cell keeps at most its remaining gap and the tracker is
+    updated with the records written.
+    
+    Returns:
+        Next unused record ID
+    """
+    for grid_cell, queries in zip(pack, results):
+        start_id = record_id
+        record_id = write_cell_records(
+            f, journal, grid_cell.cell, grid_cell.param_index, grid_cell.style_index,
+            queries, record_id, id_prefix, compact=compact, deduplicator=deduplicator,
+            limit=tracker.gap(grid_cell.cell) if tracker is not None else None
+        )
+        packing_stats.accepted_queries += record_id - start_id
+        if tracker is not None:
+            tracker.add(grid_cell.cell, record_id - start_id)
+    return record_id
+
+
+class StreamingPackWriter:
+    """
+    Query sink that writes the records of one API call while its response streams in.
+    
+    Cells are written in pack (grid) order, so IDs match the non-streaming writer: the
+    queries of the first unfinished cell go through the near-duplicate filter straight
+    into the file, queries of later cells are buffered until the cells before them are
+    finished. A cell is finished (checkpointed in the journal, like write_cell_records
+    does) when close_cell() is called for it or when finish() ends a successful call.
+    
+    After a failed attempt, reset_attempt() truncates the unfinished head cell from the
+    file and drops the buffers of unfinished later cells, so a retry neither duplicates
+    nor overfills them; abandon() ends a failed call without checkpointing its
+    unfinished cells.
+    """
+    
+    def __init__(
+        self,
+        f,
+        journal: CellJournal,
+        pack: List[GridCell],
+        record_id: int,
+        id_prefix: str,
+        packing_stats: PackingStats,
+        compact: bool = False,
+        deduplicator: Optional[NearDuplicateFilter] = None,
+        tracker: Optional[QuotaTracker] = None
+    ):
+        self.f = f
+        self.journal = journal
+        self.pack = pack
+        self.record_id = record_id
+        self.id_prefix = id_prefix
+        self.packing_stats = packing_stats
+        self.compact = compact
+        self.deduplicator = deduplicator
+        self.tracker = tracker
+        self.num_cells = len(pack)
+        self.buffers = [[] for _ in pack]
+        self.closed = [False] * len(pack)
+        self.head = 0
+        self._start_cell()
+    
+    def _start_cell(self):
+        grid_cell = self.pack[self.head]
+        self.cell_start_id = self.record_id
+        self.cell_start_offset = self.f.tell()
+        self.generated = False
+        self.limit = self.tracker.gap(grid_cell.cell) if self.tracker is not None else None
+        buffered, self.buffers[self.head] = self.buffers[self.head], []
+        self._write(buffered)
+    
+    def _write(self, queries: List[str]):
+        grid_cell = self.pack[self.head]
+        for query in queries:
+            self.generated = True
+            if self.limit is not None and self.record_id - self.cell_start_id >= self.limit:
+                break
+            record_key = f"{self.id_prefix}_{self.record_id}"
+            if self.deduplicator is not None and not self.deduplicator.offer(record_key, query, source=grid_cell.cell):
+                continue
+            record = create_training_record(query, self.record_id, self.id_prefix, self.compact)
+            self.f.write(dumps_line(record) + "\n")
+            self.record_id += 1
+    
+    def _commit_cell(self):
+        grid_cell = self.pack[self.head]
+        written = self.record_id - self.cell_start_id
+        if self.generated:
+            # The journal must never point past data that is not yet on disk
+            self.f.flush()
+            self.journal.record(
+                grid_cell.cell, grid_cell.param_index, grid_cell.style_index,
+                self.cell_start_id, written, self.f.tell()
+            )
+            ResumeManifest(self.f.name).update(self.id_prefix, self.record_id - 1)
+        self.packing_stats.accepted_queries += written
+        if self.tracker is not None:
+            self.tracker.add(grid_cell.cell, written)
+    
+    def add(self, position: int, queries: List[str]):
+        """Accept finished queries for the cell at `position` of the pack."""
+        if position >= self.num_cells or self.closed[position]:
+            return
+        if position == self.head:
+            self._write(queries)
+        else:
+            self.buffers[position].extend(queries)
+    
+    def close_cell(self, position: int):
+        """Mark the cell at `position` as finished, committing every finished cell at the head."""
+        if position >= self.num_cells or self.closed[position]:
+            return
+        self.closed[position] = True
+        while self.head < self.num_cells and self.closed[self.head]:
+            self._commit_cell()
+            self.head += 1
+            if self.head < self.num_cells:
+                self._start_cell()
+    
+    def reset_attempt(self):
+        """Take back what a failed attempt streamed for cells that are not finished yet."""
+        if self.head >= self.num_cells:
+            return
+        self.f.truncate(self.cell_start_offset)
+        self.f.seek(self.cell_start_offset)
+        if self.deduplicator is not None:
+            for record_id in range(self.cell_start_id, self.record_id):
+                self.deduplicator.remove(f"{self.id_prefix}_{record_id}")
+        self.record_id = self.cell_start_id
+        self.generated = False
+        for position in range(self.head, self.num_cells):
+            if not self.closed[position]:
+                self.buffers[position] = []
+    
+    def finish(self) -> int:
+        """
+        Finish every remaining cell of a successful call.
+        
+        Returns:
+            Next unused record ID
+        """
+        for position in range(self.num_cells):
+            self.close_cell(position)
+        return self.record_id
+    
+    def abandon(self) -> int:
+        """
+        End a failed call: cells finished while it streamed stay checkpointed, the
+        unfinished ones are taken back and left unjournaled for a later run.
+        
+        Returns:
+            Next unused record ID
+        """
+        self.reset_attempt()
+        return self.record_id
+
+
+class QueuedQuerySink:
+    """
+    Query sink for a concurrent call: queues what the call streams until the in-order
+    consumer replays it into the call's StreamingPackWriter.
+    """
+    
+    def __init__(self, num_cells: int):
+        self.num_cells = num_cells
+        self.queue = asyncio.Queue()
+    
+    def add(self, position: int, queries: List[str]):
+        self.queue.put_nowait(("add", position, queries))
+    
+    def close_cell(self, position: int):
+        self.queue.put_nowait(("close", position, None))
+    
+    def reset_attempt(self):
+        self.queue.put_nowait(("reset", None, None))
+    
+    def end(self):
+        """Signal that the call is over (successfully or not)."""
+        self.queue.put_nowait(None)
+    
+    async def replay(self, writer: StreamingPackWriter):
+        """Forward queued queries to the writer as they arrive, until the call ends."""
+        while (item := await self.queue.get()) is not None:
+            kind, position, queries = item
+            if kind == "add":
+                writer.add(position, queries)
+            elif kind == "close":
+                writer.close_cell(position)
+            else:
+                writer.reset_attempt()
+
+
+def write_schema_table(output_path: str):
+    """Register FIXED_FUNCTION_SCHEMA in the schema table next to a compact output file."""
+    table = SchemaTable(schema_table_path(output_path))
+    table.add(FIXED_FUNCTION_SCHEMA)
+    table.save()
+
+
+def write_run_metrics(metrics: CallMetrics, output_path: str):
+    """Print the headline call metrics and write the JSON summary and per-call CSV next to the output."""
+    summary = metrics.summary(per_cell=False)
+    latency = summary["histograms"]["latency"]
+    if summary["calls"]:
+        print(f"Call latency p50: {latency['p50']:.2f}s, p90: {latency['p90']:.2f}s, p99: {latency['p99']:.2f}s; "
+              f"retries: {summary['retries']}, failures: {summary['failures']}")
+        print(f"Tokens: {summary['prompt_tokens']} prompt ({summary['cached_tokens']} cached), "
+              f"{summary['completion_tokens']} completion"
+              + (f", estimated cost: ${summary['estimated_cost_usd']:.4f}" if "estimated_cost_usd" in summary else ""))
+    metrics.write_json(output_path + ".metrics.json")
+    metrics.write_csv(output_path + ".metrics.csv")
+    print(f"Call metrics saved to: {output_path}.metrics.json / .metrics.csv")
+
+
+def print_generation_summary(
+    output_path: str,
+    id_prefix: str,
+    first_id: int,
+    record_id: int,
+    rate_limiter: AdaptiveRateLimiter,
+    cache: ResponseCache,
+    packing_stats: PackingStats,
+    metrics: Optional[CallMetrics] = None
+):
+    """Print the end-of-run summary shared by the sync and async generators."""
+    limiter_stats = rate_limiter.stats()
+    cache_stats = cache.stats()
     print(f"\nGeneration complete!")
-    print(f"Total records generated in this run: {record_id - (max_existing_id + 1) if max_existing_id >= 0 else record_id}")
+    print(f"Total records generated in this run: {record_id - first_id}")
     print(f"Total records in file with prefix '{id_prefix}': {record_id}")
+    print(f"Rate limit hits: {limiter_stats['rate_limit_hits']}, "
+          f"time throttled: {limiter_stats['throttled_seconds']:.1f}s")
+    print(f"Response cache ({cache_stats['mode']}): {cache_stats['hits']} hits, {cache_stats['misses']} misses")
+    print(f"API calls: {packing_stats.calls} for {packing_stats.cells} combinations "
+          f"({packing_stats.calls_saved} saved by packing), "
+          f"tokens per accepted query: {packing_stats.tokens_per_accepted_query:.1f}")
+    if metrics is not None:
+        write_run_metrics(metrics, output_path)
     print(f"Output saved to: {output_path}")
 
 
+class GenerationRun:
+    """
+    Setup, per-call bookkeeping and teardown of one generation run.
+    
+    Shared by the sequential and the concurrent generator, which only differ in how
+    the calls of a round are dispatched and awaited.
+    """
+    
+    def __init__(self, arguments: dict):
+        """
+        Args:
+            arguments: Arguments of generate_diverse_training_data, defaults applied
+        """
+        shard = arguments["shard"]
+        self.id_prefix = arguments["id_prefix"]
+        self.compact_output = arguments["compact_output"]
+        self.cells_per_call = arguments["cells_per_call"]
+        self.top_up_rounds = arguments["top_up_rounds"]
+        self.stream_output = arguments["stream_output"]
+        self.call_kwargs = dict(
+            model_name=arguments["model_name"],
+            temperature=arguments["temperature"],
+            max_tokens=arguments["max_tokens"]
+        )
+        self.rate_limiter = arguments["rate_limiter"] or get_shared_rate_limiter()
+        self.cache = arguments["cache"] or get_shared_cache()
+        self.metrics = arguments["metrics"] or CallMetrics.from_environment()
+        self.circuit_breaker = arguments["circuit_breaker"] or get_shared_circuit_breaker()
+        self.prompt_template, self.output_path, self.record_id, self.file_mode, self.journal = prepare_generation_run(
+            prompt_path=arguments["prompt_path"],
+            output_dir=arguments["output_dir"],
+            output_filename=arguments["output_filename"],
+            param_recipes=arguments["param_recipes"],
+            style_recipes=arguments["style_recipes"],
+            id_prefix=self.id_prefix,
+            num_queries_per_combination=arguments["num_queries_per_combination"],
+            start_id=shard.start_id if shard is not None else 0
+        )
+        self.first_id = self.record_id
+        if self.compact_output:
+            write_schema_table(self.output_path)
+        self.deduplicator = create_deduplicator(arguments["dedup_threshold"], self.output_path, self.file_mode)
+        
+        grid_cells = list_grid_cells(
+            arguments["param_recipes"], arguments["style_recipes"], self.id_prefix,
+            arguments["num_queries_per_combination"]
+        )
+        tracker = build_quota_tracker(
+            grid_cells, arguments["num_queries_per_combination"], self.journal, arguments["total_target"],
+            arguments["param_weights"], arguments["style_weights"]
+        )
+        self.dead_letters = DeadLetterFile(dead_letter_path(self.output_path))
+        replay_failed = arguments["replay_failed"]
+        self.grid_cells, self.tracker = select_run_cells(
+            grid_cells, tracker, shard, self.dead_letters if replay_failed else None
+        )
+        # Combinations below their quota, whether never journaled or journaled short by an
+        # earlier run, ask for their remaining gap in the first round
+        self.requests = [(grid_cell, self.tracker.gap(grid_cell.cell)) for grid_cell in self.grid_cells]
+        if arguments["total_target"] is not None:
+            print(f"Total target: {arguments['total_target']} records, "
+                  f"{sum(gap for _, gap in self.requests)} still to request in the first round")
+        self.packing_stats = PackingStats()
+        if self.cells_per_call > 1:
+            print(f"Combinations per API call: up to {self.cells_per_call}")
+        self.top_up_calls = 0
+        self.answered_cells = set()
+        self.failed_cells = set()
+    
+    def rounds(self) -> Iterator[Tuple[int, List[Tuple[str, int, List[GridCell]]]]]:
+        """
+        Yield (round index, packs) for the first round and every top-up round that still
+        has combinations below their quota. Each pack is (prompt template, queries per
+        cell, cells).
+        
+        Combinations journaled short by an earlier run get a follow-up prompt, so their
+        request does not replay the answer they already got.
+        """
+        for round_index in range(self.top_up_rounds + 1):
+            packs = self.plan_packs()
+            if packs:
+                if round_index:
+                    self.top_up_calls += len(packs)
+                yield round_index, packs
+            # Only the missing records of under-filled combinations are requested again;
+            # dead-lettered combinations wait for a replay
+            self.requests = [
+                (grid_cell, self.tracker.gap(grid_cell.cell))
+                for grid_cell in self.grid_cells if grid_cell.cell not in self.failed_cells
+            ]
+    
+    def plan_packs(self) -> List[Tuple[str, int, List[GridCell]]]:
+        """Group the requested combinations into API calls, in grid order."""
+        # A cell's prompt depends on how many answers it already has, so only cells
+        # at the same attempt share a call
+        by_attempt = {}
+        for grid_cell, num_queries in self.requests:
+            by_attempt.setdefault(self.journal.attempt_count(grid_cell.cell), []).append((grid_cell, num_queries))
+        packs = []
+        for attempt, requests in by_attempt.items():
+            prompt_template = top_up_prompt_template(self.prompt_template, attempt)
+            packs.extend(
+                (prompt_template, num_queries, pack)
+                for num_queries, pack in plan_request_packs(requests, self.cells_per_call,
+                                                            self.call_kwargs["max_tokens"])
+            )
+        return packs
+    
+    @staticmethod
+    def progress_bar(items, round_index: int):
+        return tqdm.tqdm(items, desc="API calls" if round_index == 0 else f"Top-up round {round_index}")
+    
+    def pack_arguments(self, prompt_template: str, num_queries: int, pack: List[GridCell], query_sink=None) -> dict:
+        """Arguments of generate_cell_pack / agenerate_cell_pack for one call of the run."""
+        return dict(
+            prompt_template=prompt_template,
+            cells=[(grid_cell.param_recipe, grid_cell.style_recipe) for grid_cell in pack],
+            num_queries=num_queries,
+            packing_stats=self.packing_stats,
+            rate_limiter=self.rate_limiter,
+            cache=self.cache,
+            metrics=self.metrics,
+            cell="+".join(grid_cell.cell for grid_cell in pack),
+            circuit_breaker=self.circuit_breaker,
+            query_sink=query_sink,
+            **self.call_kwargs
+        )
+    
+    def pack_writer(self, f, pack: List[GridCell]) -> StreamingPackWriter:
+        """Writer that streams one call's queries into the output file."""
+        return StreamingPackWriter(
+            f, self.journal, pack, self.record_id, self.id_prefix, self.packing_stats,
+            compact=self.compact_output, deduplicator=self.deduplicator, tracker=self.tracker
+        )
+    
+    def record_pack(
+        self,
+        f,
+        round_index: int,
+        num_queries: int,
+        pack: List[GridCell],
+        results: Optional[List[List[str]]],
+        writer: Optional[StreamingPackWriter] = None,
+        error: Optional[RequestFailedError] = None
+    ):
+        """Write (or, for a streamed call, finish writing) the outcome of one call, in grid order."""
+        filled_before = [self.journal.filled_count(grid_cell.cell) for grid_cell in pack]
+        if error is not None:
+            results = dead_letter_pack(self.dead_letters, pack, num_queries, round_index, error, self.failed_cells)
+        if writer is not None and error is not None:
+            # A failed call's unfinished cells are not checkpointed, so they are retried
+            self.record_id = writer.abandon()
+        elif writer is not None:
+            # Streamed queries are already written; checkpoint the remaining cells
+            self.record_id = writer.finish()
+        else:
+            # Create training records for each generated query, up to each cell's quota
+            self.record_id = write_pack_results(
+                f, self.journal, pack, results, self.record_id, self.id_prefix, self.packing_stats,
+                compact=self.compact_output, deduplicator=self.deduplicator, tracker=self.tracker
+            )
+        # A cell the response skipped (or whose queries were all dropped) has not recovered
+        self.answered_cells.update(
+            grid_cell.cell for grid_cell, filled in zip(pack, filled_before)
+            if self.journal.filled_count(grid_cell.cell) > filled
+        )
+    
+    def finish(self):
+        """Write the run's reports and print its summary."""
+        finish_deduplication(self.deduplicator, self.output_path)
+        print_quota_summary(self.tracker, self.top_up_calls)
+        print_failure_summary(self.dead_letters, self.answered_cells, self.failed_cells, self.circuit_breaker)
+        print_generation_summary(
+            self.output_path, self.id_prefix, self.first_id, self.record_id, self.rate_limiter, self.cache,
+            self.packing_stats, self.metrics
+        )
+
+
+def generate_diverse_training_data(
+    prompt_path: str,
+    output_dir: str,
+    output_filename: str,
+    param_recipes: List[str],
+    style_recipes: List[str],
+    id_prefix: str,
+    num_queries_per_combination: int,
+    model_name: Optional[str] = None,
+    temperature: float = 1.0,
+    max_tokens: int = 3072,
+    rate_limiter: Optional[AdaptiveRateLimiter] = None,
+    cache: Optional[ResponseCache] = None,
+    compact_output: bool = False,
+    dedup_threshold: Optional[float] = None,
+    cells_per_call: int = 1,
+    metrics: Optional[CallMetrics] = None,
+    total_target: Optional[int] = None,
+    param_weights: Optional[List[float]] = None,
+    style_weights: Optional[List[float]] = None,
+    top_up_rounds: int = 0,
+    shard: Optional[ShardSpec] = None,
+    circuit_breaker: Optional[CircuitBreaker] = None,
+    replay_failed: bool = False,
+    stream_output: bool = False
+):
+    """
+    Generate diverse training data by iterating through all parameter-style combinations.
+    
+    Args:
+        prompt_path: Path to prompt template file
+        output_dir: Directory to save output
+        output_filename: Name of output JSONL file
+        param_recipes: List of parameter recipes to use
+        style_recipes: List of style recipes to use
+        id_prefix: Prefix for record IDs (e.g., "Mindat_v1" or "Mindat_invalid_v1")
+        num_queries_per_combination: Number of queries to generate per combination
+        model_name: Model name to use
+        temperature: Sampling temperature
+        max_tokens: Maximum tokens for generation
+        rate_limiter: Limiter shared by all calls in the run (defaults to the shared limiter)
+        cache: Response cache shared by all calls in the run (defaults to the shared cache)
+        compact_output: Write compact records referencing the schema table instead of
+            embedding FIXED_FUNCTION_SCHEMA (expand later with compact_records.export_bfcl)
+        dedup_threshold: Drop queries whose shingle Jaccard similarity to an earlier query
+            reaches this threshold (None disables the near-duplicate filter)
+        cells_per_call: Number of combinations packed into one structured-output call
+            (capped so the packed response fits in max_tokens)
+        metrics: Per-call collector for the run (defaults to a fresh one); its summary is
+            written next to the output as <output>.metrics.json and <output>.metrics.csv
+        total_target: Overall number of records to reach, split across combinations by
+            weight (None: num_queries_per_combination records per combination)
+        param_weights: Relative share of each parameter recipe under total_target
+        style_weights: Relative share of each style recipe under total_target
+        top_up_rounds: Follow-up rounds that request only the missing records of
+            combinations left below their quota (0 disables top-ups)
+        shard: Restrict the run to one shard's combinations and ID range
+            (see run_sharded_generation)
+        circuit_breaker: Breaker that pauses dispatch while the endpoint is failing
+            (defaults to the shared breaker)
+        replay_failed: Only regenerate the combinations recorded in the dead-letter file
+            (<output>.failed.jsonl) by earlier runs
+        stream_output: Stream responses and write (and near-duplicate filter) each query
+            as soon as it is complete instead of after the whole call
+    """
+    run = GenerationRun(generation_arguments(**locals()))
+    # Open output file in appropriate mode
+    with open(run.output_path, run.file_mode) as f:
+        for round_index, packs in run.rounds():
+            progress = run.progress_bar(packs, round_index)
+            for prompt_template, num_queries, pack in progress:
+                writer = run.pack_writer(f, pack) if stream_output else None
+                # Generate queries for the combinations in this call
+                results, error = None, None
+                try:
+                    results = generate_cell_pack(**run.pack_arguments(prompt_template, num_queries, pack, writer))
+                except RequestFailedError as e:
+                    error = e
+                progress.set_postfix_str(run.metrics.progress_label())
+                run.record_pack(f, round_index, num_queries, pack, results, writer, error)
+    run.finish()
+
+
+def generation_arguments(*args, **kwargs) -> dict:
+    """Bind arguments of generate_diverse_training_data by name, with its defaults applied."""
+    bound = inspect.signature(generate_diverse_training_data).bind(*args, **kwargs)
+    bound.apply_defaults()
+    return bound.arguments
+
+
+async def generate_diverse_training_data_async(*args, max_concurrency: int = 16, **generation_kwargs):
+    """
+    Concurrent version of generate_diverse_training_data.
+    
+    All parameter-style combinations are dispatched at once through the async client,
+    with at most max_concurrency requests in flight. Results are consumed in grid order,
+    so record IDs and the JSONL layout match the sequential generator exactly.
+    
+    Args:
+        max_concurrency: Maximum number of API calls in flight at once
+        *args, **generation_kwargs: Arguments of generate_diverse_training_data
+    """
+    if max_concurrency < 1:
+        raise ValueError("max_concurrency must be at least 1")
+    
+    arguments = generation_arguments(*args, **generation_kwargs)
+    run = GenerationRun(arguments)
+    print(f"Max concurrent requests: {max_concurrency}")
+    semaphore = asyncio.Semaphore(max_concurrency)
+    
+    async def generate_pack(
+        prompt_template: str,
+        num_queries: int,
+        pack: List[GridCell],
+        sink: Optional[QueuedQuerySink] = None
+    ) -> List[List[str]]:
+        try:
+            async with semaphore:
+                return await agenerate_cell_pack(**run.pack_arguments(prompt_template, num_queries, pack, sink))
+        finally:
+            # Unblock the consumer replaying this call's stream
+            if sink is not None:
+                sink.end()
+    
+    with open(run.output_path, run.file_mode) as f:
+        for round_index, packs in run.rounds():
+            # Schedule every call of the round up front, in grid order
+            sinks = [QueuedQuerySink(len(pack)) if run.stream_output else None for _, _, pack in packs]
+            tasks = [
+                asyncio.create_task(generate_pack(prompt_template, num_queries, pack, sink))
+                for (prompt_template, num_queries, pack), sink in zip(packs, sinks)
+            ]
+            
+            # Awaiting in grid order keeps IDs deterministic while later calls keep running
+            progress = run.progress_bar(list(zip(packs, tasks, sinks)), round_index)
+            for (_, num_queries, pack), task, sink in progress:
+                writer = run.pack_writer(f, pack) if sink is not None else None
+                results, error = None, None
+                try:
+                    if sink is not None:
+                        # Write this call's queries as they stream in; later calls queue theirs
+                        await sink.replay(writer)
+                    results = await task
+                except RequestFailedError as e:
+                    error = e
+                progress.set_postfix_str(run.metrics.progress_label())
+                run.record_pack(f, round_index, num_queries, pack, results, writer, error)
+    run.finish()
+
+
+def strict_json_schema_format(response_format) -> dict:
+    """Build the json_schema response_format payload of a batch request for a pydantic model."""
+    schema = response_format.model_json_schema()
+    for definition in [schema, *schema.get("$defs", {}).values()]:
+        definition["additionalProperties"] = False
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": response_format.__name__, "strict": True, "schema": schema}
+    }
+
+
+def batch_custom_id(id_prefix: str, grid_cell: GridCell, attempt: int = 0) -> str:
+    """
+    Stable batch custom_id: grid position for readability plus the recipe hash, and the
+    number of answers already journaled for a follow-up request.
+    """
+    custom_id = f"{id_prefix}-p{grid_cell.param_index}-s{grid_cell.style_index}-{grid_cell.cell}"
+    return f"{custom_id}-a{attempt}" if attempt else custom_id
+
+
+def write_batch_requests(
+    prompt_path: str,
+    output_dir: str,
+    output_filename: str,
+    requests_path: str,
+    param_recipes: List[str],
+    style_recipes: List[str],
+    id_prefix: str,
+    num_queries_per_combination: int,
+    model_name: Optional[str] = None,
+    temperature: float = 1.0,
+    max_tokens: int = 3072
+) -> int:
+    """
+    Phase 1 of offline batch generation: write one batch API request per pending cell.
+    
+    Cells the output file's journal already fills are skipped, and cells journaled short
+    ask for their missing records with a follow-up prompt. Each line
+    follows the batch API input format and carries a stable custom_id, so results can
+    be ingested in any order with ingest_batch_results.
+    
+    Args:
+        prompt_path: Path to prompt template file
+        output_dir: Directory of the output JSONL file the results will be ingested into
+        output_filename: Name of that output JSONL file
+        requests_path: Destination for the batch request JSONL file
+        param_recipes: List of parameter recipes to use
+        style_recipes: List of style recipes to use
+        id_prefix: Prefix for record IDs
+        num_queries_per_combination: Number of queries to generate per combination
+        model_name: Model or deployment name placed in each request body
+        temperature: Sampling temperature
+        max_tokens: Maximum tokens for generation
+        
+    Returns:
+        Number of requests written
+    """
+    model_name = model_name or get_deployment_name()
+    prompt_template = load_generation_template(prompt_path)
+    journal = CellJournal(os.path.join(output_dir, output_filename))
+    pending = list_pending_cells(param_recipes, style_recipes, id_prefix, num_queries_per_combination, journal)
+    response_format = strict_json_schema_format(QueryList)
+    
+    dirname = os.path.dirname(requests_path)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    with open(requests_path, "w", encoding="utf-8") as f:
+        for grid_cell in pending:
+            attempt = journal.attempt_count(grid_cell.cell)
+            request = {
+                "custom_id": batch_custom_id(id_prefix, grid_cell, attempt),
+                "method": "POST",
+                "url": "/chat/completions",
+                "body": {
+                    "model": model_name,
+                    "messages": [{
+                        "role": "user",
+                        "content": format_cell_prompt(
+                            top_up_prompt_template(prompt_template, attempt),
+                            grid_cell.param_recipe, grid_cell.style_recipe,
+                            num_queries_per_combination - journal.filled_count(grid_cell.cell)
+                        )
+                    }],
+                    "response_format": response_format,
+                    "temperature": temperature,
+                    "max_tokens": max_tokens
+                }
+            }
+            f.write(dumps_line(request) + "\n")
+    
+    print(f"Wrote {len(pending)} batch requests to {requests_path}")
+    return len(pending)
+
+
+def parse_batch_result(result: dict) -> Optional[List[str]]:
+    """Extract the generated queries from one batch API result line, or None if it failed."""
+    response = result.get("response") or {}
+    if result.get("error") or response.get("status_code") != 200:
+        return None
+    try:
+        content = response["body"]["choices"][0]["message"]["content"]
+        return QueryList.model_validate_json(content).queries
+    except (KeyError, IndexError, TypeError, ValidationError):
+        return None
+
+
+def ingest_batch_results(
+    prompt_path: str,
+    output_dir: str,
+    output_filename: str,
+    results_path: str,
+    param_recipes: List[str],
+    style_recipes: List[str],
+    id_prefix: str,
+    num_queries_per_combination: int,
+    compact_output: bool = False,
+    dedup_threshold: Optional[float] = None
+):
+    """
+    Phase 2 of offline batch generation: write records from a batch API results file.
+    
+    Results may arrive in any order and may cover only part of the grid. Cells with a
+    successful result are written in grid order (so IDs follow the grid, as in the
+    online generator) and checkpointed; the rest stay pending and can be ingested from
+    a later results file or regenerated online. Results whose custom_id was not issued
+    for this run's prefix and recipe grid are ignored, as are results of a request the
+    journal already holds the answer to, and each cell keeps at most its missing
+    records.
+    
+    Args:
+        prompt_path: Path to prompt template file
+        output_dir: Directory to save output
+        output_filename: Name of output JSONL file
+        results_path: Batch API output JSONL file
+        param_recipes: List of parameter recipes used for the requests
+        style_recipes: List of style recipes used for the requests
+        id_prefix: Prefix for record IDs
+        num_queries_per_combination: Number of queries requested per combination
+        compact_output: Write compact records referencing the schema table
+        dedup_threshold: Near-duplicate threshold (None disables the filter)
+    """
+    _, output_path, record_id, file_mode, journal = prepare_generation_run(
+        prompt_path=prompt_path,
+        output_dir=output_dir,
+        output_filename=output_filename,
+        param_recipes=param_recipes,
+        style_recipes=style_recipes,
+        id_prefix=id_prefix,
+        num_queries_per_combination=num_queries_per_combination
+    )
+    first_id = record_id
+    if compact_output:
+        write_schema_table(output_path)
+    deduplicator = create_deduplicator(dedup_threshold, output_path, file_mode)
+    
+    # Index results by grid cell; a custom_id not issued for this run's grid (another
+    # prefix, other recipes or another batch) is rejected instead of ingested, and one
+    # issued for an earlier request of a cell has already been written
+    all_grid_cells = list_grid_cells(param_recipes, style_recipes, id_prefix, num_queries_per_combination)
+    grid_cells = {
+        batch_custom_id(id_prefix, grid_cell, journal.attempt_count(grid_cell.cell)): grid_cell
+        for grid_cell in all_grid_cells
+    }
+    answered_ids = {
+        batch_custom_id(id_prefix, grid_cell, attempt)
+        for grid_cell in all_grid_cells
+        for attempt in range(journal.attempt_count(grid_cell.cell))
+    }
+    results = {}
+    failed = 0
+    foreign = 0
+    with open(results_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            result = loads(line)
+            grid_cell = grid_cells.get(result.get("custom_id"))
+            if grid_cell is None:
+                foreign += result.get("custom_id") not in answered_ids
+                continue
+            queries = parse_batch_result(result)
+            if queries is None:
+                failed += 1
+                continue
+            results[grid_cell.cell] = queries
+    if foreign:
+        print(f"Warning: Ignoring {foreign} results whose custom_id does not belong to this run "
+              f"(prefix '{id_prefix}' and the current recipe grid)")
+    
+    pending = list_pending_cells(param_recipes, style_recipes, id_prefix, num_queries_per_combination, journal)
+    ingested = 0
+    with open(output_path, file_mode) as f:
+        for grid_cell in pending:
+            queries = results.get(grid_cell.cell)
+            if queries is None:
+                continue
+            # Extra queries a model returned beyond the request are dropped
+            record_id = write_cell_records(
+                f, journal, grid_cell.cell, grid_cell.param_index, grid_cell.style_index,
+                queries, record_id, id_prefix, compact=compact_output, deduplicator=deduplicator,
+                limit=num_queries_per_combination - journal.filled_count(grid_cell.cell)
+            )
+            ingested += 1
+    
+    finish_deduplication(deduplicator, output_path)
+    print(f"\nBatch ingestion complete!")
+    print(f"Combinations ingested: {ingested}, still missing: {len(pending) - ingested}, failed results: {failed}")
+    print(f"Total records generated in this run: {record_id - first_id}")
+    print(f"Output saved to: {output_path}")
+
+
+def shard_rate_limiter(num_shards: int) -> AdaptiveRateLimiter:
+    """Limiter holding one worker's share of the AZURE_OPENAI_RPM / AZURE_OPENAI_TPM budget."""
+    rpm = os.getenv("AZURE_OPENAI_RPM")
+    tpm = os.getenv("AZURE_OPENAI_TPM")
+    return AdaptiveRateLimiter(
+        requests_per_minute=float(rpm) / num_shards if rpm else None,
+        tokens_per_minute=float(tpm) / num_shards if tpm else None,
+    )
+
+
+def plan_generation_shards(
+    num_shards: int,
+    param_recipes: List[str],
+    style_recipes: List[str],
+    num_queries_per_combination: int,
+    total_target: Optional[int] = None,
+    param_weights: Optional[List[float]] = None,
+    style_weights: Optional[List[float]] = None
+) -> List[ShardSpec]:
+    """Split the recipe grid into shards with disjoint ID ranges sized by the cell quotas."""
+    targets = grid_targets(
+        len(param_recipes), len(style_recipes),
+        per_cell=num_queries_per_combination,
+        total=total_target,
+        param_weights=param_weights,
+        style_weights=style_weights
+    )
+    return plan_shards(targets, num_shards)
+
+
+def save_or_check_shard_plan(output_path: str, specs: List[ShardSpec]):
+    """
+    Store the shard plan next to the final output, refusing to switch plans mid-run.
+    
+    Shard files written under a different plan (other recipes, quotas or shard count)
+    hold IDs from other ranges, so they must be removed before re-planning.
+    """
+    if os.path.exists(plan_path(output_path)) and load_plan(output_path) != specs:
+        raise ValueError(
+            f"{plan_path(output_path)} describes a different shard plan; remove it and the "
+            f"old shard files to start a new sharded run"
+        )
+    save_plan(output_path, specs)
+
+
+def run_generation_shard(
+    shard: ShardSpec,
+    use_async: bool = True,
+    max_concurrency: int = 16,
+    **generation_kwargs
+):
+    """
+    Generate one shard in this process.
+    
+    Records go to <output>.shard-K-of-N.json within the shard's reserved ID range, and
+    the worker budgets against its share of the deployment's rate limits.
+    
+    Args:
+        shard: Shard to generate
+        use_async: Use the concurrent generator inside the worker
+        max_concurrency: Maximum number of API calls in flight for the worker
+        **generation_kwargs: Arguments of generate_diverse_training_data
+    """
+    kwargs = dict(generation_kwargs)
+    kwargs["output_filename"] = shard_filename(kwargs["output_filename"], shard.index, shard.count)
+    kwargs["shard"] = shard
+    if kwargs.get("rate_limiter") is None:
+        kwargs["rate_limiter"] = shard_rate_limiter(shard.count)
+    if use_async:
+        asyncio.run(generate_diverse_training_data_async(max_concurrency=max_concurrency, **kwargs))
+    else:
+        generate_diverse_training_data(**kwargs)
+
+
+def merge_generation_shards(output_dir: str, output_filename: str, id_prefix: str, renumber: bool = False):
+    """Merge the shard files of a run into the final output and report the ID check."""
+    report = merge_shards(output_dir, output_filename, id_prefix, renumber=renumber)
+    last_id = report["first_id"] + report["records"] - 1
+    print(f"Merged {report['records']} records into {os.path.join(output_dir, output_filename)} "
+          f"(IDs {report['first_id']}-{last_id})")
+    if report["renumbered"]:
+        print(f"Closed {len(report['gaps'])} ID gaps by renumbering")
+    return report
+
+
+def run_sharded_generation(
+    num_workers: int,
+    use_async: bool = True,
+    max_concurrency: int = 16,
+    renumber: bool = False,
+    **generation_kwargs
+):
+    """
+    Split the recipe grid across worker processes, then merge their shards.
+    
+    Each worker has its own API client and its share of the rate limits, so throughput
+    grows with the number of workers until the deployment quota is the bottleneck.
+    Workers resume from their shard's journal when the run is restarted. The final
+    output file is overwritten by the merge.
+    
+    Args:
+        num_workers: Number of worker processes (= shards)
+        use_async: Use the concurrent generator inside each worker
+        max_concurrency: Maximum number of API calls in flight per worker
+        renumber: Close ID gaps of short shards by renumbering during the merge
+        **generation_kwargs: Arguments of generate_diverse_training_data
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    
+    specs = plan_generation_shards(
+        num_workers,
+        generation_kwargs["param_recipes"],
+        generation_kwargs["style_recipes"],
+        generation_kwargs["num_queries_per_combination"],
+        generation_kwargs.get("total_target"),
+        generation_kwargs.get("param_weights"),
+        generation_kwargs.get("style_weights")
+    )
+    output_dir = generation_kwargs["output_dir"]
+    output_filename = generation_kwargs["output_filename"]
+    os.makedirs(output_dir, exist_ok=True)
+    save_or_check_shard_plan(os.path.join(output_dir, output_filename), specs)
+    print(f"Running {len(specs)} shards in {num_workers} worker processes")
+    
+    # spawn keeps workers from inheriting the parent's clients and open connections
+    with ProcessPoolExecutor(max_workers=num_workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = [
+            pool.submit(run_generation_shard, spec, use_async, max_concurrency, **generation_kwargs)
+            for spec in specs
+        ]
+        for future in futures:
+            future.result()
+    
+    return merge_generation_shards(output_dir, output_filename, generation_kwargs["id_prefix"], renumber)
+
+
 def main():
     """Main execution function."""
+    parser = argparse.ArgumentParser(description="Generate diverse Mindat queries.")
+    parser.add_argument("--batch-emit", metavar="REQUESTS_JSONL",
+                        help="Write batch API requests for all pending combinations instead of calling the API")
+    parser.add_argument("--batch-ingest", metavar="RESULTS_JSONL",
+                        help="Write records from a batch API results file instead of calling the API")
+    parser.add_argument("--workers", type=int, metavar="N",
+                        help="Split the grid across N local worker processes and merge their shards")
+    parser.add_argument("--shard", metavar="K/N",
+                        help="Generate only shard K of N (e.g. one per machine on a shared filesystem)")
+    parser.add_argument("--merge", action="store_true",
+                        help="Merge the shard files of a sharded run into the output file")
+    parser.add_argument("--renumber", action="store_true",
+                        help="With --workers/--merge, close ID gaps of short shards by renumbering")
+    parser.add_argument("--replay-failed", action="store_true",
+                        help="Regenerate only the combinations recorded in <output>.failed.jsonl")
+    args = parser.parse_args()
     
     # ========================================
     # USER CONFIGURATION
@@ -416,10 +2248,47 @@ def main():
     output_dir = 'output'
     output_filename = 'BFCL_V4_Mindat_v1_irrelevance.json'  # Customize as needed
     
+    # Record format configuration
+    # - compact_output=True stores the function schema once in <output>.schemas.json and
+    #   references it by hash; run `python compact_records.py export` to get BFCL records
+    compact_output = False
+    
+    # Near-duplicate filter configuration
+    # - dedup_threshold drops queries too similar to an earlier one (e.g. 0.7); None disables it
+    dedup_threshold = None
+    
     # Prompt configuration
     prompt_filename = 'gemini_mindat_prompt_v1.md'
     prompt_path = Path('prompt', prompt_filename)
     
+    # Concurrency configuration
+    # - use_async=True dispatches many combinations at once via the async client
+    # - max_concurrency caps the number of API calls in flight
+    use_async = False
+    max_concurrency = 16
+    
+    # Packing configuration
+    # - cells_per_call > 1 asks for several combinations in one structured-output call,
+    #   amortizing the shared prompt text and per-request latency (capped by max_tokens)
+    cells_per_call = 1
+    
+    # Quota configuration
+    # - total_target=None asks for num_queries_per_combination records per combination;
+    #   an integer instead splits that many records across combinations (weighted by
+    #   param_weights / style_weights, one weight per recipe, None = equal)
+    # - top_up_rounds > 0 re-requests only the missing records of combinations that came
+    #   back short (model under-delivered, call failed or near-duplicates were dropped);
+    #   each round costs extra API calls, so it is off unless set here
+    total_target = None
+    param_weights = None
+    style_weights = None
+    top_up_rounds = 0
+    
+    # Streaming configuration
+    # - stream_output=True streams each response and writes every query as soon as it is
+    #   complete, overlapping writing and near-duplicate filtering with generation
+    stream_output = False
+    
     # ========================================
     # VALIDATION & EXECUTION
     # ========================================
@@ -438,11 +2307,12 @@ def main():
     print(f"Parameter Recipes: {len(selected_param_recipes)} recipes")
     print(f"Style Recipes: {len(selected_style_recipes)} recipes")
     print(f"Output File: {output_dir}/{output_filename}")
+    print(f"Mode: {'async (max ' + str(max_concurrency) + ' in flight)' if use_async else 'sequential'}")
     print("=" * 60)
     print()
     
     # Generate training data
-    generate_diverse_training_data(
+    generation_kwargs = dict(
         prompt_path=str(prompt_path),
         output_dir=output_dir,
         output_filename=output_filename,
@@ -450,10 +2320,70 @@ def main():
         style_recipes=selected_style_recipes,
         id_prefix=id_prefix,
         num_queries_per_combination=5,  # Generate 5 queries per combination
-        model_name=deployment_name,
+        model_name=get_deployment_name(),
         temperature=1.0,
-        max_tokens=3072
+        max_tokens=3072,
+        compact_output=compact_output,
+        dedup_threshold=dedup_threshold,
+        cells_per_call=cells_per_call,
+        total_target=total_target,
+        param_weights=param_weights,
+        style_weights=style_weights,
+        top_up_rounds=top_up_rounds,
+        replay_failed=args.replay_failed,
+        stream_output=stream_output
     )
+    
+    # Offline batch mode: emit requests or ingest results without calling the API
+    if args.batch_emit:
+        write_batch_requests(
+            prompt_path=str(prompt_path),
+            output_dir=output_dir,
+            output_filename=output_filename,
+            requests_path=args.batch_emit,
+            param_recipes=selected_param_recipes,
+            style_recipes=selected_style_recipes,
+            id_prefix=id_prefix,
+            num_queries_per_combination=generation_kwargs["num_queries_per_combination"],
+            model_name=generation_kwargs["model_name"],
+            temperature=generation_kwargs["temperature"],
+            max_tokens=generation_kwargs["max_tokens"]
+        )
+    elif args.batch_ingest:
+        ingest_batch_results(
+            prompt_path=str(prompt_path),
+            output_dir=output_dir,
+            output_filename=output_filename,
+            results_path=args.batch_ingest,
+            param_recipes=selected_param_recipes,
+            style_recipes=selected_style_recipes,
+            id_prefix=id_prefix,
+            num_queries_per_combination=generation_kwargs["num_queries_per_combination"],
+            compact_output=compact_output,
+            dedup_threshold=dedup_threshold
+        )
+    elif args.merge:
+        merge_generation_shards(output_dir, output_filename, id_prefix, renumber=args.renumber)
+    elif args.workers:
+        run_sharded_generation(
+            args.workers, use_async=use_async, max_concurrency=max_concurrency,
+            renumber=args.renumber, **generation_kwargs
+        )
+    elif args.shard:
+        shard_index, num_shards = parse_shard_arg(args.shard)
+        specs = plan_generation_shards(
+            num_shards, selected_param_recipes, selected_style_recipes,
+            generation_kwargs["num_queries_per_combination"], total_target, param_weights, style_weights
+        )
+        os.makedirs(output_dir, exist_ok=True)
+        save_or_check_shard_plan(os.path.join(output_dir, output_filename), specs)
+        run_generation_shard(
+            specs[shard_index], use_async=use_async, max_concurrency=max_concurrency, **generation_kwargs
+        )
+    elif use_async:
+        asyncio.run(generate_diverse_training_data_async(max_concurrency=max_concurrency, **generation_kwargs))
+    else:
+        generate_diverse_training_data(**generation_kwargs)
 
 
 if __name__ == "__main__":
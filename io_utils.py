@@ -0,0 +1,237 @@
+"""
+io_utils.py
+
+JSON and JSONL I/O shared by every dataset stage, kept free of the LLM client stack so
+that training scripts and small CLI tools can import it cheaply. utils re-exports
+jdump/jload.
+
+Decoding uses orjson when it is installed (falling back to the json module for inputs
+orjson rejects, such as NaN literals) and the json module otherwise. Encoding always
+goes through the json module with its default separators, so the files written here
+are byte-identical to the ones written with json.dumps(record, ensure_ascii=False).
+
+Records are plain dicts, or BFCLRecord structs with typed=True:
+    for record in iter_jsonl("output/BFCL_V4_Mindat_v1.json", typed=True):
+        print(record.number, record.query)
+"""
+import io
+import json
+import os
+from dataclasses import dataclass
+from typing import Any, Iterable, Iterator, List, Optional
+
+try:
+    import orjson
+except ImportError:  # The json module decodes the same values, just slower
+    orjson = None
+
+
+def _make_w_io_base(f, mode: str):
+    if not isinstance(f, io.IOBase):
+        f_dirname = os.path.dirname(f)
+        if f_dirname != "":
+            os.makedirs(f_dirname, exist_ok=True)
+        f = open(f, mode=mode)
+    return f
+
+
+def _make_r_io_base(f, mode: str):
+    if not isinstance(f, io.IOBase):
+        f = open(f, mode=mode)
+    return f
+
+
+def jdump(obj, f, mode="w", indent=4, default=str):
+    """Dump a str or dictionary to a file in json format.
+
+    Args:
+        obj: An object to be written.
+        f: A string path to the location on disk.
+        mode: Mode for opening the file.
+        indent: Indent for storing json dictionaries.
+        default: A function to handle non-serializable entries; defaults to `str`.
+    """
+    f = _make_w_io_base(f, mode)
+    if isinstance(obj, (dict, list)):
+        json.dump(obj, f, indent=indent, default=default)
+    elif isinstance(obj, str):
+        f.write(obj)
+    else:
+        raise ValueError(f"Unexpected type: {type(obj)}")
+    f.close()
+
+
+def jload(f, mode="r"):
+    """Load a .json file into a dictionary."""
+    f = _make_r_io_base(f, mode)
+    jdict = loads(f.read())
+    f.close()
+    return jdict
+
+
+def loads(data):
+    """
+    Decode one JSON document (str or bytes), with orjson when it is available.
+
+    Raises:
+        json.JSONDecodeError: If the data is not valid JSON
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass  # NaN/Infinity, integers beyond 64 bits, ...: let the json module decide
+    return json.loads(data)
+
+
+# Same settings as json.dumps(obj, ensure_ascii=False), built once instead of per call
+_LINE_ENCODER = json.JSONEncoder(ensure_ascii=False)
+
+
+def dumps_line(obj) -> str:
+    """Encode a record exactly like json.dumps(obj, ensure_ascii=False) (without the newline)."""
+    return _LINE_ENCODER.encode(obj)
+
+
+_RECORD_FIELDS = ("id", "question", "function", "function_ref", "ground_truth")
+
+
+@dataclass(slots=True)
+class BFCLRecord:
+    """
+    One BFCL dataset line: a question record ("question" plus "function" or
+    "function_ref") or a ground-truth record ("ground_truth").
+
+    Fields the record does not have are None; unknown fields are kept in extra.
+    to_dict() writes the fields in the order the dataset writers use (id, question,
+    function, function_ref, ground_truth, then extra), so their lines re-encode to the
+    same bytes.
+    """
+    id: str
+    question: Optional[list] = None
+    function: Optional[list] = None
+    function_ref: Optional[list] = None
+    ground_truth: Optional[list] = None
+    extra: Optional[dict] = None
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "BFCLRecord":
+        try:
+            # The decoded values move straight into the slots, without a copy of the dict
+            return cls(**data)
+        except TypeError:
+            pass  # Unknown fields (or one named "extra")
+        known = {key: data.pop(key) for key in _RECORD_FIELDS if key in data}
+        return cls(**known, extra=data)
+
+    def to_dict(self) -> dict:
+        data = {"id": self.id}
+        for key in _RECORD_FIELDS[1:]:
+            value = getattr(self, key)
+            if value is not None:
+                data[key] = value
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    @property
+    def number(self) -> int:
+        """Numeric part of the ID (e.g. "Mindat_v1_112" -> 112)."""
+        return int(self.id.rsplit("_", 1)[-1])
+
+    @property
+    def query(self) -> Optional[str]:
+        """Text of the first user turn, if the record has a question."""
+        try:
+            return self.question[0][0]["content"]
+        except (IndexError, KeyError, TypeError):
+            return None
+
+
+def iter_jsonl(path: str, typed: bool = False) -> Iterator[Any]:
+    """
+    Stream the records of a JSONL file, skipping blank lines.
+
+    Args:
+        path: JSONL file
+        typed: Yield BFCLRecord structs instead of plain dicts
+
+    Yields:
+        One decoded record per non-empty line
+    """
+    # orjson decodes bytes directly, which skips a UTF-8 decode of every line
+    with open(path, "rb") if orjson is not None else open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield BFCLRecord.from_dict(loads(line)) if typed else loads(line)
+
+
+def read_jsonl(path: str, typed: bool = False) -> List[Any]:
+    """All records of a JSONL file (see iter_jsonl)."""
+    return list(iter_jsonl(path, typed))
+
+
+class JSONLWriter:
+    """
+    Buffered JSONL writer accepting dicts and BFCLRecord structs.
+
+    Usage:
+        with JSONLWriter(path) as writer:
+            writer.write(record)
+    """
+
+    def __init__(self, path: str, mode: str = "w", buffer_records: int = 1000):
+        """
+        Args:
+            path: Output JSONL file
+            mode: "w" to overwrite or "a" to append
+            buffer_records: Records encoded before each write to the file
+        """
+        self.path = path
+        self.buffer_records = buffer_records
+        self.count = 0
+        self._buffer: List[str] = []
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self._f = open(path, mode, encoding="utf-8")
+
+    def write(self, record):
+        if isinstance(record, BFCLRecord):
+            record = record.to_dict()
+        self._buffer.append(dumps_line(record))
+        self.count += 1
+        if len(self._buffer) >= self.buffer_records:
+            self.flush()
+
+    def write_many(self, records: Iterable):
+        for record in records:
+            self.write(record)
+
+    def flush(self):
+        if self._buffer:
+            self._f.write("\n".join(self._buffer) + "\n")
+            self._buffer = []
+        self._f.flush()
+
+    def close(self):
+        self.flush()
+        self._f.close()
+
+    def __enter__(self) -> "JSONLWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def write_jsonl(path: str, records: Iterable, mode: str = "w") -> int:
+    """
+    Write records (dicts or BFCLRecord structs) as JSONL.
+
+    Returns:
+        Number of records written
+    """
+    with JSONLWriter(path, mode=mode) as writer:
+        writer.write_many(records)
+    return writer.count
@@ -0,0 +1,227 @@
+"""
+llm_cache.py
+
+Content-addressed on-disk cache for LLM responses.
+
+Responses are stored in SQLite keyed on a SHA-256 hash of everything that determines
+the output: the formatted prompt/messages, model or deployment name, temperature,
+max_tokens and response format. Entries are evicted least-recently-used once the
+cache exceeds its entry or byte cap.
+
+Modes:
+    readwrite   serve hits from the cache and store new responses (default)
+    replay      serve hits only; a miss raises CacheMissError instead of calling the API
+    bypass      ignore the cache entirely
+
+The shared cache is configured from the environment:
+    LLM_CACHE_PATH          SQLite file (default: .llm_cache/responses.sqlite)
+    LLM_CACHE_MODE          readwrite | replay | bypass
+    LLM_CACHE_MAX_ENTRIES   maximum number of cached responses (default: 100000)
+    LLM_CACHE_MAX_BYTES     maximum total size of cached payloads (default: unlimited)
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Optional
+
+CACHE_MODES = ("readwrite", "replay", "bypass")
+
+
+class CacheMissError(KeyError):
+    """Raised in replay mode when a request has no cached response."""
+
+
+def _describe_response_format(response_format) -> Any:
+    """Turn a response_format (pydantic model, dict or None) into JSON-serializable form."""
+    if response_format is None:
+        return None
+    if hasattr(response_format, "model_json_schema"):
+        return response_format.model_json_schema()
+    return response_format
+
+
+def make_cache_key(
+    prompt: Any,
+    model: str,
+    temperature: Optional[float] = None,
+    max_tokens: Optional[int] = None,
+    response_format=None,
+    **extra
+) -> str:
+    """
+    Build the content-addressed key for a request.
+
+    Args:
+        prompt: Formatted prompt string or list of chat messages
+        model: Model or deployment name
+        temperature: Sampling temperature
+        max_tokens: Maximum tokens for generation
+        response_format: Structured output model or format dict, if any
+        **extra: Any further request arguments that change the response
+
+    Returns:
+        Hex SHA-256 digest identifying the request
+    """
+    payload = {
+        "prompt": prompt,
+        "model": model,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "response_format": _describe_response_format(response_format),
+        "extra": extra,
+    }
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """SQLite-backed LRU cache of JSON-serializable LLM responses."""
+
+    def __init__(
+        self,
+        path: str = ".llm_cache/responses.sqlite",
+        mode: str = "readwrite",
+        max_entries: Optional[int] = 100_000,
+        max_bytes: Optional[int] = None
+    ):
+        """
+        Args:
+            path: SQLite database file
+            mode: One of "readwrite", "replay" or "bypass"
+            max_entries: Maximum number of cached responses, or None for unlimited
+            max_bytes: Maximum total payload size in bytes, or None for unlimited
+        """
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown cache mode: {mode} (expected one of {CACHE_MODES})")
+        self.path = path
+        self.mode = mode
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._conn = None
+        if mode == "bypass":
+            return
+
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        # Sharded runs share the cache file across processes, so wait out their write locks
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created REAL NOT NULL, last_access INTEGER NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_lru ON responses (last_access)")
+        self._conn.commit()
+        self._count, self._total_bytes = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Look up a cached response and mark it as recently used.
+
+        Returns:
+            The cached value, or None on a miss (bypass mode always misses)
+
+        Raises:
+            CacheMissError: On a miss in replay mode
+        """
+        if self._conn is None:
+            return None
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                if self.mode == "replay":
+                    raise CacheMissError(key)
+                return None
+            self._conn.execute(
+                "UPDATE responses SET last_access = ? WHERE key = ?", (time.time_ns(), key)
+            )
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, value: Any):
+        """Store a response; a no-op in replay and bypass modes."""
+        if self._conn is None or self.mode != "readwrite":
+            return
+        encoded = json.dumps(value, ensure_ascii=False)
+        size = len(encoded.encode("utf-8"))
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created, last_access) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, encoded, size, time.time(), time.time_ns())
+            )
+            if old is None:
+                self._count += 1
+                self._total_bytes += size
+            else:
+                self._total_bytes += size - old[0]
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        """Delete least-recently-used entries until the cache is within its caps."""
+        while (
+            (self.max_entries is not None and self._count > self.max_entries)
+            or (self.max_bytes is not None and self._total_bytes > self.max_bytes and self._count > 0)
+        ):
+            excess = max(1, self._count - self.max_entries) if self.max_entries is not None else 1
+            rows = self._conn.execute(
+                "SELECT key, size FROM responses ORDER BY last_access LIMIT ?", (excess,)
+            ).fetchall()
+            if not rows:
+                break
+            self._conn.executemany("DELETE FROM responses WHERE key = ?", [(k,) for k, _ in rows])
+            self._count -= len(rows)
+            self._total_bytes -= sum(size for _, size in rows)
+            self.evictions += len(rows)
+
+    def stats(self) -> dict:
+        """Return hit/miss statistics for end-of-run reporting."""
+        return {
+            "mode": self.mode,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": self._count if self._conn is not None else 0,
+        }
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+_shared_cache = None
+_shared_cache_lock = threading.Lock()
+
+
+def get_shared_cache() -> ResponseCache:
+    """Return the process-wide cache configured from the LLM_CACHE_* environment variables."""
+    global _shared_cache
+    with _shared_cache_lock:
+        if _shared_cache is None:
+            max_entries = os.getenv("LLM_CACHE_MAX_ENTRIES", "100000")
+            max_bytes = os.getenv("LLM_CACHE_MAX_BYTES")
+            _shared_cache = ResponseCache(
+                path=os.getenv("LLM_CACHE_PATH", ".llm_cache/responses.sqlite"),
+                mode=os.getenv("LLM_CACHE_MODE", "readwrite"),
+                max_entries=int(max_entries) if max_entries else None,
+                max_bytes=int(max_bytes) if max_bytes else None,
+            )
+        return _shared_cache
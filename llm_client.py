@@ -0,0 +1,99 @@
+"""
+llm_client.py
+
+Lazily constructed, process-wide Azure OpenAI clients.
+
+Importing this module is cheap: .env is read and the openai/httpx stack is imported
+only when a client (or the deployment name) is first requested. Every caller shares one
+sync and one async client, so HTTP connections are pooled across the whole run.
+
+Environment:
+    AZURE_OPENAI_API_ENDPOINT, AZURE_OPENAI_API_KEY, AZURE_OPENAI_API_VERSION,
+    AZURE_DEPLOYMENT_NAME: Azure OpenAI settings
+    AZURE_OPENAI_MAX_CONNECTIONS: Size of the shared connection pool (default 64)
+"""
+import os
+import threading
+from typing import Optional
+
+_lock = threading.RLock()
+_env_loaded = False
+_client = None
+_async_client = None
+
+
+def load_environment():
+    """Load .env into the environment once per process."""
+    global _env_loaded
+    if _env_loaded:
+        return
+    with _lock:
+        if not _env_loaded:
+            from dotenv import load_dotenv
+
+            load_dotenv(override=True)
+            _env_loaded = True
+
+
+def get_deployment_name() -> Optional[str]:
+    """Default model / deployment name (AZURE_DEPLOYMENT_NAME)."""
+    load_environment()
+    return os.getenv("AZURE_DEPLOYMENT_NAME")
+
+
+def _client_kwargs() -> dict:
+    load_environment()
+    return {
+        "azure_endpoint": os.getenv("AZURE_OPENAI_API_ENDPOINT"),
+        "api_key": os.getenv("AZURE_OPENAI_API_KEY"),
+        "api_version": os.getenv("AZURE_OPENAI_API_VERSION"),
+    }
+
+
+def _pool_limits():
+    import httpx
+
+    max_connections = int(os.getenv("AZURE_OPENAI_MAX_CONNECTIONS", "64"))
+    return httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+
+
+def get_client():
+    """Return the shared AzureOpenAI client, creating it on first use."""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                from openai import AzureOpenAI, DefaultHttpxClient
+
+                kwargs = _client_kwargs()
+                _client = AzureOpenAI(http_client=DefaultHttpxClient(limits=_pool_limits()), **kwargs)
+    return _client
+
+
+def get_async_client():
+    """Return the shared AsyncAzureOpenAI client, creating it on first use."""
+    global _async_client
+    if _async_client is None:
+        with _lock:
+            if _async_client is None:
+                from openai import AsyncAzureOpenAI, DefaultAsyncHttpxClient
+
+                kwargs = _client_kwargs()
+                _async_client = AsyncAzureOpenAI(http_client=DefaultAsyncHttpxClient(limits=_pool_limits()), **kwargs)
+    return _async_client
+
+
+def set_clients(client=None, async_client=None):
+    """
+    Replace the shared clients, e.g. to point the pipeline at a local mock endpoint.
+
+    Args:
+        client: Sync client to use from now on (None keeps the current one)
+        async_client: Async client to use from now on (None keeps the current one)
+    """
+    global _client, _async_client
+    with _lock:
+        if client is not None:
+            _client = client
+        if async_client is not None:
+            _async_client = async_client
@@ -0,0 +1,331 @@
+"""
+metrics.py
+
+Per-call instrumentation for every LLM path (utils.openai_completion and the
+structured-output calls of the query generator).
+
+Each API call (or response-cache hit) is recorded with its prompt, completion and
+cached-prompt token counts, wall latency, retries, time spent throttled and the recipe
+cell(s) it served. Running histograms give latency and token percentiles at any point
+of a run, and the collected calls can be written as a JSON summary and a per-call CSV.
+
+Token prices for the cost estimate are read from the environment (USD per 1M tokens):
+    LLM_PROMPT_PRICE_PER_1M       uncached prompt tokens
+    LLM_CACHED_PRICE_PER_1M       cached prompt tokens (defaults to the prompt price)
+    LLM_COMPLETION_PRICE_PER_1M   completion tokens
+"""
+import csv
+import dataclasses
+import json
+import math
+import os
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+
+@dataclass
+class CallRecord:
+    """One LLM call as seen by the caller, including its retries."""
+    source: str  # "structured_output" | "openai_completion"
+    model: Optional[str] = None
+    cell: Optional[str] = None  # Recipe hash(es) served by the call, "+"-joined when packed
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    total_tokens: int = 0
+    latency: float = 0.0  # Wall seconds from first attempt to result, including waits
+    retries: int = 0
+    throttle_wait: float = 0.0  # Seconds spent in the rate limiter or backing off
+    cache_hit: bool = False
+    success: bool = True
+    started_at: float = 0.0
+    first_query_latency: Optional[float] = None  # Streamed calls: seconds until the first finished query
+
+
+def usage_counts(usage) -> Tuple[int, int, int, int]:
+    """
+    Read token counts from an API usage object.
+
+    Returns:
+        Tuple of (prompt_tokens, completion_tokens, cached_tokens, total_tokens)
+    """
+    if usage is None:
+        return 0, 0, 0, 0
+    prompt_tokens = getattr(usage, "prompt_tokens", None) or 0
+    completion_tokens = getattr(usage, "completion_tokens", None) or 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = getattr(details, "cached_tokens", None) or 0
+    total_tokens = getattr(usage, "total_tokens", None) or prompt_tokens + completion_tokens
+    return prompt_tokens, completion_tokens, cached_tokens, total_tokens
+
+
+class Histogram:
+    """
+    Running histogram with logarithmic buckets.
+
+    Memory is constant in the number of observations; percentiles are read from the
+    buckets, so they are accurate to within one bucket width (growth - 1, 10% by default).
+    """
+
+    def __init__(self, smallest: float = 1e-3, growth: float = 1.1):
+        """
+        Args:
+            smallest: Upper bound of the first bucket; smaller values land in it
+            growth: Ratio between consecutive bucket bounds
+        """
+        self.smallest = smallest
+        self.growth = growth
+        self.counts: Dict[int, int] = defaultdict(int)
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def _bucket(self, value: float) -> int:
+        if value <= self.smallest:
+            return 0
+        return math.ceil(math.log(value / self.smallest, self.growth))
+
+    def _upper_bound(self, bucket: int) -> float:
+        return self.smallest * self.growth ** bucket
+
+    def add(self, value: float):
+        self.counts[self._bucket(value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def percentile(self, q: float) -> float:
+        """Estimated q-th percentile (q in [0, 100]), clamped to the observed range."""
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(q / 100.0 * self.count))
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                if bucket == 0:
+                    # Values at or below `smallest` (often exact zeros) share the first bucket
+                    return self.min
+                return min(max(self._upper_bound(bucket), self.min), self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        if not self.count:
+            return {"count": 0}
+        return {
+            "count": self.count,
+            "mean": round(self.total / self.count, 4),
+            "min": round(self.min, 4),
+            "p50": round(self.percentile(50), 4),
+            "p90": round(self.percentile(90), 4),
+            "p99": round(self.percentile(99), 4),
+            "max": round(self.max, 4),
+        }
+
+
+class CallMetrics:
+    """Thread-safe collector of CallRecords with running histograms."""
+
+    HISTOGRAMS = (
+        "latency", "first_query_latency", "throttle_wait", "prompt_tokens", "completion_tokens", "total_tokens",
+        "retries",
+    )
+
+    def __init__(
+        self,
+        prompt_price: Optional[float] = None,
+        completion_price: Optional[float] = None,
+        cached_price: Optional[float] = None
+    ):
+        """
+        Args:
+            prompt_price: USD per 1M uncached prompt tokens (None disables the cost estimate)
+            completion_price: USD per 1M completion tokens
+            cached_price: USD per 1M cached prompt tokens (defaults to prompt_price)
+        """
+        self.prompt_price = prompt_price
+        self.completion_price = completion_price
+        self.cached_price = cached_price if cached_price is not None else prompt_price
+        self._lock = threading.Lock()
+        self.calls: List[CallRecord] = []
+        self.histograms = {name: Histogram() for name in self.HISTOGRAMS}
+
+    @classmethod
+    def from_environment(cls) -> "CallMetrics":
+        """Collector priced from the LLM_*_PRICE_PER_1M environment variables."""
+        return cls(
+            prompt_price=_env_price("LLM_PROMPT_PRICE_PER_1M"),
+            completion_price=_env_price("LLM_COMPLETION_PRICE_PER_1M"),
+            cached_price=_env_price("LLM_CACHED_PRICE_PER_1M"),
+        )
+
+    def record(self, call: CallRecord):
+        with self._lock:
+            self.calls.append(call)
+            if call.cache_hit:
+                # Cache hits cost nothing and would skew the API latency distribution
+                return
+            for name, histogram in self.histograms.items():
+                value = getattr(call, name)
+                if value is not None:
+                    histogram.add(value)
+
+    def cost(self, call: CallRecord) -> Optional[float]:
+        """Estimated USD cost of a call, or None if no prices are configured."""
+        if self.prompt_price is None and self.completion_price is None:
+            return None
+        uncached = call.prompt_tokens - call.cached_tokens
+        return (
+            uncached * (self.prompt_price or 0.0)
+            + call.cached_tokens * (self.cached_price or 0.0)
+            + call.completion_tokens * (self.completion_price or 0.0)
+        ) / 1_000_000
+
+    def _cell_summaries(self, calls: List[CallRecord]) -> Dict[str, dict]:
+        cells: Dict[str, dict] = {}
+        for call in calls:
+            if call.cell is None:
+                continue
+            # A packed call is attributed to each of its cells in equal shares
+            members = call.cell.split("+")
+            share = 1.0 / len(members)
+            for cell in members:
+                entry = cells.setdefault(cell, {
+                    "calls": 0, "retries": 0, "prompt_tokens": 0.0, "completion_tokens": 0.0,
+                    "cached_tokens": 0.0, "latency": 0.0, "failures": 0,
+                })
+                entry["calls"] += 1
+                entry["retries"] += call.retries
+                entry["prompt_tokens"] += call.prompt_tokens * share
+                entry["completion_tokens"] += call.completion_tokens * share
+                entry["cached_tokens"] += call.cached_tokens * share
+                entry["latency"] += call.latency
+                entry["failures"] += not call.success
+        for entry in cells.values():
+            for key in ("prompt_tokens", "completion_tokens", "cached_tokens", "latency"):
+                entry[key] = round(entry[key], 3)
+        return cells
+
+    def summary(self, per_cell: bool = True) -> dict:
+        """
+        Aggregate totals, histogram percentiles and (optionally) per-cell usage.
+
+        Returns:
+            JSON-serializable summary dict
+        """
+        with self._lock:
+            calls = list(self.calls)
+            histograms = {name: histogram.summary() for name, histogram in self.histograms.items()}
+        api_calls = [call for call in calls if not call.cache_hit]
+        summary = {
+            "calls": len(api_calls),
+            "cache_hits": len(calls) - len(api_calls),
+            "failures": sum(not call.success for call in api_calls),
+            "retries": sum(call.retries for call in api_calls),
+            "throttle_seconds": round(sum(call.throttle_wait for call in api_calls), 3),
+            "prompt_tokens": sum(call.prompt_tokens for call in api_calls),
+            "cached_tokens": sum(call.cached_tokens for call in api_calls),
+            "completion_tokens": sum(call.completion_tokens for call in api_calls),
+            "total_tokens": sum(call.total_tokens for call in api_calls),
+            "histograms": histograms,
+        }
+        costs = [self.cost(call) for call in api_calls]
+        if api_calls and costs[0] is not None:
+            summary["estimated_cost_usd"] = round(sum(costs), 6)
+        if per_cell:
+            summary["cells"] = self._cell_summaries(api_calls)
+        return summary
+
+    def stats(self) -> dict:
+        """Short running view for progress logging."""
+        with self._lock:
+            latency = self.histograms["latency"]
+            return {
+                "calls": latency.count,
+                "latency_p50": round(latency.percentile(50), 3),
+                "latency_p99": round(latency.percentile(99), 3),
+                "total_tokens": int(self.histograms["total_tokens"].total),
+            }
+
+    def progress_label(self) -> str:
+        """Compact running latency/token figures for a progress bar."""
+        stats = self.stats()
+        return f"p50 {stats['latency_p50']:.2f}s, p99 {stats['latency_p99']:.2f}s, {stats['total_tokens']} tok"
+
+    def write_json(self, path: str):
+        """Write the run summary (including per-cell usage) as JSON."""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.summary(), f, indent=2)
+
+    def write_csv(self, path: str):
+        """Write one CSV row per recorded call."""
+        fields = [field.name for field in dataclasses.fields(CallRecord)] + ["cost_usd"]
+        with self._lock:
+            calls = list(self.calls)
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            writer.writeheader()
+            for call in calls:
+                row = dataclasses.asdict(call)
+                cost = self.cost(call)
+                row["cost_usd"] = round(cost, 8) if cost is not None else ""
+                writer.writerow(row)
+
+
+class CallTimer:
+    """
+    Accumulates the pieces of a CallRecord across the attempts of one call.
+
+    Typical use:
+        timer = CallTimer(metrics, "structured_output", model, cell)
+        timer.throttle_wait += limiter.acquire(tokens)
+        ... on retry: timer.retries += 1
+        timer.finish(usage=completion.usage)
+    """
+
+    def __init__(self, metrics: "CallMetrics", source: str, model: Optional[str] = None, cell: Optional[str] = None):
+        self.metrics = metrics
+        self.record = CallRecord(source=source, model=model, cell=cell, started_at=time.time())
+        self._start = time.perf_counter()
+        self.retries = 0
+        self.throttle_wait = 0.0
+
+    def mark_first_query(self):
+        """Note the time the first query of a streamed response was complete."""
+        if self.record.first_query_latency is None:
+            self.record.first_query_latency = time.perf_counter() - self._start
+
+    def finish(self, usage=None, success: bool = True, cache_hit: bool = False) -> CallRecord:
+        record = self.record
+        (record.prompt_tokens, record.completion_tokens,
+         record.cached_tokens, record.total_tokens) = usage_counts(usage)
+        record.latency = time.perf_counter() - self._start
+        record.retries = self.retries
+        record.throttle_wait = self.throttle_wait
+        record.success = success
+        record.cache_hit = cache_hit
+        self.metrics.record(record)
+        return record
+
+
+def _env_price(name: str) -> Optional[float]:
+    value = os.getenv(name)
+    return float(value) if value else None
+
+
+_shared_metrics = None
+_shared_metrics_lock = threading.Lock()
+
+
+def get_shared_metrics() -> CallMetrics:
+    """Return the process-wide collector, priced from the LLM_*_PRICE_PER_1M variables."""
+    global _shared_metrics
+    with _shared_metrics_lock:
+        if _shared_metrics is None:
+            _shared_metrics = CallMetrics.from_environment()
+        return _shared_metrics
@@ -0,0 +1,313 @@
+"""
+mock_llm.py
+
+Local stand-in for the Azure OpenAI chat-completions endpoint.
+
+The server answers POST .../chat/completions (which both chat.completions.create and
+beta.chat.completions.parse use) with deterministic payloads derived from the prompt:
+    - response_format QueryList: {"queries": [...]} with the requested number of queries
+    - response_format PackedQueryList: one entry per "cell_id: ..." line of the prompt
+    - no response_format: a short plain-text completion
+
+Requests with "stream": true are answered as server-sent events: the content arrives
+in small chunks spread over the drawn latency (the first one after
+time_to_first_chunk of it), followed by a usage chunk when stream_options asks for one.
+
+Latency is drawn from a configurable distribution, a configurable share of requests
+fails with 429 (with Retry-After) or 5xx, and another share of responses under-delivers
+queries, so throughput, concurrency, retry and top-up behavior of the pipeline can be
+measured without network access.
+
+Run:
+python mock_llm.py --port 8000 --latency_mean 0.3 --rate_limit_rate 0.05
+"""
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+
+@dataclass
+class MockLLMConfig:
+    """Behavior of the mock endpoint."""
+    latency: str = "lognormal"  # constant | uniform | lognormal
+    latency_mean: float = 0.2  # Mean service time in seconds
+    latency_spread: float = 0.5  # uniform: +/- fraction of the mean; lognormal: sigma
+    rate_limit_rate: float = 0.0  # Share of requests answered with 429
+    server_error_rate: float = 0.0  # Share of requests answered with 500
+    retry_after: float = 0.5  # Retry-After seconds sent with 429 responses
+    short_response_rate: float = 0.0  # Share of successful responses with about half the queries asked for
+    time_to_first_chunk: float = 0.1  # Streaming: share of the latency before the first chunk
+    stream_chunk_chars: int = 16  # Streaming: characters of content per chunk
+    seed: int = 0
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile (q in [0, 100]) of a list of numbers."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100.0 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def _mock_content(body: dict, short: bool = False) -> str:
+    """Deterministic completion content for a request body (short: under-deliver queries)."""
+    prompt = "\n".join(str(message.get("content", "")) for message in body.get("messages", []))
+    digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8]
+    response_format = body.get("response_format") or {}
+    schema_name = (response_format.get("json_schema") or {}).get("name")
+
+    match = re.search(r"Generate exactly (\d+)", prompt)
+    num_queries = int(match.group(1)) if match else 5
+    if short:
+        num_queries //= 2
+
+    if schema_name == "QueryList":
+        queries = [f"Mock query {i + 1} ({digest})" for i in range(num_queries)]
+        return json.dumps({"queries": queries})
+    if schema_name == "PackedQueryList":
+        cells = [
+            {"cell_id": cell_id, "queries": [f"Mock query {i + 1} ({digest} {cell_id})" for i in range(num_queries)]}
+            for cell_id in re.findall(r"^cell_id: (\S+)", prompt, flags=re.MULTILINE)
+        ]
+        return json.dumps({"cells": cells})
+    return f"Mock response ({digest})"
+
+
+class MockLLMServer:
+    """Threaded HTTP server imitating the chat-completions endpoint."""
+
+    def __init__(self, config: Optional[MockLLMConfig] = None, host: str = "127.0.0.1", port: int = 0):
+        """
+        Args:
+            config: Latency and error-injection settings
+            host: Interface to bind
+            port: Port to bind (0 picks a free port)
+        """
+        self.config = config or MockLLMConfig()
+        self._rng = random.Random(self.config.seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.rate_limited = 0
+        self.server_errors = 0
+        self.service_times: List[float] = []
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                if not self.path.split("?")[0].endswith("/chat/completions"):
+                    self._send(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+                    return
+                delay, outcome = server._draw()
+                if body.get("stream") and outcome not in (429, 500):
+                    self._stream(body, delay, short=outcome == "short")
+                    return
+                time.sleep(delay)
+                if outcome == 429:
+                    self._send(
+                        429,
+                        {"error": {"message": "Rate limit exceeded (mock)", "type": "rate_limit_error", "code": "429"}},
+                        {"retry-after": str(server.config.retry_after)}
+                    )
+                elif outcome == 500:
+                    self._send(500, {"error": {"message": "Internal server error (mock)", "type": "server_error"}})
+                else:
+                    self._send(200, server._completion(body, short=outcome == "short"))
+
+            def _stream(self, body: dict, delay: float, short: bool = False):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                start = time.monotonic()
+                events = server._stream_events(body, short)
+                for index, event in enumerate(events):
+                    # Chunks arrive evenly after the first one, finishing at `delay`
+                    share = server.config.time_to_first_chunk
+                    due = start + delay * (share + (1 - share) * index / max(1, len(events) - 1))
+                    time.sleep(max(0.0, due - time.monotonic()))
+                    self._write_chunk(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+                self._write_chunk(b"data: [DONE]\n\n")
+                self._write_chunk(b"")  # End of the chunked body
+
+            def _write_chunk(self, data: bytes):
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+
+            def _send(self, status: int, payload: dict, headers: Optional[dict] = None):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                # Keep the client SDK's own retry loop out of the measurements
+                self.send_header("x-should-retry", "false")
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def endpoint(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _draw(self):
+        """Pick the service time and outcome of one request."""
+        config = self.config
+        with self._lock:
+            self.requests += 1
+            if config.latency == "constant":
+                delay = config.latency_mean
+            elif config.latency == "uniform":
+                spread = config.latency_mean * config.latency_spread
+                delay = self._rng.uniform(config.latency_mean - spread, config.latency_mean + spread)
+            elif config.latency == "lognormal":
+                sigma = config.latency_spread
+                # Parameterized so the distribution's mean equals latency_mean
+                delay = self._rng.lognormvariate(math.log(max(config.latency_mean, 1e-6)) - sigma ** 2 / 2, sigma)
+            else:
+                raise ValueError(f"Unknown latency distribution: {config.latency}")
+            roll = self._rng.random()
+            if roll < config.rate_limit_rate:
+                outcome = 429
+                self.rate_limited += 1
+            elif roll < config.rate_limit_rate + config.server_error_rate:
+                outcome = 500
+                self.server_errors += 1
+            elif self._rng.random() < config.short_response_rate:
+                outcome = "short"
+            else:
+                outcome = 200
+            delay = max(0.0, delay)
+            self.service_times.append(delay)
+        return delay, outcome
+
+    def _completion(self, body: dict, short: bool = False) -> dict:
+        content = _mock_content(body, short)
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in body.get("messages", [])) // 4
+        completion_tokens = max(1, len(content) // 4)
+        n = body.get("n") or 1
+        return {
+            "id": f"chatcmpl-mock-{self.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [
+                {
+                    "index": i,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                    "logprobs": None,
+                }
+                for i in range(n)
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens * n,
+                "total_tokens": prompt_tokens + completion_tokens * n,
+            },
+        }
+
+    def _stream_events(self, body: dict, short: bool = False) -> List[dict]:
+        """Chunk payloads of a streamed completion, ending with the finish and usage chunks."""
+        completion = self._completion(body, short)
+        content = completion["choices"][0]["message"]["content"]
+        size = max(1, self.config.stream_chunk_chars)
+        n = body.get("n") or 1
+
+        def chunk(choices, usage=None):
+            return {
+                "id": completion["id"],
+                "object": "chat.completion.chunk",
+                "created": completion["created"],
+                "model": completion["model"],
+                "choices": choices,
+                "usage": usage,
+            }
+
+        events = [
+            chunk([
+                {"index": i, "delta": {"role": "assistant", "content": content[start:start + size]},
+                 "finish_reason": None, "logprobs": None}
+                for i in range(n)
+            ])
+            for start in range(0, len(content), size)
+        ]
+        events.append(chunk([{"index": i, "delta": {}, "finish_reason": "stop", "logprobs": None} for i in range(n)]))
+        if (body.get("stream_options") or {}).get("include_usage"):
+            events.append(chunk([], completion["usage"]))
+        return events
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "rate_limited": self.rate_limited,
+                "server_errors": self.server_errors,
+                "service_p50": percentile(self.service_times, 50),
+                "service_p99": percentile(self.service_times, 99),
+            }
+
+    def start(self) -> "MockLLMServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "MockLLMServer":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def make_client(self, **kwargs):
+        """AzureOpenAI client pointed at this server."""
+        from openai import AzureOpenAI
+
+        return AzureOpenAI(azure_endpoint=self.endpoint, api_key="mock", api_version="2024-08-01-preview", **kwargs)
+
+    def make_async_client(self, **kwargs):
+        """AsyncAzureOpenAI client pointed at this server."""
+        from openai import AsyncAzureOpenAI
+
+        return AsyncAzureOpenAI(azure_endpoint=self.endpoint, api_key="mock", api_version="2024-08-01-preview", **kwargs)
+
+
+def serve(port: int = 8000, **config):
+    """Run the mock endpoint in the foreground."""
+    server = MockLLMServer(MockLLMConfig(**config), port=port)
+    print(f"Mock chat-completions endpoint listening on {server.endpoint}")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._httpd.server_close()
+
+
+if __name__ == "__main__":
+    import fire
+
+    fire.Fire(serve)
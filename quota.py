@@ -0,0 +1,114 @@
+"""
+quota.py
+
+Per-cell record quotas for the generation grid.
+
+A quota is either a fixed count per (param_recipe, style_recipe) cell or an overall
+dataset size split across cells by weight (largest-remainder apportionment, so the
+cell targets always add up to the requested total). QuotaTracker follows how many
+records each cell has on disk and reports the remaining gaps, which the generator
+fills with small follow-up requests instead of re-running whole grids.
+"""
+import math
+from typing import Dict, List, Optional, Sequence, Tuple
+
+
+def apportion(total: int, weights: Sequence[float]) -> List[int]:
+    """
+    Split an integer total in proportion to weights (largest-remainder method).
+
+    Args:
+        total: Number to split
+        weights: Non-negative weights, at least one positive
+
+    Returns:
+        Integer shares that sum to total
+    """
+    if total < 0:
+        raise ValueError("total must be non-negative")
+    weight_sum = float(sum(weights))
+    if weight_sum <= 0 or any(weight < 0 for weight in weights):
+        raise ValueError("weights must be non-negative with a positive sum")
+    exact = [total * weight / weight_sum for weight in weights]
+    shares = [math.floor(value) for value in exact]
+    # Hand the remaining units to the largest fractional parts, earliest first on ties
+    order = sorted(range(len(exact)), key=lambda i: (shares[i] - exact[i], i))
+    for i in order[:total - sum(shares)]:
+        shares[i] += 1
+    return shares
+
+
+def grid_targets(
+    num_param_recipes: int,
+    num_style_recipes: int,
+    per_cell: Optional[int] = None,
+    total: Optional[int] = None,
+    param_weights: Optional[Sequence[float]] = None,
+    style_weights: Optional[Sequence[float]] = None
+) -> Dict[Tuple[int, int], int]:
+    """
+    Target record count for every (param_index, style_index) cell of the grid.
+
+    Args:
+        num_param_recipes: Number of parameter recipes
+        num_style_recipes: Number of style recipes
+        per_cell: Fixed target per cell (used when total is None)
+        total: Overall dataset size split across the cells
+        param_weights: Relative weight of each parameter recipe (default: equal)
+        style_weights: Relative weight of each style recipe (default: equal)
+
+    Returns:
+        Dict mapping (param_index, style_index) to the cell's target
+    """
+    cells = [(p, s) for p in range(num_param_recipes) for s in range(num_style_recipes)]
+    if total is None:
+        if per_cell is None:
+            raise ValueError("Either per_cell or total must be given")
+        return {cell: per_cell for cell in cells}
+
+    param_weights = list(param_weights) if param_weights is not None else [1.0] * num_param_recipes
+    style_weights = list(style_weights) if style_weights is not None else [1.0] * num_style_recipes
+    if len(param_weights) != num_param_recipes or len(style_weights) != num_style_recipes:
+        raise ValueError("Need one weight per parameter recipe and per style recipe")
+    # A cell's weight is the product of its recipes' weights
+    weights = [param_weights[p] * style_weights[s] for p, s in cells]
+    return dict(zip(cells, apportion(total, weights)))
+
+
+class QuotaTracker:
+    """Targets and on-disk fill counts of the grid cells in one generation run."""
+
+    def __init__(self, targets: Dict[str, int], filled: Optional[Dict[str, int]] = None):
+        """
+        Args:
+            targets: Cell recipe hash -> target number of records
+            filled: Cell recipe hash -> records already written (e.g. from the journal)
+        """
+        self.targets = dict(targets)
+        self.filled = {cell: (filled or {}).get(cell, 0) for cell in targets}
+
+    def restrict(self, cells) -> "QuotaTracker":
+        """Tracker limited to a subset of the cells (e.g. one shard's)."""
+        cells = list(cells)
+        return QuotaTracker({cell: self.targets[cell] for cell in cells}, {cell: self.filled[cell] for cell in cells})
+
+    def gap(self, cell: str) -> int:
+        """Records still missing for a cell (never negative)."""
+        return max(0, self.targets[cell] - self.filled[cell])
+
+    def add(self, cell: str, count: int):
+        self.filled[cell] += count
+
+    def unmet(self) -> Dict[str, int]:
+        """Cells below their target, with their gaps."""
+        return {cell: self.gap(cell) for cell in self.targets if self.gap(cell) > 0}
+
+    def summary(self) -> dict:
+        unmet = self.unmet()
+        return {
+            "cells": len(self.targets),
+            "target": sum(self.targets.values()),
+            "filled": sum(min(self.filled[cell], target) for cell, target in self.targets.items()),
+            "short_cells": len(unmet),
+            "shortfall": sum(unmet.values()),
+        }
@@ -0,0 +1,292 @@
+"""
+rate_limiter.py
+
+Adaptive token-bucket rate limiting shared by utils.openai_completion and the query generator.
+
+The limiter budgets requests per minute (RPM) and tokens per minute (TPM), honors
+Retry-After headers, backs off exponentially with jitter on 429s and slowly raises
+throughput again once rate limits stop. Time spent waiting is tracked so runs can
+report how long they were throttled.
+
+Budgets for the shared limiter are read from the environment:
+    AZURE_OPENAI_RPM    requests per minute for the deployment (unset = unlimited)
+    AZURE_OPENAI_TPM    tokens per minute for the deployment (unset = unlimited)
+"""
+import email.utils
+import os
+import random
+import threading
+import time
+from typing import Optional
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """Return True if an API exception is an HTTP 429 rate limit response."""
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(error, "response", None), "status_code", None)
+    return status_code == 429
+
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """
+    Extract the server-requested wait from an API exception.
+
+    Looks at the retry-after-ms and retry-after response headers; retry-after may be
+    either a number of seconds or an HTTP date.
+
+    Args:
+        error: Exception raised by the API client
+
+    Returns:
+        Seconds to wait, or None if the response carries no usable hint
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms is not None:
+        try:
+            return max(0.0, float(retry_after_ms) / 1000.0)
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if retry_after is None:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def estimate_request_tokens(prompt_text: str, max_tokens: int) -> int:
+    """
+    Estimate the tokens a request counts against the TPM quota.
+
+    Azure charges the prompt plus the full max_tokens budget when admitting a request,
+    so the estimate uses ~4 characters per prompt token plus max_tokens.
+    """
+    return len(prompt_text) // 4 + max_tokens
+
+
+class AdaptiveRateLimiter:
+    """
+    Thread- and asyncio-safe token bucket for requests and tokens per minute.
+
+    Callers reserve capacity with acquire()/acquire_async() before each request and
+    report the outcome with record_success() or record_rate_limit(). A 429 halves the
+    effective rate and pauses dispatch; after recovery_interval seconds without a 429
+    the rate creeps back up by recovery_step per successful request.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        burst_seconds: float = 10.0,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        decrease_factor: float = 0.5,
+        recovery_step: float = 0.05,
+        recovery_interval: float = 30.0,
+        min_rate_scale: float = 0.1,
+    ):
+        """
+        Args:
+            requests_per_minute: Request budget per minute, or None for unlimited
+            tokens_per_minute: Token budget per minute, or None for unlimited
+            burst_seconds: Seconds of budget that may be spent in a single burst
+            base_delay: Initial backoff delay in seconds
+            max_delay: Upper bound for a single backoff delay in seconds
+            decrease_factor: Multiplier applied to the rate after each 429
+            recovery_step: Fraction of the full rate restored per success once recovering
+            recovery_interval: Seconds without a 429 before the rate starts recovering
+            min_rate_scale: Lowest fraction of the configured rate the limiter will drop to
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.burst_seconds = burst_seconds
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.decrease_factor = decrease_factor
+        self.recovery_step = recovery_step
+        self.recovery_interval = recovery_interval
+        self.min_rate_scale = min_rate_scale
+
+        self._lock = threading.Lock()
+        now = time.monotonic()
+        self._last_refill = now
+        self._request_level = self._capacity(requests_per_minute)
+        self._token_level = self._capacity(tokens_per_minute)
+        self._blocked_until = now
+        self._last_rate_limit = None
+        self.rate_scale = 1.0
+
+        # Statistics
+        self.requests = 0
+        self.rate_limit_hits = 0
+        self.throttled_seconds = 0.0
+
+    def _capacity(self, per_minute: Optional[float]) -> float:
+        if per_minute is None:
+            return 0.0
+        return max(1.0, per_minute * self.burst_seconds / 60.0)
+
+    def _refill(self, now: float):
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        if self.requests_per_minute is not None:
+            rate = self.requests_per_minute * self.rate_scale / 60.0
+            self._request_level = min(
+                self._capacity(self.requests_per_minute),
+                self._request_level + elapsed * rate
+            )
+        if self.tokens_per_minute is not None:
+            rate = self.tokens_per_minute * self.rate_scale / 60.0
+            self._token_level = min(
+                self._capacity(self.tokens_per_minute),
+                self._token_level + elapsed * rate
+            )
+
+    def _reserve(self, tokens: int) -> float:
+        """Reserve one request and `tokens` tokens; return seconds to wait before sending."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait = max(0.0, self._blocked_until - now)
+
+            # Levels may go negative: the deficit is the queue of callers ahead of us
+            if self.requests_per_minute is not None:
+                self._request_level -= 1
+                if self._request_level < 0:
+                    rate = self.requests_per_minute * self.rate_scale / 60.0
+                    wait = max(wait, -self._request_level / rate)
+            if self.tokens_per_minute is not None and tokens > 0:
+                self._token_level -= tokens
+                if self._token_level < 0:
+                    rate = self.tokens_per_minute * self.rate_scale / 60.0
+                    wait = max(wait, -self._token_level / rate)
+
+            self.requests += 1
+            self.throttled_seconds += wait
+            return wait
+
+    def acquire(self, tokens: int = 0) -> float:
+        """
+        Block until a request of `tokens` tokens may be sent.
+
+        Returns:
+            Seconds spent waiting
+        """
+        wait = self._reserve(tokens)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self, tokens: int = 0) -> float:
+        """Async version of acquire() that yields to the event loop while waiting."""
+        import asyncio  # Already loaded whenever an event loop is running
+
+        wait = self._reserve(tokens)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def record_success(self, tokens_used: Optional[int] = None, tokens_reserved: int = 0):
+        """
+        Report a successful request.
+
+        Args:
+            tokens_used: Actual tokens billed, used to refund an over-estimated reservation
+            tokens_reserved: Tokens passed to acquire() for this request
+        """
+        with self._lock:
+            if self.tokens_per_minute is not None and tokens_used is not None:
+                self._token_level += tokens_reserved - tokens_used
+            if self.rate_scale < 1.0 and (
+                self._last_rate_limit is None
+                or time.monotonic() - self._last_rate_limit >= self.recovery_interval
+            ):
+                self.rate_scale = min(1.0, self.rate_scale + self.recovery_step)
+
+    def backoff_delay(
+        self,
+        attempt: int,
+        retry_after: Optional[float] = None,
+        base_delay: Optional[float] = None
+    ) -> float:
+        """
+        Exponential backoff with full jitter, never shorter than the server's Retry-After.
+
+        Args:
+            attempt: Zero-based retry attempt number
+            retry_after: Server-requested wait in seconds, if any
+            base_delay: Override for the limiter's base_delay
+        """
+        base_delay = self.base_delay if base_delay is None else base_delay
+        delay = random.uniform(0, min(self.max_delay, base_delay * (2 ** attempt)))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def record_rate_limit(self, attempt: int = 0, retry_after: Optional[float] = None) -> float:
+        """
+        Report a 429: lower the rate and pause dispatch for every caller.
+
+        The pause is enforced by the next acquire(), so callers should simply retry
+        rather than sleeping themselves.
+
+        Args:
+            attempt: Zero-based retry attempt number of the failed request
+            retry_after: Server-requested wait in seconds, if any
+
+        Returns:
+            Seconds until dispatch resumes
+        """
+        delay = self.backoff_delay(attempt, retry_after)
+        with self._lock:
+            now = time.monotonic()
+            self.rate_limit_hits += 1
+            self._last_rate_limit = now
+            self.rate_scale = max(self.min_rate_scale, self.rate_scale * self.decrease_factor)
+            self._blocked_until = max(self._blocked_until, now + delay)
+        return delay
+
+    def record_backoff(self, delay: float):
+        """Account for a retry sleep that the caller performs itself."""
+        with self._lock:
+            self.throttled_seconds += delay
+
+    def stats(self) -> dict:
+        """Return throttling statistics for end-of-run reporting."""
+        return {
+            "requests": self.requests,
+            "rate_limit_hits": self.rate_limit_hits,
+            "throttled_seconds": round(self.throttled_seconds, 3),
+            "rate_scale": round(self.rate_scale, 3),
+        }
+
+
+_shared_limiter = None
+_shared_limiter_lock = threading.Lock()
+
+
+def get_shared_rate_limiter() -> AdaptiveRateLimiter:
+    """Return the process-wide limiter configured from AZURE_OPENAI_RPM / AZURE_OPENAI_TPM."""
+    global _shared_limiter
+    with _shared_limiter_lock:
+        if _shared_limiter is None:
+            rpm = os.getenv("AZURE_OPENAI_RPM")
+            tpm = os.getenv("AZURE_OPENAI_TPM")
+            _shared_limiter = AdaptiveRateLimiter(
+                requests_per_minute=float(rpm) if rpm else None,
+                tokens_per_minute=float(tpm) if tpm else None,
+            )
+        return _shared_limiter
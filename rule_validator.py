@@ -0,0 +1,351 @@
+"""
+rule_validator.py
+
+Local RuleValidator for mindat_geomaterial call arguments.
+
+Implements the rules the invalid parameter recipes of generate_instruction_v8.py are
+written against:
+    rule_schema             no fields outside the schema, and each field of its schema type
+    rule_hardness_range     hardness_min/hardness_max within the Mohs scale, min <= max
+    rule_crystal_system     every crystal_system value is one of the schema's enum values
+    rule_chemical_element   every el_inc/el_exc entry is an element symbol or name (or a
+                            name misspelled by an edit or two, see elements.ElementIndex)
+    rule_element_conflict   no element is both included and excluded
+
+The validator is compiled once from a function schema (field set, type table, enum set)
+and reused for every argument dict. validate_many() checks the hardness bounds of a
+whole batch as columns (with numpy if it is installed); the element index resolves each
+distinct element string only once.
+
+Run:
+python rule_validator.py arguments.jsonl --output_path violations.jsonl
+"""
+import json
+import math
+import time
+from collections import Counter
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from elements import ElementIndex, get_element_index
+
+try:
+    import numpy as np
+except ImportError:  # The column checks fall back to list comprehensions
+    np = None
+
+RULES = (
+    "rule_schema",
+    "rule_hardness_range",
+    "rule_crystal_system",
+    "rule_chemical_element",
+    "rule_element_conflict",
+)
+
+# JSON schema type names (including the BFCL "dict"/"float" spellings) -> Python types
+_SCHEMA_TYPES = {
+    "boolean": (bool,),
+    "float": (int, float),
+    "number": (int, float),
+    "integer": (int,),
+    "string": (str,),
+    "array": (list, tuple),
+    "dict": (dict,),
+    "object": (dict,),
+}
+_HARDNESS_FIELDS = ("hardness_min", "hardness_max")
+_ELEMENT_FIELDS = ("el_inc", "el_exc")
+
+
+class Violation(NamedTuple):
+    """One broken rule in an argument dict."""
+    rule: str
+    field: Optional[str]
+    message: str
+
+
+def _number(value) -> float:
+    """Numeric argument value as a float, NaN if missing or not a number."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return math.nan
+
+
+class RuleValidator:
+    """Checks mindat_geomaterial argument dicts against a function schema."""
+
+    def __init__(
+        self,
+        schema: dict,
+        hardness_range: Tuple[float, float] = (1.0, 10.0),
+        element_index: Optional[ElementIndex] = None
+    ):
+        """
+        Args:
+            schema: Function schema (e.g. FIXED_FUNCTION_SCHEMA) or its "parameters" part
+            hardness_range: Inclusive valid range of hardness_min and hardness_max
+            element_index: Element resolver (default: the shared index; pass
+                ElementIndex(max_distance=0) to reject misspelled names)
+        """
+        parameters = schema.get("parameters", schema)
+        properties = parameters.get("properties", {})
+        self.name = schema.get("name")
+        self.fields = frozenset(properties)
+        self.required = tuple(parameters.get("required", []))
+        self.field_types = {
+            field: (_SCHEMA_TYPES[spec["type"]], spec["type"])
+            for field, spec in properties.items()
+            if spec.get("type") in _SCHEMA_TYPES
+        }
+        crystal_items = properties.get("crystal_system", {}).get("items", {})
+        self.crystal_systems = frozenset(crystal_items.get("enum", ()))
+        self.hardness_fields = tuple(field for field in _HARDNESS_FIELDS if field in self.fields)
+        self.element_fields = tuple(field for field in _ELEMENT_FIELDS if field in self.fields)
+        self.hardness_min, self.hardness_max = hardness_range
+        self.element_index = element_index or get_element_index()
+
+    def rule_schema(self, arguments: dict) -> List[Violation]:
+        violations = []
+        for field in self.required:
+            if field not in arguments:
+                violations.append(Violation("rule_schema", field, f"missing required field '{field}'"))
+        for field, value in arguments.items():
+            if field not in self.fields:
+                violations.append(Violation("rule_schema", field, f"unexpected field '{field}'"))
+                continue
+            if field not in self.field_types:
+                continue
+            types, type_name = self.field_types[field]
+            # bool is an int subclass, but only "boolean" fields accept it
+            if not isinstance(value, types) or (isinstance(value, bool) and bool not in types):
+                violations.append(Violation(
+                    "rule_schema", field, f"'{field}' has type {type(value).__name__}, expected {type_name}"
+                ))
+        return violations
+
+    def _hardness_violations(self, field: str, value: float) -> Violation:
+        return Violation(
+            "rule_hardness_range", field,
+            f"{field} {value:g} is outside [{self.hardness_min:g}, {self.hardness_max:g}]"
+        )
+
+    def _inverted_hardness(self, low: float, high: float) -> Violation:
+        return Violation(
+            "rule_hardness_range", "hardness_min", f"hardness_min {low:g} exceeds hardness_max {high:g}"
+        )
+
+    def rule_hardness_range(self, arguments: dict) -> List[Violation]:
+        violations = []
+        values = {field: _number(arguments.get(field)) for field in self.hardness_fields}
+        for field, value in values.items():
+            if not self.hardness_min <= value <= self.hardness_max and not math.isnan(value):
+                violations.append(self._hardness_violations(field, value))
+        low = values.get("hardness_min", math.nan)
+        high = values.get("hardness_max", math.nan)
+        if low > high:
+            violations.append(self._inverted_hardness(low, high))
+        return violations
+
+    def rule_crystal_system(self, arguments: dict) -> List[Violation]:
+        value = arguments.get("crystal_system")
+        if value is None or not self.crystal_systems:
+            return []
+        values = [value] if isinstance(value, str) else value if isinstance(value, (list, tuple)) else []
+        return [
+            Violation("rule_crystal_system", "crystal_system", f"unknown crystal system {item!r}")
+            for item in values
+            if not isinstance(item, str) or item not in self.crystal_systems
+        ]
+
+    def rule_chemical_element(self, arguments: dict) -> List[Violation]:
+        violations = []
+        for field in self.element_fields:
+            value = arguments.get(field)
+            if isinstance(value, str):
+                for token in self.element_index.normalize(value)[1]:
+                    violations.append(Violation("rule_chemical_element", field, f"unknown element {token!r} in {field}"))
+        return violations
+
+    def rule_element_conflict(self, arguments: dict) -> List[Violation]:
+        included = arguments.get("el_inc")
+        excluded = arguments.get("el_exc")
+        if not isinstance(included, str) or not isinstance(excluded, str):
+            return []
+        excluded_symbols = set(self.element_index.normalize(excluded)[0])
+        conflicts = [symbol for symbol in self.element_index.normalize(included)[0] if symbol in excluded_symbols]
+        return [
+            Violation("rule_element_conflict", "el_exc", f"element {symbol} is both included and excluded")
+            for symbol in conflicts
+        ]
+
+    def _unwrap(self, arguments):
+        """Accept {"<function name>": {...}} call dicts as well as bare argument dicts."""
+        if isinstance(arguments, dict) and len(arguments) == 1 and self.name in arguments:
+            return arguments[self.name]
+        return arguments
+
+    def validate(self, arguments: dict) -> List[Violation]:
+        """
+        Check one argument dict against every rule.
+
+        Args:
+            arguments: Call arguments, bare or wrapped as {"<function name>": arguments}
+
+        Returns:
+            Violations in rule order (empty if the arguments are valid)
+        """
+        arguments = self._unwrap(arguments)
+        if not isinstance(arguments, dict):
+            return [Violation("rule_schema", None, "arguments must be an object")]
+        return (
+            self.rule_schema(arguments)
+            + self.rule_hardness_range(arguments)
+            + self.rule_crystal_system(arguments)
+            + self.rule_chemical_element(arguments)
+            + self.rule_element_conflict(arguments)
+        )
+
+    def _batch_hardness(self, batch: Sequence[dict]) -> Dict[int, List[Violation]]:
+        """rule_hardness_range for a whole batch, with the bound checks done column-wise."""
+        columns = {field: [_number(arguments.get(field)) for arguments in batch] for field in self.hardness_fields}
+        low, high = self.hardness_min, self.hardness_max
+        found: Dict[int, List[Violation]] = {}
+
+        def flag(indices: Iterable[int], make):
+            for i in indices:
+                found.setdefault(int(i), []).append(make(int(i)))
+
+        # NaN (missing or non-numeric) compares False everywhere, so it is never flagged
+        if np is not None:
+            arrays = {field: np.asarray(values, dtype=float) for field, values in columns.items()}
+            for field, array in arrays.items():
+                flag(np.flatnonzero((array < low) | (array > high)),
+                     lambda i, field=field: self._hardness_violations(field, columns[field][i]))
+            if len(arrays) == 2:
+                flag(np.flatnonzero(arrays["hardness_min"] > arrays["hardness_max"]),
+                     lambda i: self._inverted_hardness(columns["hardness_min"][i], columns["hardness_max"][i]))
+        else:
+            for field, values in columns.items():
+                flag([i for i, value in enumerate(values) if value < low or value > high],
+                     lambda i, field=field: self._hardness_violations(field, columns[field][i]))
+            if len(columns) == 2:
+                flag([i for i, (a, b) in enumerate(zip(columns["hardness_min"], columns["hardness_max"])) if a > b],
+                     lambda i: self._inverted_hardness(columns["hardness_min"][i], columns["hardness_max"][i]))
+        return found
+
+    def validate_many(self, batch: Sequence[dict]) -> List[List[Violation]]:
+        """
+        Check a batch of argument dicts; same result as [validate(a) for a in batch].
+
+        Args:
+            batch: Call arguments, bare or wrapped as {"<function name>": arguments}
+
+        Returns:
+            One violation list per argument dict, in input order
+        """
+        batch = [self._unwrap(arguments) for arguments in batch]
+        objects = [arguments if isinstance(arguments, dict) else {} for arguments in batch]
+        hardness = self._batch_hardness(objects)
+        results = []
+        for i, arguments in enumerate(batch):
+            if not isinstance(arguments, dict):
+                results.append([Violation("rule_schema", None, "arguments must be an object")])
+                continue
+            results.append(
+                self.rule_schema(arguments)
+                + hardness.get(i, [])
+                + self.rule_crystal_system(arguments)
+                + self.rule_chemical_element(arguments)
+                + self.rule_element_conflict(arguments)
+            )
+        return results
+
+
+def count_violations(results: Iterable[List[Violation]]) -> Dict[str, int]:
+    """Number of argument dicts breaking each rule."""
+    counts = Counter()
+    for violations in results:
+        counts.update({violation.rule for violation in violations})
+    return {rule: counts[rule] for rule in RULES}
+
+
+def validate_file(
+    input_path: str,
+    output_path: Optional[str] = None,
+    arguments_key: Optional[str] = None,
+    schema_path: Optional[str] = None,
+    batch_size: int = 10000
+) -> dict:
+    """
+    Validate a JSONL file of argument dicts.
+
+    Args:
+        input_path: JSONL file, one argument dict (or record holding one) per line
+        output_path: Optional JSONL file receiving {"line", "id", "valid", "violations"} per input line
+        arguments_key: Field of each line holding the arguments (default: the line itself)
+        schema_path: JSON file with the function schema (default: FIXED_FUNCTION_SCHEMA)
+        batch_size: Lines validated per validate_many() call
+
+    Returns:
+        Dict with the line count, valid count, per-rule counts and throughput
+    """
+    if schema_path:
+        with open(schema_path, "r", encoding="utf-8") as f:
+            schema = json.load(f)
+    else:
+        from generate_instruction_v8 import FIXED_FUNCTION_SCHEMA
+        schema = FIXED_FUNCTION_SCHEMA
+    validator = RuleValidator(schema)
+
+    totals = Counter()
+    lines = 0
+    valid = 0
+    seconds = 0.0
+    fout = open(output_path, "w", encoding="utf-8") if output_path else None
+
+    def flush(records: List[dict]):
+        nonlocal lines, valid, seconds
+        batch = [record.get(arguments_key) if arguments_key else record for record in records]
+        start = time.perf_counter()
+        results = validator.validate_many(batch)
+        seconds += time.perf_counter() - start
+        totals.update(count_violations(results))
+        for record, violations in zip(records, results):
+            valid += not violations
+            if fout is not None:
+                fout.write(json.dumps({
+                    "line": lines,
+                    "id": record.get("id") if arguments_key else None,
+                    "valid": not violations,
+                    "violations": [violation._asdict() for violation in violations],
+                }, ensure_ascii=False) + "\n")
+            lines += 1
+
+    try:
+        pending = []
+        with open(input_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    pending.append(json.loads(line))
+                    if len(pending) >= batch_size:
+                        flush(pending)
+                        pending = []
+        if pending:
+            flush(pending)
+    finally:
+        if fout is not None:
+            fout.close()
+
+    summary = {
+        "lines": lines,
+        "valid": valid,
+        "violations": {rule: totals[rule] for rule in RULES},
+        "dicts_per_second": round(lines / seconds) if seconds else None,
+    }
+    print(json.dumps(summary, indent=2))
+    return summary
+
+
+if __name__ == "__main__":
+    import fire
+
+    fire.Fire(validate_file)
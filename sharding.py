@@ -0,0 +1,229 @@
+"""
+sharding.py
+
+Split a generation run across worker processes or machines and merge the results.
+
+The recipe grid is cut into contiguous blocks of cells with roughly equal record
+targets. Each shard writes its own JSONL file and gets a pre-reserved ID range exactly
+as large as the sum of its cells' targets, so shards never collide and, once every
+quota is met, the merged IDs are contiguous. The plan is stored next to the final
+output (<output>.shards.json) so the merge knows which ranges to expect.
+
+Shard files carry their own journal and manifest sidecars and can be resumed
+independently. Near-duplicate filtering is per shard.
+"""
+import json
+import os
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from checkpoint import ResumeManifest
+from compact_records import SchemaTable, schema_table_path
+from io_utils import dumps_line, loads
+
+
+class ShardSpec(NamedTuple):
+    """One worker's slice of the recipe grid and its reserved ID range."""
+    index: int
+    count: int
+    cells: Tuple[Tuple[int, int], ...]  # (param_index, style_index) pairs
+    start_id: int  # First reserved ID
+    end_id: int  # One past the last reserved ID
+
+
+def partition_by_weight(weights: List[int], num_shards: int) -> List[Tuple[int, int]]:
+    """
+    Cut a sequence into num_shards contiguous [start, end) slices of similar total weight.
+
+    Slice k ends at the first position where the running total reaches k/num_shards of
+    the overall total, so no slice is more than one element heavier than its share.
+    """
+    if num_shards < 1:
+        raise ValueError("num_shards must be at least 1")
+    total = sum(weights)
+    bounds = [0]
+    running = 0
+    position = 0
+    for k in range(1, num_shards):
+        goal = total * k / num_shards
+        while position < len(weights) and running + weights[position] / 2 < goal:
+            running += weights[position]
+            position += 1
+        bounds.append(max(position, bounds[-1]))
+    bounds.append(len(weights))
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def plan_shards(
+    targets: Dict[Tuple[int, int], int],
+    num_shards: int,
+    start_id: int = 0
+) -> List[ShardSpec]:
+    """
+    Assign grid cells and disjoint ID ranges to shards.
+
+    Args:
+        targets: (param_index, style_index) -> record target, e.g. from quota.grid_targets
+        num_shards: Number of shards
+        start_id: First ID of the whole run
+
+    Returns:
+        One ShardSpec per shard, with ascending ID ranges
+    """
+    cells = sorted(targets)
+    weights = [targets[cell] for cell in cells]
+    specs = []
+    next_id = start_id
+    for index, (begin, end) in enumerate(partition_by_weight(weights, num_shards)):
+        size = sum(weights[begin:end])
+        specs.append(ShardSpec(index, num_shards, tuple(cells[begin:end]), next_id, next_id + size))
+        next_id += size
+    return specs
+
+
+def shard_filename(output_filename: str, index: int, count: int) -> str:
+    """Name of a shard file, e.g. data.json -> data.shard-1-of-4.json."""
+    stem, extension = os.path.splitext(output_filename)
+    return f"{stem}.shard-{index}-of-{count}{extension}"
+
+
+def plan_path(output_path: str) -> str:
+    return output_path + ".shards.json"
+
+
+def save_plan(output_path: str, specs: List[ShardSpec]):
+    """Write the shard plan next to the final output file."""
+    payload = [
+        {"index": s.index, "count": s.count, "cells": [list(c) for c in s.cells],
+         "start_id": s.start_id, "end_id": s.end_id}
+        for s in specs
+    ]
+    tmp_path = plan_path(output_path) + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(payload, f)
+    os.replace(tmp_path, plan_path(output_path))
+
+
+def load_plan(output_path: str) -> List[ShardSpec]:
+    with open(plan_path(output_path), "r", encoding="utf-8") as f:
+        payload = json.load(f)
+    return [
+        ShardSpec(s["index"], s["count"], tuple(tuple(c) for c in s["cells"]), s["start_id"], s["end_id"])
+        for s in payload
+    ]
+
+
+def parse_shard_arg(value: str) -> Tuple[int, int]:
+    """Parse a "K/N" command-line value into (shard index, shard count)."""
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise ValueError(f"Expected a shard as INDEX/COUNT (e.g. 0/4), got {value!r}") from None
+    if not 0 <= index < count:
+        raise ValueError(f"Shard index must be in [0, {count}), got {index}")
+    return index, count
+
+
+def _record_number(line: str, prefix: str) -> int:
+    record_id = loads(line)["id"]
+    if not record_id.startswith(prefix):
+        raise ValueError(f"Record ID {record_id!r} does not have prefix {prefix!r}")
+    return int(record_id[len(prefix):])
+
+
+def merge_shards(
+    output_dir: str,
+    output_filename: str,
+    id_prefix: str,
+    specs: Optional[List[ShardSpec]] = None,
+    renumber: bool = False
+) -> dict:
+    """
+    Concatenate shard files in ID order into the final JSONL file, verifying the IDs.
+
+    Every shard must be sorted by ID and stay inside its reserved range; the merged IDs
+    must be contiguous with no duplicates. With renumber=True, gaps left by shards that
+    fell short of their quota are closed by renumbering records in merged order.
+
+    Args:
+        output_dir: Directory holding the shard files and the final output
+        output_filename: Name of the final output file
+        id_prefix: Prefix of the record IDs
+        specs: Shard plan (defaults to the plan saved next to the output)
+        renumber: Reassign contiguous IDs instead of failing on gaps
+
+    Returns:
+        Dict with the number of records, the ID range and the gaps found
+
+    Raises:
+        ValueError: On duplicate, out-of-order or out-of-range IDs, or on gaps without renumber
+    """
+    output_path = os.path.join(output_dir, output_filename)
+    specs = specs or load_plan(output_path)
+    prefix = f"{id_prefix}_"
+    shard_paths = [os.path.join(output_dir, shard_filename(output_filename, s.index, s.count)) for s in specs]
+    missing = [path for path in shard_paths if not os.path.exists(path)]
+    if missing:
+        raise ValueError(f"Missing shard files: {', '.join(missing)}")
+
+    # First pass: validate IDs without writing anything
+    gaps = []
+    expected = specs[0].start_id if specs else 0
+    records = 0
+    for spec, path in zip(specs, shard_paths):
+        previous = None
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                number = _record_number(line, prefix)
+                if previous is not None and number <= previous:
+                    kind = "Duplicate" if number == previous else "Out-of-order"
+                    raise ValueError(f"{kind} ID {prefix}{number} in {path}")
+                if not spec.start_id <= number < spec.end_id:
+                    raise ValueError(
+                        f"ID {prefix}{number} in {path} is outside the shard's range "
+                        f"[{spec.start_id}, {spec.end_id})"
+                    )
+                if number != expected:
+                    gaps.append((expected, number - 1))
+                expected = number + 1
+                previous = number
+                records += 1
+    if specs and expected < specs[-1].end_id:
+        gaps.append((expected, specs[-1].end_id - 1))
+    if gaps and not renumber:
+        shown = ", ".join(f"{start}-{end}" for start, end in gaps[:5])
+        raise ValueError(
+            f"{len(gaps)} ID gaps in the shards (first: {shown}); rerun the short shards to fill "
+            f"their quotas, or merge with renumber=True"
+        )
+
+    # Second pass: concatenate (shards and their contents are already in ID order)
+    first_id = specs[0].start_id if specs else 0
+    next_id = first_id
+    tmp_path = output_path + ".merge.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as fout:
+        for path in shard_paths:
+            with open(path, "r", encoding="utf-8") as fin:
+                for line in fin:
+                    if not line.strip():
+                        continue
+                    if renumber and gaps:
+                        record = loads(line)
+                        record["id"] = f"{prefix}{next_id}"
+                        line = dumps_line(record) + "\n"
+                    fout.write(line if line.endswith("\n") else line + "\n")
+                    next_id += 1
+    os.replace(tmp_path, output_path)
+    if records:
+        ResumeManifest(output_path).update(id_prefix, first_id + records - 1 if renumber else expected - 1)
+
+    # Compact shards reference schemas by hash; the final file needs their union
+    shard_tables = [schema_table_path(path) for path in shard_paths if os.path.exists(schema_table_path(path))]
+    if shard_tables:
+        table = SchemaTable(schema_table_path(output_path))
+        for table_path in shard_tables:
+            table.schemas.update(SchemaTable(table_path).schemas)
+        table.save()
+
+    return {"records": records, "first_id": first_id, "gaps": gaps, "renumbered": bool(renumber and gaps)}
@@ -0,0 +1,185 @@
+"""
+stream_json.py
+
+Incremental JSON parsing for streamed structured-output responses.
+
+IncrementalJSONParser accepts a JSON document in arbitrary slices (e.g. the content
+deltas of a streamed chat completion) and reports every value the moment its last
+character arrives, together with its path from the document root:
+
+    parser = IncrementalJSONParser()
+    parser.feed('{"queries": ["first que')   # -> []
+    parser.feed('ry", "sec')                 # -> [(("queries", 0), "first query")]
+
+Strings, numbers and literals are reported when they end; objects and arrays are
+reported (fully built) when they close, after their members.
+"""
+import json
+import re
+from typing import Any, List, Tuple
+
+_STRING_SPECIAL = re.compile(r'["\\]')
+_WHITESPACE = " \t\r\n"
+
+Event = Tuple[Tuple[Any, ...], Any]
+
+
+class IncrementalJSONParser:
+    """Streaming JSON parser emitting (path, value) events for completed values."""
+
+    def __init__(self):
+        # One frame per open container: [container, current key or index, expecting]
+        self._stack: List[list] = []
+        self._string = None  # Raw characters of the string being read, or None
+        self._string_is_key = False
+        self._escape = False
+        self._scalar: List[str] = []  # Characters of the number or literal being read
+        self.done = False
+        self.value = None
+
+    def _fail(self, message: str):
+        raise ValueError(f"Invalid JSON stream: {message}")
+
+    def _complete(self, value, events: List[Event]):
+        if not self._stack:
+            if self.done:
+                self._fail("data after the end of the document")
+            self.done = True
+            self.value = value
+            events.append(((), value))
+            return
+        frame = self._stack[-1]
+        container, key, expecting = frame
+        if expecting != "value":
+            self._fail(f"unexpected value {value!r}")
+        if isinstance(container, list):
+            container.append(value)
+        else:
+            container[key] = value
+        events.append((tuple(f[1] for f in self._stack), value))
+        frame[2] = "comma"
+
+    def _end_scalar(self, events: List[Event]):
+        if self._scalar:
+            token = "".join(self._scalar)
+            self._scalar = []
+            self._complete(json.loads(token), events)
+
+    def _open(self, container):
+        if self._stack and self._stack[-1][2] != "value":
+            self._fail("unexpected container")
+        if isinstance(container, list):
+            self._stack.append([container, 0, "value"])
+        else:
+            self._stack.append([container, None, "key"])
+
+    def _close(self, closing: str, events: List[Event]):
+        self._end_scalar(events)
+        if not self._stack:
+            self._fail(f"unmatched {closing!r}")
+        container, key, expecting = self._stack.pop()
+        if isinstance(container, list) != (closing == "]"):
+            self._fail(f"mismatched {closing!r}")
+        # Only a finished member or an empty container may be closed
+        empty = not container and (isinstance(container, list) or key is None)
+        if expecting != "comma" and not empty:
+            self._fail(f"unexpected {closing!r}")
+        self._complete(container, events)
+
+    def _comma(self, events: List[Event]):
+        self._end_scalar(events)
+        if not self._stack or self._stack[-1][2] != "comma":
+            self._fail("unexpected ','")
+        frame = self._stack[-1]
+        if isinstance(frame[0], list):
+            frame[1] += 1
+            frame[2] = "value"
+        else:
+            frame[2] = "key"
+
+    def feed(self, text: str) -> List[Event]:
+        """
+        Parse the next slice of the document.
+
+        Args:
+            text: Any continuation of the text fed so far
+
+        Returns:
+            (path, value) for every value completed by this slice, in completion order;
+            the path holds object keys and array indices from the root
+
+        Raises:
+            ValueError: If the text cannot continue a valid JSON document
+        """
+        events: List[Event] = []
+        i = 0
+        n = len(text)
+        while i < n:
+            if self._string is not None:
+                if self._escape:
+                    self._string.append(text[i])
+                    self._escape = False
+                    i += 1
+                    continue
+                match = _STRING_SPECIAL.search(text, i)
+                if match is None:
+                    self._string.append(text[i:])
+                    break
+                j = match.start()
+                self._string.append(text[i:j])
+                i = j + 1
+                if text[j] == "\\":
+                    self._string.append("\\")
+                    self._escape = True
+                    continue
+                value = json.loads('"' + "".join(self._string) + '"')
+                self._string = None
+                if self._string_is_key:
+                    frame = self._stack[-1]
+                    frame[1] = value
+                    frame[2] = "colon"
+                else:
+                    self._complete(value, events)
+                continue
+
+            char = text[i]
+            i += 1
+            if char in _WHITESPACE:
+                self._end_scalar(events)
+            elif char == '"':
+                self._end_scalar(events)
+                top = self._stack[-1] if self._stack else None
+                self._string_is_key = top is not None and isinstance(top[0], dict) and top[2] == "key"
+                self._string = []
+            elif char == "{":
+                self._open({})
+            elif char == "[":
+                self._open([])
+            elif char in "}]":
+                self._close(char, events)
+            elif char == ":":
+                if not self._stack or self._stack[-1][2] != "colon":
+                    self._fail("unexpected ':'")
+                self._stack[-1][2] = "value"
+            elif char == ",":
+                self._comma(events)
+            else:
+                self._scalar.append(char)
+        return events
+
+    def close(self) -> Any:
+        """
+        Finish the document.
+
+        Returns:
+            The complete parsed value
+
+        Raises:
+            ValueError: If the document is incomplete
+        """
+        events: List[Event] = []
+        if not self._stack and self._string is None:
+            self._end_scalar(events)
+        if not self.done:
+            self._fail("document is incomplete")
+        return self.value
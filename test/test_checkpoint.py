@@ -0,0 +1,90 @@
+import json
+
+from checkpoint import CellJournal, ResumeManifest, read_last_id, read_max_id, recipe_hash
+
+
+def _write_records(path, ids, mode="w"):
+    with open(path, mode, encoding="utf-8") as f:
+        for record_id in ids:
+            f.write(json.dumps({"id": record_id, "question": []}) + "\n")
+        f.flush()
+        return f.tell()
+
+
+def test_recipe_hash_depends_on_content():
+    assert recipe_hash("p", "s", "X", 5) == recipe_hash("p", "s", "X", 5)
+    assert recipe_hash("p", "s", "X", 5) != recipe_hash("p", "s", "X", 6)
+
+
+def test_journal_resume_discards_unjournaled_records(tmp_path):
+    output = str(tmp_path / "out.json")
+    end = _write_records(output, ["X_0", "X_1"])
+    journal = CellJournal(output)
+    journal.record("cell-a", 0, 0, 0, 2, end)
+    # A cell that crashed after writing a record but before its checkpoint
+    _write_records(output, ["X_2"], mode="a")
+
+    resumed = CellJournal(output)
+    assert resumed.is_complete("cell-a", 2)
+    assert not resumed.is_complete("cell-a", 3)
+    assert resumed.filled_count("cell-a") == 2
+    assert resumed.last_id() == 1
+    assert resumed.discard_partial_output() > 0
+    with open(output, encoding="utf-8") as f:
+        assert [json.loads(line)["id"] for line in f] == ["X_0", "X_1"]
+
+
+def test_journal_ignores_torn_line_and_adds_top_ups(tmp_path, capsys):
+    output = str(tmp_path / "out.json")
+    journal = CellJournal(output)
+    journal.record("cell-a", 0, 0, 0, 2, 10)
+    journal.record("cell-a", 0, 0, 5, 1, 20)
+    with open(journal.path, "a", encoding="utf-8") as f:
+        f.write('{"cell": "cell-b", "co')
+
+    resumed = CellJournal(output)
+    assert resumed.filled_count("cell-a") == 3
+    assert resumed.attempt_count("cell-a") == 2
+    assert not resumed.is_complete("cell-b", 1)
+    assert resumed.last_offset() == 20
+    assert "unreadable journal line" in capsys.readouterr().out
+
+
+def test_manifest_goes_stale_when_file_changes(tmp_path):
+    output = str(tmp_path / "out.json")
+    _write_records(output, ["X_0", "X_1"])
+    manifest = ResumeManifest(output)
+    manifest.update("X", 1)
+    assert manifest.lookup("X") == 1
+    assert manifest.lookup("Y") is None
+
+    _write_records(output, ["X_2"], mode="a")
+    assert manifest.lookup("X") is None
+
+
+def test_manifest_notices_same_size_edit(tmp_path):
+    output = str(tmp_path / "out.json")
+    _write_records(output, ["X_0", "X_1"])
+    manifest = ResumeManifest(output)
+    manifest.update("X", 1)
+    _write_records(output, ["X_0", "X_7"])
+    assert manifest.lookup("X") is None
+
+
+def test_read_last_id_skips_other_prefixes(tmp_path):
+    output = str(tmp_path / "out.json")
+    _write_records(output, ["X_0", "X_1", "X_extra_9", "Y_5"])
+    assert read_last_id(output, "X") == 1
+    assert read_last_id(output, "X", block_size=8) == 1
+    assert read_last_id(output, "Z") == -1
+
+
+def test_read_max_id_scans_files_not_in_append_order(tmp_path):
+    output = str(tmp_path / "out.json")
+    end = _write_records(output, ["X_5", "X_9", "X_2"])
+    # Without a matching journal the whole file is scanned
+    assert read_max_id(output, "X") == 9
+    # With a journal ending at the file size, the tail record is trusted
+    journal = CellJournal(output)
+    journal.record("cell-a", 0, 0, 0, 3, end)
+    assert read_max_id(output, "X", journal) == 2
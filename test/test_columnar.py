@@ -0,0 +1,65 @@
+import itertools
+import os
+
+import pytest
+
+import columnar
+from io_utils import dumps_line, iter_jsonl
+
+OUTPUT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "output")
+
+
+def _write_jsonl(path, records):
+    with open(path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(dumps_line(record) + "\n")
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    records = list(itertools.islice(iter_jsonl(os.path.join(OUTPUT_DIR, "BFCL_V4_Mindat_v1.json")), 50))
+    ground_truth = [
+        {"id": records[0]["id"], "ground_truth": [{"mindat_geomaterial": {
+            "hardness_min": [5.5], "ima": [True], "crystal_system": ["Hexagonal", "Trigonal"],
+            "el_inc": [["Au", "Cu"], ""], "el_exc": [["Fe"]]}}]},
+        {"id": records[1]["id"], "ground_truth": [{"mindat_geomaterial": {"hardness_max": [6], "el_inc": []}}]},
+        # Not a list of calls: kept as JSON text
+        {"id": records[2]["id"], "ground_truth": {"mindat_geomaterial": None}},
+    ]
+    records_path = str(tmp_path / "records.jsonl")
+    ground_truth_path = str(tmp_path / "ground_truth.jsonl")
+    _write_jsonl(records_path, records)
+    _write_jsonl(ground_truth_path, ground_truth)
+    return records_path, ground_truth_path
+
+
+def test_encode_ground_truth_roundtrip():
+    ground_truth = [{"f": {"a": [1, 2], "b": [1.5], "c": [False], "d": ["x"], "e": [["Fe"]], "m": [1, "x"]}}]
+    calls = columnar.encode_ground_truth(ground_truth)
+    assert calls[0]["arguments"][0] == {"name": "a", "ints": [1, 2]}
+    assert calls[0]["arguments"][-1] == {"name": "m", "json": ["1", '"x"']}
+    fields = ("name", "json") + columnar.GROUND_TRUTH_VALUE_FIELDS
+    rows = [{"name": call["name"], "arguments": [{field: argument.get(field) for field in fields}
+                                                 for argument in call["arguments"]]} for call in calls]
+    assert columnar.decode_ground_truth(rows) == ground_truth
+    assert columnar.encode_ground_truth({"f": {}}) is None
+
+
+@pytest.mark.parametrize("extension", columnar.COLUMNAR_EXTENSIONS)
+def test_export_import_roundtrip(dataset, tmp_path, extension):
+    pytest.importorskip("pyarrow")
+    records_path, ground_truth_path = dataset
+    table_path = str(tmp_path / ("dataset" + extension))
+    assert columnar.export_dataset(records_path, table_path, ground_truth_path=ground_truth_path)["rows"] == 50
+
+    table = columnar.load_dataset(table_path, columns=["ground_truth", "ground_truth_json"])
+    assert table.column("ground_truth").null_count == 48
+    assert table.column("ground_truth_json").null_count == 49
+
+    output_path = str(tmp_path / "roundtrip.jsonl")
+    ground_truth_output = str(tmp_path / "roundtrip_ground_truth.jsonl")
+    assert columnar.import_dataset(table_path, output_path, ground_truth_output) == 50
+    with open(records_path, "rb") as expected, open(output_path, "rb") as actual:
+        assert actual.read() == expected.read()
+    with open(ground_truth_path, "rb") as expected, open(ground_truth_output, "rb") as actual:
+        assert actual.read() == expected.read()
@@ -0,0 +1,44 @@
+import json
+
+from dedup import NearDuplicateFilter, choose_bands, jaccard, seed_from_file, shingles
+
+
+def test_choose_bands_uses_every_permutation():
+    bands, rows = choose_bands(0.7, 64)
+    assert bands * rows <= 64
+
+
+def test_shingles_and_jaccard():
+    a = shingles("Minerals harder than quartz")
+    assert jaccard(a, a) == 1.0
+    assert jaccard(a, shingles("Something else entirely")) < 0.2
+
+
+def test_offer_drops_near_duplicates():
+    dedup_filter = NearDuplicateFilter(threshold=0.7)
+    assert dedup_filter.offer("X_0", "List minerals with a Mohs hardness between 4 and 6.")
+    assert not dedup_filter.offer("X_1", "List minerals with a Mohs hardness between 4 and 6!", source="cell")
+    assert dedup_filter.offer("X_2", "Which minerals crystallize in the trigonal system?")
+    assert dedup_filter.stats()["kept"] == 2
+    assert dedup_filter.dropped[0]["duplicate_of"] == "X_0"
+    assert dedup_filter.dropped[0]["source"] == "cell"
+
+
+def test_remove_takes_a_query_back():
+    dedup_filter = NearDuplicateFilter(threshold=0.7)
+    query = "Show minerals containing copper but not iron."
+    assert dedup_filter.offer("X_0", query)
+    dedup_filter.remove("X_0")
+    dedup_filter.remove("X_0")
+    assert dedup_filter.kept == 0
+    assert dedup_filter.find_duplicate(query) is None
+    assert dedup_filter.offer("X_1", query)
+
+
+def test_seed_from_file(tmp_path):
+    path = tmp_path / "records.jsonl"
+    query = "Find minerals with a density above 3 grams per cubic centimeter."
+    path.write_text(json.dumps({"id": "X_0", "question": [[{"role": "user", "content": query}]]}) + "\n")
+    dedup_filter = NearDuplicateFilter()
+    assert seed_from_file(dedup_filter, str(path)) == 1
+    assert not dedup_filter.offer("X_1", query)
@@ -0,0 +1,36 @@
+from collections import Counter
+
+from elements import ElementIndex, edit_distance, split_elements, to_symbol
+
+
+def test_to_symbol_any_case():
+    assert to_symbol("Fe") == "Fe"
+    assert to_symbol(" IRON ") == "Fe"
+    assert to_symbol("cu") == "Cu"
+    assert to_symbol("Xx") is None
+
+
+def test_split_elements():
+    assert split_elements(" Fe, ,Cu ") == ("Fe", "Cu")
+
+
+def test_edit_distance_counts_transpositions():
+    assert edit_distance("silver", "sliver", 2) == 1
+    assert edit_distance("iron", "carbon", 1) == 2
+
+
+def test_resolve_misspelled_names():
+    index = ElementIndex()
+    assert index.resolve("Sliver") == "Ag"
+    assert index.resolve("Xx") is None  # Symbols are never matched fuzzily
+    assert ElementIndex(max_distance=0).resolve("Sliver") is None
+
+
+def test_normalize_keeps_unknown_tokens():
+    index = ElementIndex()
+    assert index.normalize("iron, cu, Sliver, Foo, Fe") == (("Fe", "Cu", "Ag"), ("Foo",))
+    unknown = Counter()
+    record = {"ground_truth": [{"f": {"el_inc": [["fe", "MG"], ""], "el_exc": "copper"}}]}
+    index.normalize_fields(record, unknown=unknown)
+    assert record == {"ground_truth": [{"f": {"el_inc": [["Fe", "Mg"], ""], "el_exc": "Cu"}}]}
+    assert not unknown
@@ -0,0 +1,89 @@
+import time
+
+from failures import (
+    PERMANENT,
+    REDUCE_LENGTH,
+    RETRYABLE,
+    CircuitBreaker,
+    DeadLetterFile,
+    RequestFailedError,
+    TruncatedResponseError,
+    classify_error,
+    dead_letter_path,
+    is_endpoint_failure,
+)
+
+
+class StatusError(Exception):
+    def __init__(self, status_code, message="error"):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def test_classify_error():
+    assert classify_error(StatusError(500)) == RETRYABLE
+    assert classify_error(StatusError(429)) == RETRYABLE
+    assert classify_error(StatusError(400)) == PERMANENT
+    assert classify_error(StatusError(400, "This model's maximum context length is 8192")) == REDUCE_LENGTH
+    assert classify_error(TimeoutError()) == RETRYABLE
+    assert classify_error(ValueError("invalid JSON")) == RETRYABLE
+    assert classify_error(TruncatedResponseError()) == PERMANENT
+    assert classify_error(KeyError("x")) == PERMANENT
+
+
+def test_is_endpoint_failure():
+    assert is_endpoint_failure(StatusError(503))
+    assert is_endpoint_failure(ConnectionError())
+    assert not is_endpoint_failure(StatusError(429))
+    assert not is_endpoint_failure(ValueError())
+
+
+def test_breaker_opens_probes_and_closes():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+    breaker.record_outcome(StatusError(500))
+    assert breaker.state == "closed"
+    breaker.record_outcome(StatusError(500))
+    assert breaker.state == "open"
+    assert breaker.wait() > 0
+    assert breaker.state == "half_open"
+
+    # The failed probe reopens the breaker with a longer timeout
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker._current_timeout == 0.1
+    breaker.wait()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.stats()["opens"] == 2
+
+
+def test_breaker_ignores_non_endpoint_errors():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_outcome(StatusError(500))
+    time.sleep(0.06)
+    assert breaker.wait() == 0  # This caller is the half-open probe
+    breaker.record_outcome(StatusError(429))
+    # The probe said nothing about the endpoint: the next caller probes instead
+    assert breaker.state == "half_open"
+    assert breaker.wait() == 0
+    for _ in range(3):
+        breaker.record_outcome(StatusError(400))
+    assert breaker.opens == 1
+
+
+def test_dead_letters_latest_entry_wins_and_resolve(tmp_path):
+    dead_letters = DeadLetterFile(dead_letter_path(str(tmp_path / "out.json")))
+    assert dead_letters.entries() == {}
+    dead_letters.record("a", RequestFailedError(RETRYABLE, 3, StatusError(500)), cells=[0])
+    dead_letters.record("b", RequestFailedError(PERMANENT, 1, StatusError(400)))
+    dead_letters.record("a", RequestFailedError(PERMANENT, 1, StatusError(400)), cells=[0])
+
+    entries = dead_letters.entries()
+    assert list(entries) == ["a", "b"]
+    assert entries["a"]["category"] == PERMANENT
+    assert entries["a"]["cells"] == [0]
+
+    assert dead_letters.resolve(["a", "c"]) == 1
+    assert list(dead_letters.entries()) == ["b"]
+    assert dead_letters.resolve(["b"]) == 1
+    assert dead_letters.entries() == {}
@@ -0,0 +1,140 @@
+import json
+import random
+
+import pytest
+
+import final_processing_for_bfcl as fp
+
+
+def _record(number, el_inc=("Mg", "fe"), crystal_system=("Trigonal",)):
+    return {
+        "id": f"Mindat_v1_{number}",
+        "question": [[{"role": "user", "content": f"query {number}"}]],
+        "ground_truth": [{"mindat_geomaterial": {
+            "hardness_min": [float(number % 10)],
+            "crystal_system": list(crystal_system),
+            "el_inc": [list(el_inc), ""],
+        }}],
+    }
+
+
+def _write(path, records, mode="w"):
+    with open(path, mode, encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def _read(path):
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+def test_element_case_and_canonical_form():
+    assert fp.element_case(" cu ") == "Cu"
+    assert fp.element_case("IRON") == "Iron"
+    assert fp.canonical_elements("fe, MG") == fp.canonical_elements(["Mg", "Fe"]) == ("Fe", "Mg")
+    assert fp.canonical_alternatives(["Mg", "fe"]) == [["Fe", "Mg"], "Fe,Mg"]
+    assert fp.elements_match("mg,FE", [["Fe", "Mg"], "Fe,Mg"])
+    assert fp.elements_match(None, [""])
+    assert not fp.elements_match(["Fe"], [["Fe", "Mg"]])
+
+
+def test_generate_all_combinations():
+    assert fp.generate_all_combinations(["fe", "Mg"]) == [["Fe", "Mg"], ["Mg", "Fe"], "Fe,Mg", "Mg,Fe"]
+    assert fp.generate_all_combinations(["cu"]) == [["Cu"], "Cu"]
+    assert len(fp.generate_all_combinations(["A", "B", "C", "D"], max_alternatives=6)) == 6
+
+
+def test_transform_ground_truth_expands_by_default():
+    item, capped = fp.transform_ground_truth(_record(1))
+    arguments = item["ground_truth"][0]["mindat_geomaterial"]
+    assert arguments["el_inc"] == [["Mg", "Fe"], ["Fe", "Mg"], "Mg,Fe", "Fe,Mg", ""]
+    assert arguments["crystal_system"] == ["Trigonal", ["Trigonal"]]
+    assert capped == 0
+
+    item, _ = fp.transform_ground_truth(_record(1), expand=False)
+    assert item["ground_truth"][0]["mindat_geomaterial"]["el_inc"] == [["Fe", "Mg"], "Fe,Mg", ""]
+
+
+@pytest.mark.parametrize("chunk_size", [2, 1000])
+def test_iter_sorted_lines_external_merge(tmp_path, chunk_size):
+    numbers = list(range(25)) + [7]
+    random.Random(0).shuffle(numbers)
+    path = str(tmp_path / "input.jsonl")
+    # Records with equal IDs keep their input order
+    _write(path, [dict(_record(number), order=i) for i, number in enumerate(numbers)])
+
+    count, lines = fp.iter_sorted_lines(path, chunk_size=chunk_size)
+    records = [json.loads(line) for line in lines]
+    assert count == 26
+    assert [fp.record_number(json.dumps(record)) for record in records] == sorted(numbers)
+    sevens = [record["order"] for record in records if record["id"] == "Mindat_v1_7"]
+    assert sevens == sorted(sevens)
+    assert [path.name for path in tmp_path.iterdir()] == ["input.jsonl"]
+
+
+def test_long_element_lists_are_not_capped_by_default(tmp_path):
+    input_path = str(tmp_path / "input.jsonl")
+    output_path = str(tmp_path / "output.jsonl")
+    _write(input_path, [_record(0, el_inc=("Na", "Mg", "Al", "Si", "K", "Ca", "Fe"))])
+    fp.process_jsonl_complete(input_path, output_path)
+    el_inc = json.loads(_read(output_path))["ground_truth"][0]["mindat_geomaterial"]["el_inc"]
+    assert len(el_inc) == 2 * 5040 + 1
+
+    fp.process_jsonl_complete(input_path, output_path, max_alternatives=100)
+    assert len(json.loads(_read(output_path))["ground_truth"][0]["mindat_geomaterial"]["el_inc"]) == 101
+
+
+def test_process_complete_sorts_and_transforms(tmp_path):
+    input_path = str(tmp_path / "input.jsonl")
+    output_path = str(tmp_path / "output.jsonl")
+    _write(input_path, [_record(3), _record(1), _record(2)])
+    fp.process_jsonl_complete(input_path, output_path, chunk_size=2)
+    records = [json.loads(line) for line in _read(output_path).splitlines()]
+    assert [record["id"] for record in records] == ["Mindat_v1_1", "Mindat_v1_2", "Mindat_v1_3"]
+    expected, _ = fp.transform_ground_truth(_record(1))
+    assert records[0] == expected
+
+
+def test_incremental_append_and_splice_match_full_run(tmp_path):
+    input_path = str(tmp_path / "input.jsonl")
+    output_path = str(tmp_path / "output.jsonl")
+    reference_path = str(tmp_path / "reference.jsonl")
+
+    def check(mode):
+        result = fp.process_jsonl_incremental(input_path, output_path)
+        fp.process_jsonl_complete(input_path, reference_path)
+        assert result["mode"] == mode
+        assert _read(output_path) == _read(reference_path)
+        return result
+
+    _write(input_path, [_record(number) for number in (4, 0, 2, 6)])
+    check("full")
+    assert check("unchanged")["transformed"] == 0
+
+    # Appended records with higher IDs: only they are transformed
+    _write(input_path, [_record(9), _record(8)], mode="a")
+    assert check("append")["transformed"] == 2
+
+    # A lower ID, a changed record and a removed one are spliced in
+    records = [json.loads(line) for line in _read(input_path).splitlines()]
+    records = [record for record in records if record["id"] != "Mindat_v1_2"]
+    records[0]["ground_truth"][0]["mindat_geomaterial"]["el_inc"] = [["Cu"]]
+    records.append(_record(5))
+    _write(input_path, records)
+    result = check("splice")
+    assert (result["transformed"], result["removed"]) == (2, 1)
+
+    # Repeated IDs need a full (stable) run
+    _write(input_path, [_record(5)], mode="a")
+    check("full")
+
+
+def test_incremental_rejects_modified_output(tmp_path):
+    input_path = str(tmp_path / "input.jsonl")
+    output_path = str(tmp_path / "output.jsonl")
+    _write(input_path, [_record(0), _record(1)])
+    fp.process_jsonl_incremental(input_path, output_path)
+    with open(output_path, "a", encoding="utf-8") as f:
+        f.write("\n")
+    assert fp.process_jsonl_incremental(input_path, output_path)["mode"] == "full"
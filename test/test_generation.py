@@ -0,0 +1,291 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+import generate_instruction_v8 as g
+import llm_client
+from checkpoint import CellJournal
+from dedup import NearDuplicateFilter
+from failures import CircuitBreaker, DeadLetterFile, dead_letter_path
+from llm_cache import ResponseCache
+from metrics import CallMetrics
+from mock_llm import MockLLMConfig, MockLLMServer
+from quota import QuotaTracker
+from rate_limiter import AdaptiveRateLimiter
+from sharding import merge_shards
+
+PROMPT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "prompt",
+                           "gemini_mindat_prompt_v1.md")
+PARAM_RECIPES = g.all_param_recipes[:3]
+STYLE_RECIPES = g.all_style_recipes[:2]
+
+
+@pytest.fixture
+def mock_server(request):
+    config = getattr(request, "param", None) or MockLLMConfig(latency="constant", latency_mean=0.0)
+    with MockLLMServer(config) as server:
+        llm_client.set_clients(client=server.make_client(max_retries=0),
+                               async_client=server.make_async_client(max_retries=0))
+        yield server
+
+
+def generation_kwargs(output_dir, **overrides):
+    kwargs = dict(
+        prompt_path=PROMPT_PATH,
+        output_dir=str(output_dir),
+        output_filename="out.json",
+        param_recipes=PARAM_RECIPES,
+        style_recipes=STYLE_RECIPES,
+        id_prefix="X",
+        num_queries_per_combination=4,
+        model_name="mock",
+        rate_limiter=AdaptiveRateLimiter(base_delay=0.001),
+        cache=ResponseCache(mode="bypass"),
+        metrics=CallMetrics(),
+        circuit_breaker=CircuitBreaker(failure_threshold=1000),
+    )
+    kwargs.update(overrides)
+    return kwargs
+
+
+def read_output(output_dir, filename="out.json"):
+    with open(os.path.join(str(output_dir), filename), encoding="utf-8") as f:
+        return f.read()
+
+
+def record_ids(text):
+    return [json.loads(line)["id"] for line in text.splitlines()]
+
+
+@pytest.fixture
+def reference_output(mock_server, tmp_path):
+    g.generate_diverse_training_data(**generation_kwargs(tmp_path / "reference"))
+    return read_output(tmp_path / "reference")
+
+
+def test_sequential_run_writes_every_cell(reference_output, tmp_path):
+    assert record_ids(reference_output) == [f"X_{i}" for i in range(24)]
+    journal = CellJournal(str(tmp_path / "reference" / "out.json"))
+    assert len(journal.entries) == 6
+    assert all(entry["count"] == 4 for entry in journal.entries.values())
+
+
+@pytest.mark.parametrize("cells_per_call", [1, 3])
+def test_dispatch_modes_write_identical_output(mock_server, tmp_path, cells_per_call):
+    # Packed calls get other prompts (and mock answers), so each packing has its own reference
+    g.generate_diverse_training_data(**generation_kwargs(tmp_path / "reference", cells_per_call=cells_per_call))
+    reference = read_output(tmp_path / "reference")
+    assert len(record_ids(reference)) == 24
+    for use_async in (False, True):
+        for stream_output in (False, True):
+            output_dir = tmp_path / f"run-{use_async}-{stream_output}"
+            kwargs = generation_kwargs(output_dir, cells_per_call=cells_per_call, stream_output=stream_output)
+            if use_async:
+                asyncio.run(g.generate_diverse_training_data_async(max_concurrency=4, **kwargs))
+            else:
+                g.generate_diverse_training_data(**kwargs)
+            assert read_output(output_dir) == reference, (use_async, stream_output)
+
+
+def test_resume_regenerates_unjournaled_cells(reference_output, tmp_path):
+    output_dir = tmp_path / "run"
+    g.generate_diverse_training_data(**generation_kwargs(output_dir))
+    # Crash after two checkpointed cells, halfway through the third
+    journal_path = str(output_dir / "out.json.journal.jsonl")
+    with open(journal_path, encoding="utf-8") as f:
+        lines = f.readlines()
+    with open(journal_path, "w", encoding="utf-8") as f:
+        f.writelines(lines[:2])
+    with open(output_dir / "out.json", "r+b") as f:
+        f.truncate(json.loads(lines[2])["end_offset"] - 10)
+    os.remove(str(output_dir / "out.json.manifest.json"))
+
+    g.generate_diverse_training_data(**generation_kwargs(output_dir))
+    assert read_output(output_dir) == reference_output
+    assert g.extract_max_id_from_file(str(output_dir / "out.json"), "X") == 23
+
+
+@pytest.mark.parametrize("mock_server", [MockLLMConfig(latency="constant", latency_mean=0.0, short_response_rate=1.0)],
+                         indirect=True)
+def test_top_up_rounds_fill_short_cells(mock_server, tmp_path):
+    g.generate_diverse_training_data(**generation_kwargs(tmp_path / "topped", top_up_rounds=3))
+    journal = CellJournal(str(tmp_path / "topped" / "out.json"))
+    assert 12 < len(record_ids(read_output(tmp_path / "topped"))) < 24
+    assert all(journal.filled_count(cell) <= 4 for cell in journal.entries)
+
+    # A rerun into the same directory requests the missing records of the journaled
+    # short cells, with or without top-up rounds
+    for top_up_rounds in (0, 3):
+        output_dir = tmp_path / f"short-{top_up_rounds}"
+        mock_server.config.short_response_rate = 1.0
+        g.generate_diverse_training_data(**generation_kwargs(output_dir))
+        assert len(record_ids(read_output(output_dir))) == 12
+        mock_server.config.short_response_rate = 0.0
+        g.generate_diverse_training_data(**generation_kwargs(output_dir, top_up_rounds=top_up_rounds))
+        assert record_ids(read_output(output_dir)) == [f"X_{i}" for i in range(24)]
+        journal = CellJournal(str(output_dir / "out.json"))
+        assert all(journal.filled_count(cell) == 4 for cell in journal.entries)
+
+
+def test_total_target_splits_quota(mock_server, tmp_path):
+    g.generate_diverse_training_data(**generation_kwargs(tmp_path / "run", total_target=10))
+    journal = CellJournal(str(tmp_path / "run" / "out.json"))
+    assert sorted(journal.filled_count(cell) for cell in journal.entries) == [1, 1, 2, 2, 2, 2]
+    assert len(record_ids(read_output(tmp_path / "run"))) == 10
+
+
+def test_shards_stay_in_their_id_ranges(mock_server, tmp_path):
+    specs = g.plan_generation_shards(2, PARAM_RECIPES, STYLE_RECIPES, 4)
+    for spec in specs:
+        g.run_generation_shard(spec, use_async=False, **generation_kwargs(tmp_path))
+        shard_ids = record_ids(read_output(tmp_path, g.shard_filename("out.json", spec.index, spec.count)))
+        numbers = [int(record_id.split("_")[-1]) for record_id in shard_ids]
+        assert numbers == list(range(spec.start_id, spec.end_id))
+    assert merge_shards(str(tmp_path), "out.json", "X", specs)["gaps"] == []
+    assert record_ids(read_output(tmp_path)) == [f"X_{i}" for i in range(24)]
+
+
+@pytest.mark.parametrize("mock_server", [MockLLMConfig(latency="constant", latency_mean=0.0, server_error_rate=1.0)],
+                         indirect=True)
+def test_failed_cells_are_dead_lettered_and_replayed(mock_server, tmp_path):
+    g.generate_diverse_training_data(**generation_kwargs(tmp_path))
+    dead_letters = DeadLetterFile(dead_letter_path(str(tmp_path / "out.json")))
+    assert len(dead_letters.entries()) == 6
+    assert not os.path.exists(tmp_path / "out.json") or read_output(tmp_path) == ""
+
+    mock_server.config.server_error_rate = 0.0
+    g.generate_diverse_training_data(**generation_kwargs(tmp_path, replay_failed=True))
+    assert dead_letters.entries() == {}
+    assert len(record_ids(read_output(tmp_path))) == 24
+
+
+def test_unparsable_response_is_inconclusive(tmp_path):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.0)
+    breaker.record_failure()
+    limiter = AdaptiveRateLimiter(base_delay=0.001)
+    limiter.rate_scale = 0.5
+    call = g.StructuredCall("prompt", g.QueryList, model_name="mock", rate_limiter=limiter,
+                            cache=ResponseCache(mode="bypass"), metrics=CallMetrics(), circuit_breaker=breaker)
+    assert breaker.wait() == 0  # This call is the half-open probe
+    with pytest.raises(ValueError):
+        call.succeed(None, None)
+    # Neither the breaker nor the limiter counts the attempt as a success
+    assert breaker.state == "half_open"
+    assert limiter.rate_scale == 0.5
+    call.succeed(g.QueryList(queries=["q"]), None)
+    assert breaker.state == "closed"
+
+
+def _pack_writer(tmp_path, deduplicator=None, tracker=None):
+    output = str(tmp_path / "out.json")
+    pack = g.list_grid_cells(PARAM_RECIPES[:2], STYLE_RECIPES[:1], "X", 4)
+    f = open(output, "w", encoding="utf-8")
+    writer = g.StreamingPackWriter(f, CellJournal(output), pack, 0, "X", g.PackingStats(),
+                                   deduplicator=deduplicator, tracker=tracker)
+    return f, writer, pack
+
+
+def test_streaming_writer_buffers_later_cells_and_resets(tmp_path):
+    deduplicator = NearDuplicateFilter()
+    f, writer, pack = _pack_writer(tmp_path, deduplicator)
+    writer.add(1, ["Which minerals are trigonal and contain copper?"])
+    writer.add(0, ["List minerals harder than 6 on the Mohs scale.", "Show minerals that include iron and sulfur."])
+    assert f.tell() > 0
+    assert deduplicator.kept == 2
+
+    # A failed attempt: the head cell's records and the later buffers are taken back
+    writer.reset_attempt()
+    assert f.tell() == 0
+    assert deduplicator.kept == 0
+    assert writer.buffers == [[], []]
+
+    writer.add(0, ["List minerals harder than 6 on the Mohs scale."])
+    writer.close_cell(0)
+    writer.add(1, ["Which minerals are trigonal and contain copper?"])
+    assert writer.finish() == 2
+    f.close()
+    journal = CellJournal(str(tmp_path / "out.json"))
+    assert [journal.filled_count(grid_cell.cell) for grid_cell in pack] == [1, 1]
+    assert record_ids(read_output(tmp_path)) == ["X_0", "X_1"]
+
+
+def test_streaming_writer_abandon_keeps_finished_cells(tmp_path):
+    tracker = QuotaTracker({cell: 1 for cell in (grid_cell.cell for grid_cell in
+                                                 g.list_grid_cells(PARAM_RECIPES[:2], STYLE_RECIPES[:1], "X", 4))})
+    f, writer, pack = _pack_writer(tmp_path, tracker=tracker)
+    # The quota caps the head cell at one record
+    writer.add(0, ["First query about quartz.", "Second query about calcite."])
+    writer.close_cell(0)
+    writer.add(1, ["A query that is never finished."])
+    assert writer.abandon() == 1
+    f.close()
+    journal = CellJournal(str(tmp_path / "out.json"))
+    assert journal.is_complete(pack[0].cell, 1)
+    assert not journal.is_complete(pack[1].cell, 1)
+    assert record_ids(read_output(tmp_path)) == ["X_0"]
+    assert tracker.unmet() == {pack[1].cell: 1}
+
+
+def _batch_result(custom_id, queries, status_code=200):
+    content = json.dumps({"queries": queries})
+    return {"custom_id": custom_id, "error": None,
+            "response": {"status_code": status_code, "body": {"choices": [{"message": {"content": content}}]}}}
+
+
+def test_batch_ingest_validates_custom_ids_and_trims(tmp_path, capsys):
+    kwargs = dict(prompt_path=PROMPT_PATH, output_dir=str(tmp_path), output_filename="out.json",
+                  param_recipes=PARAM_RECIPES, style_recipes=STYLE_RECIPES, id_prefix="X",
+                  num_queries_per_combination=2)
+    requests_path = str(tmp_path / "requests.jsonl")
+    assert g.write_batch_requests(requests_path=requests_path, model_name="mock", **kwargs) == 6
+    with open(requests_path, encoding="utf-8") as f:
+        custom_ids = [json.loads(line)["custom_id"] for line in f]
+
+    results = [
+        _batch_result(custom_ids[3], ["d1", "d2", "d3"]),
+        _batch_result(custom_ids[0], ["a1", "a2"]),
+        _batch_result(custom_ids[1], [], status_code=500),
+        _batch_result(custom_ids[2].replace("X-", "Other-", 1), ["foreign"]),
+    ]
+    results_path = str(tmp_path / "results.jsonl")
+    with open(results_path, "w", encoding="utf-8") as f:
+        f.writelines(json.dumps(result) + "\n" for result in results)
+    g.ingest_batch_results(results_path=results_path, **kwargs)
+    assert "Ignoring 1 results" in capsys.readouterr().out
+
+    records = [json.loads(line) for line in read_output(tmp_path).splitlines()]
+    assert [record["question"][0][0]["content"] for record in records] == ["a1", "a2", "d1", "d2"]
+    assert [record["id"] for record in records] == ["X_0", "X_1", "X_2", "X_3"]
+    # Only the cells still missing are requested again
+    assert g.write_batch_requests(requests_path=requests_path, model_name="mock", **kwargs) == 4
+
+
+def test_batch_tops_up_partial_cells(tmp_path):
+    kwargs = dict(prompt_path=PROMPT_PATH, output_dir=str(tmp_path), output_filename="out.json",
+                  param_recipes=PARAM_RECIPES, style_recipes=STYLE_RECIPES, id_prefix="X",
+                  num_queries_per_combination=2)
+    requests_path = str(tmp_path / "requests.jsonl")
+    g.write_batch_requests(requests_path=requests_path, model_name="mock", **kwargs)
+    with open(requests_path, encoding="utf-8") as f:
+        custom_ids = [json.loads(line)["custom_id"] for line in f]
+    results_path = str(tmp_path / "results.jsonl")
+    with open(results_path, "w", encoding="utf-8") as f:
+        f.write(json.dumps(_batch_result(custom_ids[0], ["a1"])) + "\n")
+    g.ingest_batch_results(results_path=results_path, **kwargs)
+    # Ingesting the same results again does not duplicate the cell's records
+    g.ingest_batch_results(results_path=results_path, **kwargs)
+    assert record_ids(read_output(tmp_path)) == ["X_0"]
+
+    # The short cell asks for its one missing query with a follow-up request
+    assert g.write_batch_requests(requests_path=requests_path, model_name="mock", **kwargs) == 6
+    with open(requests_path, encoding="utf-8") as f:
+        request = json.loads(f.readline())
+    assert request["custom_id"] == custom_ids[0] + "-a1"
+    assert "follow-up request 1" in request["body"]["messages"][0]["content"]
+    with open(results_path, "w", encoding="utf-8") as f:
+        f.write(json.dumps(_batch_result(request["custom_id"], ["a2", "a3"])) + "\n")
+    g.ingest_batch_results(results_path=results_path, **kwargs)
+    records = [json.loads(line) for line in read_output(tmp_path).splitlines()]
+    assert [record["question"][0][0]["content"] for record in records] == ["a1", "a2"]
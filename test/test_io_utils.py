@@ -0,0 +1,56 @@
+import json
+
+from io_utils import BFCLRecord, JSONLWriter, dumps_line, iter_jsonl, loads, read_jsonl, write_jsonl
+
+RECORDS = [
+    {"id": "X_0", "question": [[{"role": "user", "content": "Minerale mit Härte über 5 — bitte"}]]},
+    {"id": "X_1", "ground_truth": [{"f": {"hardness_min": [5.0, 5], "ima": [True], "el_inc": [["Fe"], ""]}}]},
+    {"id": "X_2", "big": 2 ** 70, "nan": float("nan")},
+]
+
+
+def test_dumps_line_matches_json_dumps():
+    for record in RECORDS:
+        assert dumps_line(record) == json.dumps(record, ensure_ascii=False)
+
+
+def test_loads_accepts_str_bytes_and_json_extensions():
+    assert loads('{"a": 1}') == {"a": 1}
+    assert loads(b'{"a": [1.5]}') == {"a": [1.5]}
+    # orjson rejects these, the json module takes over
+    assert loads('{"big": 1180591620717411303424}')["big"] == 2 ** 70
+    assert loads('[NaN]')[0] != loads('[NaN]')[0]
+
+
+def test_write_and_read_roundtrip_is_byte_identical(tmp_path):
+    path = str(tmp_path / "records.jsonl")
+    assert write_jsonl(path, RECORDS[:2]) == 2
+    with open(path, encoding="utf-8") as f:
+        assert f.read() == "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in RECORDS[:2])
+    assert read_jsonl(path) == RECORDS[:2]
+
+
+def test_writer_appends_and_skips_blank_lines(tmp_path):
+    path = str(tmp_path / "nested" / "records.jsonl")
+    with JSONLWriter(path, buffer_records=1) as writer:
+        writer.write(RECORDS[0])
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("\n")
+    write_jsonl(path, [RECORDS[1]], mode="a")
+    assert [record["id"] for record in iter_jsonl(path)] == ["X_0", "X_1"]
+
+
+def test_typed_records_roundtrip(tmp_path):
+    path = str(tmp_path / "records.jsonl")
+    write_jsonl(path, RECORDS)
+    records = read_jsonl(path, typed=True)
+    assert [record.number for record in records] == [0, 1, 2]
+    assert records[0].query == RECORDS[0]["question"][0][0]["content"]
+    assert records[1].ground_truth == RECORDS[1]["ground_truth"] and records[1].extra is None
+    assert list(records[2].extra) == ["big", "nan"] and records[2].extra["big"] == 2 ** 70
+
+    copy = str(tmp_path / "copy.jsonl")
+    write_jsonl(copy, records)
+    with open(path, encoding="utf-8") as f, open(copy, encoding="utf-8") as g:
+        assert f.read() == g.read()
+    assert BFCLRecord.from_dict({"id": "X_3"}).query is None
@@ -0,0 +1,86 @@
+import json
+import os
+
+import pytest
+
+from quota import QuotaTracker, apportion, grid_targets
+from sharding import load_plan, merge_shards, parse_shard_arg, plan_shards, save_plan, shard_filename
+
+
+def test_apportion_sums_to_total():
+    shares = apportion(10, [1, 1, 1])
+    assert sum(shares) == 10
+    assert shares == [4, 3, 3]
+    with pytest.raises(ValueError):
+        apportion(5, [0, 0])
+
+
+def test_grid_targets_weights():
+    assert grid_targets(2, 2, per_cell=3) == {(0, 0): 3, (0, 1): 3, (1, 0): 3, (1, 1): 3}
+    targets = grid_targets(2, 1, total=9, param_weights=[2, 1])
+    assert targets == {(0, 0): 6, (1, 0): 3}
+    with pytest.raises(ValueError):
+        grid_targets(2, 2)
+
+
+def test_quota_tracker_gaps():
+    tracker = QuotaTracker({"a": 5, "b": 3}, {"a": 2, "b": 4})
+    assert tracker.gap("a") == 3
+    assert tracker.gap("b") == 0
+    assert tracker.unmet() == {"a": 3}
+    tracker.add("a", 3)
+    assert tracker.summary() == {"cells": 2, "target": 8, "filled": 8, "short_cells": 0, "shortfall": 0}
+    assert tracker.restrict(["b"]).targets == {"b": 3}
+
+
+def test_plan_shards_reserves_disjoint_ranges():
+    targets = grid_targets(3, 3, per_cell=4)
+    specs = plan_shards(targets, 4, start_id=100)
+    assert specs[0].start_id == 100
+    for previous, spec in zip(specs, specs[1:]):
+        assert previous.end_id == spec.start_id
+    assert specs[-1].end_id == 100 + 36
+    assert sorted(cell for spec in specs for cell in spec.cells) == sorted(targets)
+    for spec in specs:
+        assert spec.end_id - spec.start_id == sum(targets[cell] for cell in spec.cells)
+
+
+def test_parse_shard_arg():
+    assert parse_shard_arg("1/4") == (1, 4)
+    with pytest.raises(ValueError):
+        parse_shard_arg("4/4")
+    with pytest.raises(ValueError):
+        parse_shard_arg("a/b")
+
+
+def _write_shard(directory, spec, numbers):
+    path = os.path.join(directory, shard_filename("out.json", spec.index, spec.count))
+    with open(path, "w", encoding="utf-8") as f:
+        for number in numbers:
+            f.write(json.dumps({"id": f"X_{number}"}) + "\n")
+
+
+def test_merge_shards_checks_ranges_and_renumbers(tmp_path):
+    directory = str(tmp_path)
+    specs = plan_shards({(0, 0): 2, (0, 1): 2}, 2)
+    save_plan(os.path.join(directory, "out.json"), specs)
+    assert load_plan(os.path.join(directory, "out.json")) == specs
+
+    _write_shard(directory, specs[0], [0, 1])
+    _write_shard(directory, specs[1], [2, 3])
+    report = merge_shards(directory, "out.json", "X")
+    assert report == {"records": 4, "first_id": 0, "gaps": [], "renumbered": False}
+
+    # A short shard leaves a gap: rejected unless renumbered
+    _write_shard(directory, specs[0], [0])
+    with pytest.raises(ValueError, match="ID gaps"):
+        merge_shards(directory, "out.json", "X")
+    report = merge_shards(directory, "out.json", "X", renumber=True)
+    assert report["renumbered"]
+    with open(os.path.join(directory, "out.json"), encoding="utf-8") as f:
+        assert [json.loads(line)["id"] for line in f] == ["X_0", "X_1", "X_2"]
+
+    # IDs outside the shard's reserved range are an error
+    _write_shard(directory, specs[0], [0, 2])
+    with pytest.raises(ValueError, match="outside the shard's range"):
+        merge_shards(directory, "out.json", "X")
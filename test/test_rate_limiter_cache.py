@@ -0,0 +1,86 @@
+import pytest
+from pydantic import BaseModel
+
+from llm_cache import CacheMissError, ResponseCache, make_cache_key
+from rate_limiter import AdaptiveRateLimiter, get_retry_after, is_rate_limit_error
+
+
+class StatusError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+        self.response = type("Response", (), {"status_code": status_code, "headers": headers or {}})()
+
+
+class Queries(BaseModel):
+    queries: list
+
+
+def test_rate_limit_errors():
+    error = StatusError(429, {"retry-after": "2"})
+    assert is_rate_limit_error(error)
+    assert get_retry_after(error) == 2.0
+    assert not is_rate_limit_error(StatusError(500))
+
+
+def test_limiter_spaces_requests_past_the_burst():
+    limiter = AdaptiveRateLimiter(requests_per_minute=600, burst_seconds=0.1)
+    assert limiter.acquire() == 0
+    # The one-request burst is used up: the next request waits about 60 / 600 seconds
+    assert limiter._reserve(0) == pytest.approx(0.1, abs=0.02)
+
+
+def test_rate_limit_lowers_rate_and_blocks():
+    limiter = AdaptiveRateLimiter(base_delay=0.01, recovery_interval=0.0, recovery_step=0.25)
+    delay = limiter.record_rate_limit(retry_after=0.05)
+    assert delay >= 0.05
+    assert limiter.rate_scale == 0.5
+    assert limiter.acquire() > 0
+    limiter.record_success()
+    assert limiter.rate_scale == 0.75
+    assert limiter.stats()["rate_limit_hits"] == 1
+
+
+def test_token_reservations_are_refunded():
+    limiter = AdaptiveRateLimiter(tokens_per_minute=6000, burst_seconds=10)
+    assert limiter.acquire(tokens=1000) == 0
+    limiter.record_success(tokens_used=200, tokens_reserved=1000)
+    assert limiter._token_level == pytest.approx(800, abs=1)
+
+
+def test_backoff_delay_respects_retry_after():
+    limiter = AdaptiveRateLimiter(base_delay=0.01, max_delay=0.02)
+    assert 0 <= limiter.backoff_delay(10) <= 0.02
+    assert limiter.backoff_delay(0, retry_after=3) == 3
+
+
+def test_cache_key_covers_request_arguments():
+    key = make_cache_key("prompt", "model", 1.0, 100, Queries)
+    assert key == make_cache_key("prompt", "model", 1.0, 100, Queries)
+    assert key != make_cache_key("prompt", "model", 0.5, 100, Queries)
+    assert key != make_cache_key("prompt", "model", 1.0, 100, None)
+    assert key != make_cache_key("prompt", "model", 1.0, 100, Queries, cells=2)
+
+
+def test_cache_modes_and_lru_eviction(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = ResponseCache(path, max_entries=2)
+    cache.put("a", {"queries": ["1"]})
+    cache.put("b", {"queries": ["2"]})
+    assert cache.get("a") == {"queries": ["1"]}
+    cache.put("c", {"queries": ["3"]})  # Evicts b, the least recently used
+    assert cache.get("b") is None
+    assert cache.stats() == {"mode": "readwrite", "hits": 1, "misses": 1, "evictions": 1, "entries": 2}
+    cache.close()
+
+    replay = ResponseCache(path, mode="replay")
+    assert replay.get("c") == {"queries": ["3"]}
+    replay.put("d", {})
+    with pytest.raises(CacheMissError):
+        replay.get("d")
+    replay.close()
+
+    bypass = ResponseCache(path, mode="bypass")
+    assert bypass.get("a") is None
+    with pytest.raises(ValueError):
+        ResponseCache(path, mode="other")
@@ -0,0 +1,57 @@
+import json
+
+from generate_instruction_v8 import FIXED_FUNCTION_SCHEMA
+from rule_validator import RULES, RuleValidator, count_violations, validate_file
+
+CASES = [
+    {"hardness_min": 4.0, "hardness_max": 6.0, "ima": True},
+    {"hardness_min": 7, "hardness_max": 3, "foo": 1},
+    {"hardness_min": 11},
+    {"crystal_system": ["Cubic", "Trigonal"]},
+    {"el_inc": "Fe,Xx", "el_exc": "iron"},
+    {"mindat_geomaterial": {"ima": "yes"}},
+    [1],
+]
+
+
+def _rules(violations):
+    return [violation.rule for violation in violations]
+
+
+def test_validate_rules():
+    validator = RuleValidator(FIXED_FUNCTION_SCHEMA)
+    results = [validator.validate(arguments) for arguments in CASES]
+    assert results[0] == []
+    assert _rules(results[1]) == ["rule_schema", "rule_hardness_range"]
+    assert results[2][0].message == "hardness_min 11 is outside [1, 10]"
+    assert _rules(results[3]) == ["rule_crystal_system"]
+    assert _rules(results[4]) == ["rule_chemical_element", "rule_element_conflict"]
+    assert results[5][0].field == "ima"
+    assert results[6][0].message == "arguments must be an object"
+
+
+def test_validate_many_matches_validate():
+    validator = RuleValidator(FIXED_FUNCTION_SCHEMA)
+    assert validator.validate_many(CASES) == [validator.validate(arguments) for arguments in CASES]
+
+
+def test_count_violations():
+    validator = RuleValidator(FIXED_FUNCTION_SCHEMA)
+    counts = count_violations(validator.validate_many(CASES))
+    assert list(counts) == list(RULES)
+    assert counts["rule_schema"] == 3
+    assert counts["rule_hardness_range"] == 2
+
+
+def test_validate_file(tmp_path):
+    input_path = tmp_path / "arguments.jsonl"
+    output_path = tmp_path / "violations.jsonl"
+    input_path.write_text("".join(
+        json.dumps({"id": f"X_{i}", "arguments": arguments}) + "\n" for i, arguments in enumerate(CASES[:3])
+    ))
+    report = validate_file(str(input_path), str(output_path), arguments_key="arguments", batch_size=2)
+    assert report["lines"] == 3
+    assert report["valid"] == 1
+    lines = [json.loads(line) for line in output_path.read_text().splitlines()]
+    assert [line["valid"] for line in lines] == [True, False, False]
+    assert lines[1]["id"] == "X_1"
@@ -19,7 +19,7 @@ from typing import Dict, Optional, Sequence
 
 import torch
 import transformers
-import utils
+import io_utils
 from torch.utils.data import Dataset
 from transformers import Trainer
 
@@ -130,15 +130,29 @@ class SupervisedDataset(Dataset):
     def __init__(self, data_path: str, tokenizer: transformers.PreTrainedTokenizer):
         super(SupervisedDataset, self).__init__()
         logging.warning("Loading data...")
-        list_data_dict = utils.jload(data_path)
-
-        logging.warning("Formatting inputs...")
         prompt_input, prompt_no_input = PROMPT_DICT["prompt_input"], PROMPT_DICT["prompt_no_input"]
-        sources = [
-            prompt_input.format_map(example) if example.get("input", "") != "" else prompt_no_input.format_map(example)
-            for example in list_data_dict
-        ]
-        targets = [f"{example['output']}{tokenizer.eos_token}" for example in list_data_dict]
+        if data_path.endswith((".arrow", ".parquet")):
+            # Arrow/Parquet data (see columnar.export_rows): read three columns, no per-example dicts
+            import columnar  # needs the optional pyarrow dependency
+
+            columns = columnar.load_columns(data_path, ["instruction", "input", "output"])
+
+            logging.warning("Formatting inputs...")
+            sources = [
+                prompt_input.format(instruction=instruction, input=input_text) if input_text
+                else prompt_no_input.format(instruction=instruction)
+                for instruction, input_text in zip(columns["instruction"], columns["input"])
+            ]
+            targets = [f"{output}{tokenizer.eos_token}" for output in columns["output"]]
+        else:
+            list_data_dict = io_utils.jload(data_path)
+
+            logging.warning("Formatting inputs...")
+            sources = [
+                prompt_input.format_map(example) if example.get("input", "") != "" else prompt_no_input.format_map(example)
+                for example in list_data_dict
+            ]
+            targets = [f"{example['output']}{tokenizer.eos_token}" for example in list_data_dict]
 
         logging.warning("Tokenizing inputs... This may take some time...")
         data_dict = preprocess(sources, targets, tokenizer)
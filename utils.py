@@ -1,31 +1,33 @@
+import concurrent.futures
 import dataclasses
 import logging
-import math
-import os
-import io
 import sys
 import time
-import json
+import types
 from typing import Optional, Sequence, Union
-from openai import AzureOpenAI
-import tqdm
-import copy
-from dotenv import load_dotenv
-
-load_dotenv(override=True)
+from failures import (
+    PERMANENT,
+    REDUCE_LENGTH,
+    CircuitBreaker,
+    DeadLetterFile,
+    RequestFailedError,
+    classify_error,
+    get_shared_circuit_breaker,
+)
+from io_utils import jdump, jload  # noqa: F401  (re-exported for existing callers)
+from llm_cache import ResponseCache, get_shared_cache, make_cache_key
+from llm_client import get_client
+from metrics import CallMetrics, CallTimer, get_shared_metrics
+from rate_limiter import (
+    AdaptiveRateLimiter,
+    estimate_request_tokens,
+    get_retry_after,
+    get_shared_rate_limiter,
+    is_rate_limit_error,
+)
 
 StrOrOpenAIObject = Union[str, dict]
 
-azure_endpoint = os.getenv("AZURE_OPENAI_API_ENDPOINT")
-api_version = os.getenv("AZURE_OPENAI_API_VERSION")
-deployment_name = os.getenv("AZURE_DEPLOYMENT_NAME")
-
-client = AzureOpenAI(
-    azure_endpoint=azure_endpoint,
-    api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-    api_version=api_version,
-)
-
 
 @dataclasses.dataclass
 class OpenAIDecodingArguments(object):
@@ -49,9 +51,49 @@ def openai_completion(
     max_instances=sys.maxsize,
     max_batches=sys.maxsize,
     return_text=False,
+    rate_limiter: Optional[AdaptiveRateLimiter] = None,
+    cache: Optional[ResponseCache] = None,
+    metrics: Optional[CallMetrics] = None,
+    max_retries: int = 10,
+    circuit_breaker: Optional[CircuitBreaker] = None,
+    dead_letters: Optional[DeadLetterFile] = None,
     **decoding_kwargs,
 ):
-    is_single_prompt = isinstance(prompts, (str, dict, list)) and not isinstance(prompts[0], (list, dict))
+    """
+    Decode prompts with the chat completions API.
+
+    Every prompt is sent as its own request; `batch_size` requests run concurrently on a
+    thread pool and the results come back in prompt order. Each request is retried on its
+    own, so one throttled or failing prompt does not hold back or repeat the others.
+    Prompts that fail permanently or run out of retries come back as None (and are
+    appended to `dead_letters` if given) instead of stopping the whole job.
+
+    Args:
+        prompts: A prompt string, a single message dict, a message list (one conversation),
+            or a list of prompt strings / message lists
+        decoding_args: Decoding arguments sent with every request (max_tokens, n, ...)
+        model_name: Model / deployment name
+        sleep_time: Base backoff delay in seconds for failed requests
+        batch_size: Number of requests in flight at once
+        max_instances: Maximum number of prompts to decode
+        max_batches: Deprecated, use max_instances
+        return_text: Return completion texts instead of choice objects
+        rate_limiter: Limiter shared with other callers (defaults to the process-wide one)
+        cache: Response cache (defaults to the process-wide one)
+        metrics: Call metrics collector (defaults to the process-wide one)
+        max_retries: Retries per prompt after retryable or context-length failures
+        circuit_breaker: Breaker that pauses dispatch while the endpoint is failing
+            (defaults to the process-wide one)
+        dead_letters: Dead-letter file recording failed prompts with their messages
+        **decoding_kwargs: Extra arguments passed through to chat.completions.create
+
+    Returns:
+        One completion per prompt (a list of n completions per prompt when n > 1, None for
+        a failed prompt); a single result instead of a list when a single prompt was given
+    """
+    is_single_prompt = isinstance(prompts, (str, dict)) or (
+        isinstance(prompts, (list, tuple)) and len(prompts) > 0 and isinstance(prompts[0], dict)
+    )
     if is_single_prompt:
         prompts = [prompts]
 
@@ -63,113 +105,192 @@ def openai_completion(
         max_instances = max_batches * batch_size
 
     prompts = prompts[:max_instances]
-    num_prompts = len(prompts)
-    prompt_batches = [
-        prompts[batch_id * batch_size : (batch_id + 1) * batch_size]
-        for batch_id in range(int(math.ceil(num_prompts / batch_size)))
-    ]
-
-    completions = []
-    for batch_id, prompt_batch in tqdm.tqdm(
-        enumerate(prompt_batches),
-        desc="prompt_batches",
-        total=len(prompt_batches),
-    ):
-        batch_decoding_args = copy.deepcopy(decoding_args)
-
-        while True:
-            try:
-                shared_kwargs = dict(
-                    model=model_name,
-                    **batch_decoding_args.__dict__,
-                    **decoding_kwargs,
-                )
-
-                if isinstance(prompt_batch[0], list):
-                    messages = prompt_batch[0]  # 已是消息列表时直接使用
-                elif isinstance(prompt_batch[0], str):
-                    messages = [{"role": "user", "content": prompt} for prompt in prompt_batch]
-                else:
-                    raise ValueError(f"Unexpected prompt format: {type(prompt_batch[0])}")
-
-                completion_batch = client.chat.completions.create(
-                    messages=messages,
-                    model=model_name,  # 必须明确指定
-                )
-                choices = completion_batch.choices
-
-                for choice in choices:
-                    choice.total_tokens = completion_batch.usage.total_tokens
-                    choice.text = choice.message.content
-                completions.extend(choices)
-                break
-            except Exception as e:
-                logging.warning(f"OpenAIError: {e}.")
-                if "Please reduce your prompt" in str(e):
-                    batch_decoding_args.max_tokens = int(batch_decoding_args.max_tokens * 0.8)
-                    logging.warning(f"Reducing target length to {batch_decoding_args.max_tokens}, Retrying...")
-                else:
-                    logging.warning("Hit request rate limit; retrying...")
-                    time.sleep(sleep_time)
+    limiter = rate_limiter or get_shared_rate_limiter()
+    response_cache = cache or get_shared_cache()
+    call_metrics = metrics or get_shared_metrics()
+    breaker = circuit_breaker or get_shared_circuit_breaker()
+    request_kwargs = _request_kwargs(decoding_args, decoding_kwargs)
+
+    def complete(index, prompt):
+        messages = _to_messages(prompt)
+        try:
+            return _complete_one(
+                messages, model_name, request_kwargs, sleep_time, max_retries,
+                limiter, breaker, response_cache, call_metrics
+            )
+        except RequestFailedError as e:
+            logging.warning(f"Prompt {index} failed: {e}")
+            if dead_letters is not None:
+                dead_letters.record(str(index), e, messages=messages, model=model_name)
+            return None
+
+    import tqdm
+
+    progress = tqdm.tqdm(desc="prompts", total=len(prompts))
+    if batch_size <= 1:
+        results = []
+        for index, prompt in enumerate(prompts):
+            results.append(complete(index, prompt))
+            progress.update()
+    else:
+        results = [None] * len(prompts)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=batch_size) as executor:
+            futures = {executor.submit(complete, index, prompt): index for index, prompt in enumerate(prompts)}
+            for future in concurrent.futures.as_completed(futures):
+                results[futures[future]] = future.result()
+                progress.update()
+    progress.close()
+
+    logging.info(f"Rate limiter stats: {limiter.stats()}")
+    logging.info(f"Response cache stats: {response_cache.stats()}")
+    logging.info(f"Call metrics: {call_metrics.stats()}")
+    failed = sum(choices is None for choices in results)
+    if failed:
+        logging.warning(
+            f"{failed} of {len(results)} prompts failed"
+            + (f"; see {dead_letters.path}" if dead_letters is not None else "")
+        )
 
     if return_text:
-        completions = [completion.text for completion in completions]
+        results = [None if choices is None else [choice.text for choice in choices] for choices in results]
     if decoding_args.n > 1:
-        completions = [completions[i : i + decoding_args.n] for i in range(0, len(completions), decoding_args.n)]
+        completions = results
+    else:
+        completions = [None if choices is None else choices[0] for choices in results]
     if is_single_prompt:
         (completions,) = completions
     return completions
 
 
-def _make_w_io_base(f, mode: str):
-    if not isinstance(f, io.IOBase):
-        f_dirname = os.path.dirname(f)
-        if f_dirname != "":
-            os.makedirs(f_dirname, exist_ok=True)
-        f = open(f, mode=mode)
-    return f
+def _to_messages(prompt) -> list:
+    """Message list for one prompt: a string, a single message dict or a message list."""
+    if isinstance(prompt, str):
+        return [{"role": "user", "content": prompt}]
+    if isinstance(prompt, dict):
+        return [prompt]
+    if isinstance(prompt, (list, tuple)) and all(isinstance(message, dict) for message in prompt):
+        return list(prompt)
+    raise ValueError(f"Unexpected prompt format: {type(prompt)}")
 
 
-def _make_r_io_base(f, mode: str):
-    if not isinstance(f, io.IOBase):
-        f = open(f, mode=mode)
-    return f
+def _request_kwargs(decoding_args: OpenAIDecodingArguments, decoding_kwargs: dict) -> dict:
+    """chat.completions.create arguments for the decoding args (None fields are left out)."""
+    kwargs = {
+        key: value for key, value in dataclasses.asdict(decoding_args).items()
+        if value is not None and key not in ("stream", "logprobs")
+    }
+    if decoding_args.stream:
+        logging.warning("openai_completion does not stream; ignoring stream=True.")
+    if decoding_args.logprobs is not None:
+        # Completions-style integer logprobs map to the chat API's top_logprobs
+        kwargs.update(logprobs=True, top_logprobs=decoding_args.logprobs)
+    kwargs.update(decoding_kwargs)
+    return kwargs
 
 
-def jdump(obj, f, mode="w", indent=4, default=str):
-    """Dump a str or dictionary to a file in json format.
+def _complete_one(
+    messages: list,
+    model_name: str,
+    request_kwargs: dict,
+    sleep_time: float,
+    max_retries: int,
+    limiter: AdaptiveRateLimiter,
+    breaker: CircuitBreaker,
+    response_cache: ResponseCache,
+    call_metrics: CallMetrics,
+) -> list:
+    """
+    Send one prompt, retrying retryable and context-length failures.
 
-    Args:
-        obj: An object to be written.
-        f: A string path to the location on disk.
-        mode: Mode for opening the file.
-        indent: Indent for storing json dictionaries.
-        default: A function to handle non-serializable entries; defaults to `str`.
+    Returns:
+        The completion's choices (n of them)
+
+    Raises:
+        RequestFailedError: If the request failed permanently or ran out of retries
     """
-    f = _make_w_io_base(f, mode)
-    if isinstance(obj, (dict, list)):
-        json.dump(obj, f, indent=indent, default=default)
-    elif isinstance(obj, str):
-        f.write(obj)
-    else:
-        raise ValueError(f"Unexpected type: {type(obj)}")
-    f.close()
+    request_kwargs = dict(request_kwargs)
+    cache_kwargs = {key: value for key, value in request_kwargs.items() if key not in ("temperature", "max_tokens")}
+    cache_key = make_cache_key(
+        messages,
+        model_name,
+        request_kwargs.get("temperature"),
+        request_kwargs.get("max_tokens"),
+        **cache_kwargs,
+    )
+    timer = CallTimer(call_metrics, "openai_completion", model_name)
+    cached_choices = response_cache.get(cache_key)
+    if cached_choices is not None:
+        timer.finish(cache_hit=True)
+        return [_choice_from_cache(choice) for choice in cached_choices]
+
+    prompt_text = "".join(str(message.get("content", "")) for message in messages)
+    attempt = 0
+    while True:
+        timer.throttle_wait += breaker.wait()
+        reserved_tokens = estimate_request_tokens(prompt_text, request_kwargs.get("max_tokens") or 0)
+        timer.throttle_wait += limiter.acquire(reserved_tokens)
+        try:
+            completion = get_client().chat.completions.create(
+                messages=messages,
+                model=model_name,
+                **request_kwargs,
+            )
+            limiter.record_success(completion.usage.total_tokens, reserved_tokens)
+            breaker.record_success()
+            choices = completion.choices
+            for choice in choices:
+                choice.total_tokens = completion.usage.total_tokens
+                choice.text = choice.message.content
+            response_cache.put(cache_key, [_choice_to_cache(choice) for choice in choices])
+            timer.finish(usage=completion.usage)
+            return choices
+        except Exception as e:
+            logging.warning(f"OpenAIError: {e}.")
+            category = classify_error(e)
+            breaker.record_outcome(e)
+            if category == PERMANENT or attempt >= max_retries:
+                timer.finish(success=False)
+                raise RequestFailedError(category, attempt + 1, e) from e
+            if category == REDUCE_LENGTH and request_kwargs.get("max_tokens"):
+                request_kwargs["max_tokens"] = int(request_kwargs["max_tokens"] * 0.8)
+                logging.warning(f"Reducing target length to {request_kwargs['max_tokens']}, Retrying...")
+            elif is_rate_limit_error(e):
+                delay = limiter.record_rate_limit(attempt, get_retry_after(e))
+                logging.warning(f"Hit request rate limit; retrying in {delay:.1f}s...")
+            else:
+                delay = limiter.backoff_delay(attempt, base_delay=sleep_time)
+                logging.warning(f"Request failed; retrying in {delay:.1f}s...")
+                limiter.record_backoff(delay)
+                time.sleep(delay)
+                timer.throttle_wait += delay
+            attempt += 1
+            timer.retries += 1
+
+
+def _choice_to_cache(choice) -> dict:
+    return {
+        "text": choice.text,
+        "total_tokens": choice.total_tokens,
+        "finish_reason": choice.finish_reason,
+    }
 
 
-def jload(f, mode="r"):
-    """Load a .json file into a dictionary."""
-    f = _make_r_io_base(f, mode)
-    jdict = json.load(f)
-    f.close()
-    return jdict
+def _choice_from_cache(cached: dict):
+    """Rebuild a choice-like object exposing the attributes openai_completion callers use."""
+    return types.SimpleNamespace(
+        text=cached["text"],
+        total_tokens=cached["total_tokens"],
+        finish_reason=cached["finish_reason"],
+        message=types.SimpleNamespace(role="assistant", content=cached["text"]),
+    )
 
 
 if __name__ == "__main__":
     pass
     # Test the connection with a simple prompt
     # try:
-    #     response = client.chat.completions.create(
-    #         model=deployment_name,
+    #     response = get_client().chat.completions.create(
+    #         model=get_deployment_name(),
     #         messages=[
     #             {"role": "system", "content": "You are a helpful assistant."},
     #             {"role": "user", "content": "Hello! Can you confirm you're working?"}